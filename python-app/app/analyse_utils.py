@@ -1,103 +1,104 @@
-import json
-import re
-import traceback
-from .db import get_db_connection
 from .funcs import parse_medical_text
+from . import repository
 
 async def reanalyze_all_saved_analyses(user_id: int):
     """Пересматривает все сохраненные анализы пользователя"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     try:
         # Получаем медицинские данные пользователя
-        cur.execute(
-            'SELECT contraindications, allergens FROM user_medical_data WHERE user_id = ?',
-            (user_id,)
-        )
-        medical_data = cur.fetchone()
+        medical_data = await repository.get_medical_data(user_id)
         
         if not medical_data:
             print(f"У пользователя {user_id} нет медицинских данных")
             return
         
-        # Получаем все сохраненные анализы пользователя
-        cur.execute('''
-            SELECT id, analysis_result 
-            FROM saved_analyses 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        analyses = cur.fetchall()
-        
         # Извлекаем аллергены и противопоказания
         allergens = parse_medical_text(medical_data['allergens'])
         contraindications = parse_medical_text(medical_data['contraindications'])
         
-        # Пересматриваем каждый анализ
-        for analysis in analyses:
-            try:
-                old_result = json.loads(analysis['analysis_result'])
-                
-                new_ingredients = []
-                new_warnings = []
-                new_warnings_count = 0
-                
-                # Анализируем ингредиенты с новыми медицинскими данными
-                for ingredient_data in old_result.get('ingredients', []):
-                    ingredient_name = ingredient_data.get('name', '')
-                    ingredient_lower = ingredient_name.lower()
-                    
-                    is_allergen = False
-                    is_contraindication = False
-                    
-                    # Проверяем на аллергены
-                    for allergen in allergens:
-                        if allergen and allergen in ingredient_lower:
-                            is_allergen = True
-                            break
-                    
-                    # Проверяем на противопоказания
-                    for contra in contraindications:
-                        if contra and contra in ingredient_lower:
-                            is_contraindication = True
-                            break
-                    
-                    new_ingredients.append({
-                        'name': ingredient_name,
-                        'is_allergen': is_allergen,
-                        'is_contraindication': is_contraindication
-                    })
-                    
-                    if is_allergen:
-                        new_warnings.append(f"Аллерген обнаружен: {ingredient_name}")
-                        new_warnings_count += 1
-                    if is_contraindication:
-                        new_warnings.append(f"Противопоказание: {ingredient_name}")
-                        new_warnings_count += 1
-                
-                # Обновляем анализ в базе
-                new_result = {
-                    "ingredients": new_ingredients,
-                    "warnings": new_warnings,
-                    "original_response": old_result.get('original_response', 
-                                                        'Перепроверено с обновленными медицинскими данными')
-                }
-                
-                cur.execute('''
-                    UPDATE saved_analyses 
-                    SET analysis_result = ?, warnings_count = ?
-                    WHERE id = ?
-                ''', (json.dumps(new_result), new_warnings_count, analysis['id']))
-                
-            except Exception as e:
-                print(f"Ошибка при пересмотре анализа {analysis['id']}: {e}")
-                continue
-        
-        conn.commit()
-        print(f"Пересмотрено {len(analyses)} анализов для пользователя {user_id}")
+        # Пересчитываем флаги всех анализов одной транзакцией в SQL
+        await repository.reanalyze_analyses(user_id, allergens, contraindications)
+        print(f"Пересмотрены анализы пользователя {user_id}")
         
     except Exception as e:
         print(f"Ошибка в reanalyze_all_saved_analyses: {e}")
-    finally:
-        conn.close()
\ No newline at end of file
+
+def medical_terms(medical_data) -> tuple:
+    """Аллергены и противопоказания пользователя для проверки ингредиентов"""
+    if not medical_data:
+        return [], []
+    return parse_medical_text(medical_data['allergens']), parse_medical_text(medical_data['contraindications'])
+
+def flag_ingredient(ingredient_item, allergens: list, contraindications: list) -> dict:
+    """Ингредиент (строка или словарь) с флагами is_allergen/is_contraindication"""
+    # Поддерживаем оба формата: строка или словарь
+    if isinstance(ingredient_item, str):
+        ingredient_name = ingredient_item
+        is_allergen = False
+        is_contraindication = False
+    else:
+        ingredient_name = ingredient_item.get('name', '')
+        is_allergen = ingredient_item.get('is_allergen', False)
+        is_contraindication = ingredient_item.get('is_contraindication', False)
+
+    ingredient_lower = ingredient_name.lower()
+
+    # Проверяем на аллергены (если не было уже помечено)
+    if not is_allergen:
+        for allergen in allergens:
+            if allergen and allergen in ingredient_lower:
+                is_allergen = True
+                break
+
+    # Проверяем на противопоказания
+    if not is_contraindication:
+        for contra in contraindications:
+            if contra and contra in ingredient_lower:
+                is_contraindication = True
+                break
+
+    return {
+        'name': ingredient_name,
+        'is_allergen': is_allergen,
+        'is_contraindication': is_contraindication
+    }
+
+def build_analysis_response(analysis_result: dict, medical_data) -> dict:
+    """
+    Ответ анализа изображения: ингредиенты распознавания с флагами
+    аллергенов и противопоказаний по медицинским данным пользователя
+    """
+    # Если анализ пришел из fallback, добавляем дополнительное предупреждение
+    is_fallback = analysis_result.get('source') == 'fallback'
+
+    # Проверяем на аллергены если есть медицинские данные
+    allergens, contraindications = medical_terms(medical_data)
+
+    # Анализируем ингредиенты на наличие аллергенов
+    analyzed_ingredients = []
+    warnings = []
+
+    for ingredient_item in analysis_result.get('ingredients', []):
+        ingredient = flag_ingredient(ingredient_item, allergens, contraindications)
+        analyzed_ingredients.append(ingredient)
+
+        if ingredient['is_allergen']:
+            warnings.append(f"⚠️ Аллерген обнаружен: {ingredient['name']}")
+        if ingredient['is_contraindication']:
+            warnings.append(f"⚠️ Противопоказание: {ingredient['name']}")
+
+    # Если это fallback, добавляем информационное сообщение
+    if is_fallback:
+        warnings.insert(0, "ℹ️ Анализ выполнен в упрощенном режиме. Результат может быть менее точным.")
+
+    # Формируем ответ
+    response = {
+        "ingredients": analyzed_ingredients,
+        "warnings": warnings,
+        "original_response": analysis_result.get('original_response', 'Анализ выполнен')
+    }
+
+    # Если была ошибка, добавляем ее в ответ для отладки (но не показываем пользователю)
+    if analysis_result.get('error'):
+        response['_debug_error'] = analysis_result['error']
+
+    return response
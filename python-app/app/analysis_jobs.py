@@ -0,0 +1,166 @@
+import asyncio
+import math
+import time
+import uuid
+from collections import deque
+from .config import ANALYSIS_JOB_WORKERS, ANALYSIS_JOB_MAX_PENDING, ANALYSIS_JOB_TTL_SECONDS
+from .metrics import metrics
+from .inference_cache import analyze_image_cached
+from .inference_limiter import inference_limiter, InferenceOverloaded
+from .analyse_utils import build_analysis_response
+from . import repository
+
+FINISHED_STATUSES = ("done", "failed")
+
+class AnalysisJobs:
+    """
+    Фоновые задачи анализа изображений.
+
+    POST /analysis-jobs только проверяет изображение и ставит задачу в очередь,
+    а распознавание выполняют workers фоновых обработчиков, так что HTTP
+    соединение не держится на время работы Ollama. Статус задачи
+    (queued -> running -> done/failed) читается опросом или потоком SSE.
+    В очереди не больше max_pending задач; завершенные хранятся ttl секунд.
+    Запускается из lifespan приложения.
+    """
+
+    def __init__(self, workers: int = ANALYSIS_JOB_WORKERS,
+                 max_pending: int = ANALYSIS_JOB_MAX_PENDING,
+                 ttl: float = ANALYSIS_JOB_TTL_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._jobs = {}
+        self._finished = deque()  # (finished_at, job_id) в порядке завершения
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        """Запускает обработчиков в текущем event loop"""
+        if not self._tasks:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Останавливает обработчиков; невыполненные задачи завершаются ошибкой"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            self._finish(job, "failed", error="Сервер был остановлен до начала анализа")
+        self._publish()
+
+    def submit(self, user_id: int, image_data: bytes) -> dict:
+        """Ставит изображение в очередь анализа. При заполненной очереди - InferenceOverloaded"""
+        self._expire()
+        pending = self._queue.qsize()
+        if pending >= self.max_pending:
+            metrics.inc("analysis_jobs.rejected")
+            retry_after = math.ceil((pending + 1) * inference_limiter.service_time / self.workers)
+            raise InferenceOverloaded(max(1, retry_after))
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "error": None,
+            "image_data": image_data,
+            "version": 0,
+            "changed": asyncio.Event()
+        }
+        self._jobs[job["id"]] = job
+        self._queue.put_nowait(job)
+        metrics.inc("analysis_jobs.submitted")
+        self._publish()
+        return self._public(job)
+
+    def get(self, job_id: str, user_id: int):
+        """Состояние задачи пользователя или None (нет такой, чужая или истекла)"""
+        job = self._lookup(job_id, user_id)
+        return self._public(job) if job is not None else None
+
+    def watch(self, job_id: str, user_id: int):
+        """Состояние задачи и событие, которое сработает при следующем изменении"""
+        job = self._lookup(job_id, user_id)
+        if job is None:
+            return None, None
+        return self._public(job), job["changed"]
+
+    def stats(self) -> dict:
+        counts = {}
+        for job in self._jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {
+            "workers": len(self._tasks),
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "jobs": counts
+        }
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._publish()
+            await self._run(job)
+
+    async def _run(self, job: dict):
+        metrics.observe("analysis_jobs.wait_seconds", time.time() - job["created_at"])
+        self._update(job, "running")
+        try:
+            analysis_result = await analyze_image_cached(job["image_data"])
+            # Медицинские данные берем на момент готовности результата
+            medical_data = await repository.get_medical_data(job["user_id"])
+            self._finish(job, "done", result=build_analysis_response(analysis_result, medical_data))
+        except asyncio.CancelledError:
+            self._finish(job, "failed", error="Сервер был остановлен во время анализа")
+            raise
+        except InferenceOverloaded as e:
+            self._finish(job, "failed", error=str(e))
+        except Exception as e:
+            print(f"Ошибка фоновой задачи анализа {job['id']}: {e}")
+            self._finish(job, "failed", error=str(e))
+
+    def _lookup(self, job_id: str, user_id: int):
+        self._expire()
+        job = self._jobs.get(job_id)
+        if job is None or job["user_id"] != user_id:
+            return None
+        return job
+
+    def _update(self, job: dict, status: str, **fields):
+        job.update(fields, status=status, updated_at=time.time(), version=job["version"] + 1)
+        # Будим всех, кто ждет изменения, и готовим событие для следующего
+        changed, job["changed"] = job["changed"], asyncio.Event()
+        changed.set()
+
+    def _finish(self, job: dict, status: str, result: dict = None, error: str = None):
+        self._update(job, status, result=result, error=error, image_data=None)
+        self._finished.append((job["updated_at"], job["id"]))
+        metrics.inc(f"analysis_jobs.{status}")
+
+    def _expire(self):
+        expired_before = time.time() - self.ttl
+        while self._finished and self._finished[0][0] <= expired_before:
+            _, job_id = self._finished.popleft()
+            self._jobs.pop(job_id, None)
+
+    def _publish(self):
+        metrics.set("analysis_jobs.pending", self._queue.qsize() if self._queue is not None else 0)
+
+    def _public(self, job: dict) -> dict:
+        return {
+            "id": job["id"],
+            "status": job["status"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "result": job["result"],
+            "error": job["error"]
+        }
+
+analysis_jobs = AnalysisJobs()
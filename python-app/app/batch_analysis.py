@@ -0,0 +1,52 @@
+import asyncio
+import base64
+from .funcs import analyze_image_with_fallback
+from .inference_cache import find_cached_analysis, store_analysis, cached_result
+from .inference_limiter import inference_limiter
+from .metrics import metrics
+
+async def analyze_images_batch(images: dict, concurrency: int = None):
+    """
+    Анализ нескольких изображений: {индекс: байты} -> пары (индекс, результат
+    или исключение) в порядке готовности.
+
+    Сначала для всех изображений параллельно ищется результат в кэше, и найденные
+    отдаются сразу. Остальные распознаются, занимая не больше concurrency мест
+    (по умолчанию - число одновременных запросов к Ollama), чтобы пакет не
+    переполнил очередь ограничителя сам себе. При закрытии генератора
+    незавершенные распознавания отменяются.
+    """
+    concurrency = concurrency or inference_limiter.max_concurrency
+    indexes = list(images)
+    lookups = await asyncio.gather(*(find_cached_analysis(images[i]) for i in indexes))
+
+    misses = []
+    for index, (key, phash, cached) in zip(indexes, lookups):
+        if cached is None:
+            misses.append((index, key, phash))
+        else:
+            yield index, cached_result(cached)
+    metrics.inc("analysis.batch_images", len(indexes))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(index: int, key: tuple, phash):
+        try:
+            async with semaphore:
+                image_data = images[index]
+                image_base64 = base64.b64encode(image_data).decode('utf-8')
+                result = await analyze_image_with_fallback(image_base64, image_data)
+        except Exception as e:
+            # Ошибка одного изображения (например, перегрузка) не прерывает пакет
+            return index, e
+        await store_analysis(key, result, phash)
+        return index, result
+
+    tasks = [asyncio.create_task(analyze(*miss)) for miss in misses]
+    try:
+        for done in asyncio.as_completed(tasks):
+            yield await done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from .config import (
+    OLLAMA_BREAKER_WINDOW, OLLAMA_BREAKER_MIN_CALLS, OLLAMA_BREAKER_FAILURE_RATE, OLLAMA_BREAKER_OPEN_SECONDS
+)
+from .metrics import metrics
+from .inference_limiter import InferenceOverloaded
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpen(Exception):
+    """Зависимость считается недоступной, вызов не выполнялся"""
+
+class CircuitBreaker:
+    """
+    Автомат защиты внешней зависимости.
+
+    closed - вызовы идут как обычно, результаты последних window вызовов
+    запоминаются; когда среди них (не меньше min_calls) доля ошибок достигает
+    failure_rate, автомат размыкается. open - вызовы сразу завершаются
+    CircuitOpen, без ожидания таймаутов. Через open_seconds автомат
+    переходит в half_open и пропускает ровно один пробный вызов: успех
+    замыкает цепь, ошибка снова размыкает ее на open_seconds.
+
+    Исключения из ignored (например, перегрузка очереди) и отмена вызова
+    не считаются ни успехом, ни ошибкой.
+    """
+
+    def __init__(self, name: str, window: int = OLLAMA_BREAKER_WINDOW,
+                 min_calls: int = OLLAMA_BREAKER_MIN_CALLS,
+                 failure_rate: float = OLLAMA_BREAKER_FAILURE_RATE,
+                 open_seconds: float = OLLAMA_BREAKER_OPEN_SECONDS,
+                 ignored: tuple = ()):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.ignored = ignored
+        self.state = CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self._outcomes = deque(maxlen=window)  # True - успех, False - ошибка
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def protect(self):
+        """Выполняет блок, если цепь не разомкнута; иначе сразу CircuitOpen"""
+        probe = self._before_call()
+        try:
+            yield
+        except self.ignored:
+            self._release(probe)
+            raise
+        except Exception:
+            self._record(probe, success=False)
+            raise
+        except BaseException:
+            # Отмена запроса ничего не говорит о зависимости
+            self._release(probe)
+            raise
+        else:
+            self._record(probe, success=True)
+
+    def reset(self):
+        """Замыкает цепь и забывает историю вызовов"""
+        with self._lock:
+            self._outcomes.clear()
+            self._probe_in_flight = False
+            self.opened_at = None
+            self._set_state(CLOSED)
+
+    def stats(self) -> dict:
+        with self._lock:
+            failures = self._outcomes.count(False)
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.opened_at + self.open_seconds - time.monotonic()), 1)
+            return {
+                "state": self.state,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": failures,
+                "rejected": self.rejected,
+                "retry_in_seconds": retry_in
+            }
+
+    def _before_call(self) -> bool:
+        """Пропускает вызов или бросает CircuitOpen. Возвращает True для пробного вызова"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+        metrics.inc(f"{self.name}.breaker_rejected")
+        raise CircuitOpen(f"{self.name} временно недоступен (автомат разомкнут)")
+
+    def _record(self, probe: bool, success: bool):
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if success:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                elif probe:
+                    self._open()
+                return
+            if self.state == OPEN:
+                # Вызов начался до размыкания - на состояние уже не влияет
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def _release(self, probe: bool):
+        if probe:
+            with self._lock:
+                self._probe_in_flight = False
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._set_state(OPEN)
+        metrics.inc(f"{self.name}.breaker_opened")
+        print(f"Автомат {self.name} разомкнут на {self.open_seconds} с")
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.set(f"{self.name}.breaker_state", state)
+
+# Перегрузка своей очереди - не признак недоступности Ollama
+ollama_breaker = CircuitBreaker("ollama", ignored=(InferenceOverloaded,))
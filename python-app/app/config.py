@@ -9,6 +9,20 @@ else:
 
 # Database
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'app.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 256))
+# Потоки, в которых выполняются запросы асинхронного слоя данных
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', DB_POOL_SIZE))
+# Групповой коммит: окно сбора записей и максимальный размер пачки
+DB_WRITE_BATCH_WINDOW_MS = float(os.getenv('DB_WRITE_BATCH_WINDOW_MS', 2))
+DB_WRITE_BATCH_MAX = int(os.getenv('DB_WRITE_BATCH_MAX', 64))
+
+# Полнотекстовый поиск: до скольких совпадений выдача ранжируется по релевантности
+SEARCH_RANKED_MAX_MATCHES = int(os.getenv('SEARCH_RANKED_MAX_MATCHES', 200))
 
 # MinIO Configuration
 MINIO_ENDPOINT = os.getenv('MINIO_ENDPOINT', 'localhost:9000')
@@ -19,10 +33,66 @@ MINIO_SECURE = os.getenv('MINIO_SECURE', 'False').lower() == 'true'
 
 # Ollama Configuration
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
+# Несколько серверов Ollama через запятую; запросы распределяются между ними
+OLLAMA_HOSTS = [host.strip() for host in os.getenv('OLLAMA_HOSTS', OLLAMA_HOST).split(',') if host.strip()]
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'qwen3-vl:4b')
+# Предел генерируемых токенов на ответ распознавания
+OLLAMA_NUM_PREDICT = int(os.getenv('OLLAMA_NUM_PREDICT', 256))
+# Одновременные распознавания и длина очереди к Ollama; сверх очереди - 429
+OLLAMA_MAX_CONCURRENCY = int(os.getenv('OLLAMA_MAX_CONCURRENCY', 1))
+OLLAMA_MAX_QUEUE = int(os.getenv('OLLAMA_MAX_QUEUE', 8))
+# Начальная оценка времени распознавания для Retry-After, пока нет замеров
+OLLAMA_EXPECTED_SERVICE_SECONDS = float(os.getenv('OLLAMA_EXPECTED_SERVICE_SECONDS', 30))
+# Пул соединений долгоживущего клиента каждого сервера Ollama (распознавания и keep-alive запросы)
+OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', OLLAMA_MAX_CONCURRENCY + 2))
+# Сколько Ollama держит модель в памяти после запроса и как часто это продлевать (0 - не продлевать)
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+OLLAMA_KEEP_ALIVE_PING_SECONDS = float(os.getenv('OLLAMA_KEEP_ALIVE_PING_SECONDS', 600))
+# Загружать модель при старте приложения
+OLLAMA_WARMUP = os.getenv('OLLAMA_WARMUP', 'True').lower() == 'true'
+# Сервер Ollama исключается после стольких ошибок подряд и проверяется с таким интервалом
+OLLAMA_HOST_EJECT_FAILURES = int(os.getenv('OLLAMA_HOST_EJECT_FAILURES', 3))
+OLLAMA_HOST_PROBE_SECONDS = float(os.getenv('OLLAMA_HOST_PROBE_SECONDS', 15))
+# Выбор стартового разрешения изображения: сколько попыток уровня нужно для выводов,
+# какая доля успехов и какое время ответа считаются приемлемыми, как часто пробовать крупнее
+RESOLUTION_MIN_SAMPLES = int(os.getenv('RESOLUTION_MIN_SAMPLES', 2))
+RESOLUTION_SUCCESS_TARGET = float(os.getenv('RESOLUTION_SUCCESS_TARGET', 0.8))
+RESOLUTION_LATENCY_TARGET_SECONDS = float(os.getenv('RESOLUTION_LATENCY_TARGET_SECONDS', 120))
+RESOLUTION_EXPLORE_RATE = float(os.getenv('RESOLUTION_EXPLORE_RATE', 0.05))
+# Автомат защиты: доля ошибок среди последних вызовов, после которой Ollama
+# считается недоступной, и пауза до пробного вызова
+OLLAMA_BREAKER_WINDOW = int(os.getenv('OLLAMA_BREAKER_WINDOW', 10))
+OLLAMA_BREAKER_MIN_CALLS = int(os.getenv('OLLAMA_BREAKER_MIN_CALLS', 4))
+OLLAMA_BREAKER_FAILURE_RATE = float(os.getenv('OLLAMA_BREAKER_FAILURE_RATE', 0.5))
+OLLAMA_BREAKER_OPEN_SECONDS = float(os.getenv('OLLAMA_BREAKER_OPEN_SECONDS', 30))
+
+# Фоновые задачи анализа: обработчики, длина очереди и время хранения результата
+ANALYSIS_JOB_WORKERS = int(os.getenv('ANALYSIS_JOB_WORKERS', 2))
+ANALYSIS_JOB_MAX_PENDING = int(os.getenv('ANALYSIS_JOB_MAX_PENDING', 32))
+ANALYSIS_JOB_TTL_SECONDS = float(os.getenv('ANALYSIS_JOB_TTL_SECONDS', 600))
+# Пакетный анализ: максимум изображений в одном запросе /analyze-images
+ANALYSIS_BATCH_MAX_IMAGES = int(os.getenv('ANALYSIS_BATCH_MAX_IMAGES', 10))
+# Как часто проверять, не отключился ли клиент во время анализа (секунды)
+ANALYSIS_DISCONNECT_POLL_SECONDS = float(os.getenv('ANALYSIS_DISCONNECT_POLL_SECONDS', 1))
+
+# Кэш результатов распознавания по содержимому изображения
+INFERENCE_CACHE_MEMORY_SIZE = int(os.getenv('INFERENCE_CACHE_MEMORY_SIZE', 256))
+INFERENCE_CACHE_MAX_ENTRIES = int(os.getenv('INFERENCE_CACHE_MAX_ENTRIES', 10000))
+INFERENCE_CACHE_TTL_SECONDS = float(os.getenv('INFERENCE_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+# Лимит INFERENCE_CACHE_MAX_ENTRIES применяется раз в столько вставок, а не на каждой
+INFERENCE_CACHE_TRIM_EVERY = int(os.getenv('INFERENCE_CACHE_TRIM_EVERY', 50))
+# Почти одинаковые изображения: максимальное расстояние Хэмминга между dHash (-1 - выключено)
+INFERENCE_CACHE_PHASH_MAX_DISTANCE = int(os.getenv('INFERENCE_CACHE_PHASH_MAX_DISTANCE', 6))
 
 # Token Configuration
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv('REFRESH_TOKEN_EXPIRE_DAYS', 7))
+TOKEN_CACHE_MAX_SIZE = int(os.getenv('TOKEN_CACHE_MAX_SIZE', 10000))
+TOKEN_SWEEP_INTERVAL_SECONDS = float(os.getenv('TOKEN_SWEEP_INTERVAL_SECONDS', 300))
+TOKEN_SWEEP_BATCH_SIZE = int(os.getenv('TOKEN_SWEEP_BATCH_SIZE', 500))
+# Подписанные (stateless) access токены: проверяются без обращения к БД
+SIGNED_ACCESS_TOKENS = os.getenv('SIGNED_ACCESS_TOKENS', 'False').lower() == 'true'
+TOKEN_SECRET_KEY = os.getenv('TOKEN_SECRET_KEY', '')
 
 # CORS
 CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
@@ -1,89 +1,166 @@
+import queue
 import sqlite3
-from datetime import datetime
-from .config import DATABASE_PATH
+import threading
+from .config import (
+    DATABASE_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE, DB_BUSY_TIMEOUT_MS, DB_STATEMENT_CACHE_SIZE
+)
+
+class PooledConnection:
+    """
+    Соединение, взятое из пула.
+
+    Ведет себя как sqlite3.Connection, но close() возвращает соединение
+    в пул вместо закрытия. Как контекстный менеджер коммитит транзакцию
+    при успешном выходе, откатывает при исключении и возвращает
+    соединение в пул:
+
+        with get_db_connection() as conn:
+            conn.execute(...)
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Соединение уже возвращено в пул")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._conn is not None:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        self.close()
+        return False
+
+    def __del__(self):
+        # Соединение, которое забыли закрыть, все равно возвращается в пул
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class ConnectionPool:
+    """
+    Ограниченный пул заранее настроенных соединений SQLite.
+
+    Соединения создаются лениво (не больше size), настраиваются один раз
+    (WAL, synchronous=NORMAL, foreign_keys, размеры кэша и mmap,
+    busy_timeout) и переиспользуются между запросами и потоками.
+    """
+
+    def __init__(self, database: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_connection(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row  # Чтобы получать результаты как словари
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute(f"PRAGMA cache_size = {-DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+
+            if create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(
+                        f"Нет свободных соединений с БД (пул из {self.size})"
+                    )
+
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        # Незавершенная транзакция не должна достаться следующему владельцу
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Закрывает все свободные соединения (при остановке приложения)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize()
+        }
+
+_pool = ConnectionPool(DATABASE_PATH)
 
 def get_db_connection():
-    """Подключение к SQLite базе данных"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # Чтобы получать результаты как словари
-    return conn
+    """Соединение с SQLite из пула; close() или выход из with возвращает его в пул"""
+    return _pool.acquire()
+
+def close_db_pool():
+    _pool.close_all()
 
 def init_db():
-    """Инициализация базы данных"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Включаем foreign keys для SQLite
-    cur.execute("PRAGMA foreign_keys = ON;")
-
-    # Создание таблицы пользователей
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username VARCHAR(50) UNIQUE NOT NULL,
-            email VARCHAR(100) UNIQUE NOT NULL,
-            password_hash VARCHAR(255) NOT NULL,
-            role VARCHAR(20) DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Создание таблицы токенов
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS user_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER REFERENCES users(id),
-            token VARCHAR(255) UNIQUE NOT NULL,
-            token_type VARCHAR(10) NOT NULL DEFAULT 'access',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP NOT NULL
-        )
-    ''')
-    
-    # Создание таблицы медицинских данных
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS user_medical_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE REFERENCES users(id),
-            contraindications TEXT,
-            allergens TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # Создание таблицы сохраненных анализов
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS saved_analyses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER REFERENCES users(id),
-            image_path TEXT NOT NULL,
-            analysis_result TEXT NOT NULL,
-            ingredients_count INTEGER DEFAULT 0,
-            warnings_count INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)')
-    
-    conn.commit()
-    conn.close()
-
-def cleanup_expired_tokens():
-    """Очистка просроченных токенов"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('DELETE FROM user_tokens WHERE expires_at <= ?', 
-                (datetime.now().isoformat(),))
-    
-    deleted_count = cur.rowcount
-    conn.commit()
-    conn.close()
-    
-    if deleted_count > 0:
-        print(f"Удалено {deleted_count} просроченных токенов")
-    
-    return deleted_count
\ No newline at end of file
+    """Инициализация базы данных: применение миграций схемы"""
+    from .migrations import run_migrations
+
+    with get_db_connection() as conn:
+        run_migrations(conn)
+
+async def cleanup_expired_tokens():
+    """Внеочередной запуск очистки просроченных токенов"""
+    from .token_sweeper import token_sweeper
+    return await token_sweeper.sweep()
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .db import get_db_connection
+from .config import DB_WRITE_BATCH_WINDOW_MS, DB_WRITE_BATCH_MAX
+from .metrics import metrics
+
+class DbWriter:
+    """
+    Единственный писатель SQLite с групповым коммитом.
+
+    Операции записи ставятся в очередь, фоновая задача собирает те,
+    что пришли в пределах окна window_ms (но не больше max_batch),
+    и выполняет их в одном потоке одной транзакцией. Каждая операция
+    обернута в SAVEPOINT: ошибка одной откатывает только ее, остальные
+    коммитятся. Вызывающий получает результат своей операции
+    (например lastrowid) или ее исключение.
+    """
+
+    def __init__(self, window_ms: float = DB_WRITE_BATCH_WINDOW_MS, max_batch: int = DB_WRITE_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+    def is_running(self) -> bool:
+        """Писатель запущен в текущем event loop"""
+        if self._task is None or self._task.done():
+            return False
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def submit(self, func, *args):
+        """Ставит func(conn, *args) в очередь записи и ждет результат"""
+        future = self._loop.create_future()
+        await self._queue.put((func, args, future))
+        return await future
+
+    def _execute_batch(self, batch: list) -> list:
+        """Выполняет пачку операций одной транзакцией (в потоке писателя)"""
+        outcomes = []
+        with get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, _ in batch:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    result = func(conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_op")
+                    outcomes.append((None, e))
+                else:
+                    outcomes.append((result, None))
+                conn.execute("RELEASE write_op")
+        return outcomes
+
+    async def _collect_batch(self, first) -> list:
+        # Ждем окно, чтобы успели подойти параллельные записи, и забираем все накопившееся
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+
+        batch = [first]
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                # Сигнал остановки обработаем после текущей пачки
+                self._queue.put_nowait(None)
+                break
+            batch.append(item)
+        return batch
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            batch = await self._collect_batch(item)
+            start = time.perf_counter()
+            try:
+                outcomes = await self._loop.run_in_executor(self._executor, self._execute_batch, batch)
+            except Exception as e:
+                # Не удался сам коммит: ошибка у всех операций пачки
+                print(f"Ошибка группового коммита: {e}")
+                outcomes = [(None, e)] * len(batch)
+
+            metrics.inc("db_writer.commits")
+            metrics.inc("db_writer.operations", len(batch))
+            metrics.observe("db_writer.batch_size", len(batch))
+            metrics.observe("db_writer.commit_seconds", time.perf_counter() - start)
+
+            for (_, _, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def start(self):
+        """Запускает писателя в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает уже поставленные операции и останавливает писателя"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+db_writer = DbWriter()
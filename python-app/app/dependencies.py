@@ -1,53 +1,51 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from .funcs import get_user_by_token
+from .repository import resolve_user_by_token
 
 security = HTTPBearer()
 
-def require_auth(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_principal(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Определяет пользователя по access токену один раз за запрос.
+    Результат (в том числе None) сохраняется в request.state.user,
+    проверки ниже только читают его.
+    """
+    if hasattr(request.state, 'user'):
+        return request.state.user
+
+    user = await resolve_user_by_token(credentials.credentials, 'access')
+    request.state.user = user
+    return user
+
+async def require_auth(user = Depends(get_current_principal)):
     """Проверяет, что пользователь авторизован"""
-    user = get_user_by_token(credentials.credentials, 'access')
-    
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Требуется авторизация"
         )
-    
+
     return user
 
-def require_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def require_admin(user = Depends(require_auth)):
     """Проверяет, что пользователь является администратором"""
-    user = get_user_by_token(credentials.credentials, 'access')
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Требуется авторизация"
-        )
-    
     if user['role'] != 'admin':
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Доступ запрещен. Требуются права администратора"
         )
-    
+
     return user
 
-def require_not_banned(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def require_not_banned(user = Depends(require_auth)):
     """Проверяет, что пользователь не забанен"""
-    user = get_user_by_token(credentials.credentials, 'access')
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Требуется авторизация"
-        )
-    
     if user['role'] == 'banned':
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ваш аккаунт заблокирован. Обратитесь к администратору"
         )
-    
-    return user
\ No newline at end of file
+
+    return user
@@ -1,12 +1,20 @@
 import hashlib
 import secrets
-from datetime import datetime, timedelta
+import time
 from .db import get_db_connection
-from .config import ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, OLLAMA_HOST
+from .config import ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, SIGNED_ACCESS_TOKENS, OLLAMA_NUM_PREDICT
+from .token_cache import token_cache
+from .signed_tokens import create_access_token, verify_access_token, is_signed_token, revocation_set
+from .metrics import metrics
+from .ollama_client import ollama_client
+from .inference_limiter import inference_limiter, InferenceOverloaded
+from .circuit_breaker import ollama_breaker
+from .resolution_policy import resolution_policy, image_long_side, LEVELS
+from .ingredient_parsing import clean_ingredient_name, IngredientStreamParser
 import json
 import re
 import asyncio
-import ollama
+from contextlib import aclosing
 from PIL import Image
 import io
 import base64
@@ -23,20 +31,25 @@ def generate_token_pair_with_conn(conn, user_id: int):
     """Генерация пары токенов с использованием существующего соединения"""
     cur = conn.cursor()
     
-    access_token = generate_token()
     refresh_token = generate_token()
+    # Сроки действия хранятся как целые epoch-секунды
+    refresh_expires_at = int(time.time()) + REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
     
-    access_expires_at = datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    refresh_expires_at = datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    if SIGNED_ACCESS_TOKENS:
+        # Подписанный access токен не хранится в БД, в БД только refresh токен
+        cur.execute('SELECT role FROM users WHERE id = ?', (user_id,))
+        access_token, _ = create_access_token(user_id, cur.fetchone()['role'])
+    else:
+        access_token = generate_token()
+        access_expires_at = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        cur.execute(
+            'INSERT INTO user_tokens (user_id, token, expires_at, token_type) VALUES (?, ?, ?, ?)',
+            (user_id, access_token, access_expires_at, 'access')
+        )
     
-    # Сохраняем оба токена
-    cur.execute(
-        'INSERT INTO user_tokens (user_id, token, expires_at, token_type) VALUES (?, ?, ?, ?)',
-        (user_id, access_token, access_expires_at.isoformat(), 'access')
-    )
     cur.execute(
         'INSERT INTO user_tokens (user_id, token, expires_at, token_type) VALUES (?, ?, ?, ?)',
-        (user_id, refresh_token, refresh_expires_at.isoformat(), 'refresh')
+        (user_id, refresh_token, refresh_expires_at, 'refresh')
     )
     
     return {
@@ -46,34 +59,64 @@ def generate_token_pair_with_conn(conn, user_id: int):
     }
 
 def get_user_by_token(token: str, token_type: str = 'access'):
-    """Получение пользователя по токену"""
-    from .db import get_db_connection, cleanup_expired_tokens
-    
+    """Получение пользователя по токену (сначала из кэша, затем из БД)"""
+    if token_type == 'access' and is_signed_token(token):
+        # Подписанный токен проверяется без обращения к БД
+        return verify_access_token(token)
+
+    cached_user = token_cache.get(token, token_type)
+    if cached_user is not None:
+        return cached_user
+
+    # Поколение до SELECT: если пользователя инвалидируют, пока мы читаем, строка не попадет в кэш
+    generation = token_cache.generation()
     conn = get_db_connection()
     cur = conn.cursor()
-    
-    # Очищаем просроченные токены в этом же соединении
-    cur.execute('DELETE FROM user_tokens WHERE expires_at <= ?', 
-                (datetime.now().isoformat(),))
-    
-    deleted_count = cur.rowcount
-    if deleted_count > 0:
-        print(f"Удалено {deleted_count} просроченных токенов")
-    
-    # Проверяем токен
+
+    # Просроченные токены удаляет фоновый token_sweeper,
+    # здесь они просто отсекаются условием по expires_at
     cur.execute('''
-        SELECT u.id, u.username, u.email, u.role, u.created_at 
-        FROM users u 
-        JOIN user_tokens ut ON u.id = ut.user_id 
+        SELECT u.id, u.username, u.email, u.role, u.created_at, ut.expires_at
+        FROM users u
+        JOIN user_tokens ut ON u.id = ut.user_id
         WHERE ut.token = ? AND ut.expires_at > ? AND ut.token_type = ?
-    ''', (token, datetime.now().isoformat(), token_type))
-    
-    user = cur.fetchone()
-    conn.commit()
+    ''', (token, int(time.time()), token_type))
+
+    row = cur.fetchone()
     conn.close()
-    
+
+    if not row:
+        return None
+
+    user = {
+        'id': row['id'],
+        'username': row['username'],
+        'email': row['email'],
+        'role': row['role'],
+        'created_at': row['created_at']
+    }
+    token_cache.set(token, token_type, user, row['expires_at'], generation)
+
     return user
 
+def revoke_user_tokens(user_id: int, conn, revoked_before: float):
+    """
+    Отзывает уже выданные access токены пользователя в режиме подписанных
+    токенов: запись в список отзыва идет в транзакции conn. После коммита
+    вызывающий обязан вызвать user_tokens_revoked.
+    """
+    if SIGNED_ACCESS_TOKENS:
+        revocation_set.revoke_user(user_id, conn, revoked_before)
+
+def user_tokens_revoked(user_id: int, revoked_before: float):
+    """
+    После коммита отзыва: сбрасывает кэш токенов и применяет отзыв в памяти.
+    До коммита нельзя: параллельный запрос успел бы прочитать старые строки
+    """
+    token_cache.invalidate_user(user_id)
+    if SIGNED_ACCESS_TOKENS:
+        revocation_set.apply(user_id, revoked_before)
+
 def parse_medical_text(text: str) -> list:
     """Парсит текст медицинских данных в список"""
     import re
@@ -90,6 +133,10 @@ def parse_bool_param(value: str) -> bool:
     return bool(value)
 
 async def compress_image(image_data: bytes, max_size: int = 500, quality: int = 85) -> bytes:
+    """Сжатие изображения (compress_image_sync) в пуле потоков, не блокируя event loop"""
+    return await asyncio.to_thread(compress_image_sync, image_data, max_size, quality)
+
+def compress_image_sync(image_data: bytes, max_size: int = 500, quality: int = 85) -> bytes:
     """
     Сжимает изображение, сохраняя пропорции и формат
     
@@ -166,14 +213,40 @@ async def compress_image(image_data: bytes, max_size: int = 500, quality: int =
         # В случае ошибки возвращаем исходное изображение
         return image_data
 
-def clean_ingredient_name(ingredient: str) -> str:
-    """Очищает название ингредиента от лишних символов"""
-    # Убираем маркеры списка, кавычки и лишние пробелы
-    clean = re.sub(r'^[\-\*•\d\.\s"\']+|[\-\*•\d\.\s"\']+$', '', ingredient)
-    return clean.strip() if clean and len(clean) > 1 else ingredient
+def parse_strict_response(content: str):
+    """
+    Быстрый разбор ответа, сгенерированного по ANALYSIS_SCHEMA: строго
+    {"ingredients": [строки]}. Возвращает очищенный список или None,
+    если ответ схеме не соответствует.
+    """
+    try:
+        data = json.loads(content)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('ingredients'), list):
+        return None
+    if not all(isinstance(ing, str) for ing in data['ingredients']):
+        return None
+
+    cleaned = [clean_ingredient_name(ing) for ing in data['ingredients'] if ing.strip()]
+    return [name for name in cleaned if name] or None
 
 def parse_ollama_response(content: str) -> list:
-    """Парсинг ответа Ollama с обработкой разных форматов"""
+    """
+    Парсинг ответа Ollama: сначала строгий разбор по схеме, затем
+    (обрезанный по num_predict или не по схеме ответ) эвристики
+    """
+    strict = parse_strict_response(content)
+    if strict is not None:
+        metrics.inc("analysis.parse_strict")
+        return strict
+    metrics.inc("analysis.parse_heuristic")
+
+    # Ответ, обрезанный на пределе токенов: забираем завершенные элементы массива
+    partial = IngredientStreamParser()
+    salvaged = partial.feed(content)
+    if salvaged and not partial.done:
+        return salvaged
     
     # Пытаемся найти JSON в ответе
     json_match = re.search(r'\{[^{}]*\{.*\}[^{}]*\}|\{.*\}', content, re.DOTALL)
@@ -215,23 +288,39 @@ def parse_ollama_response(content: str) -> list:
     
     return ingredients
 
+ANALYSIS_PROMPT = """Analyze this image and list all ingredients you can identify or assume in JSON format. 
+        Use this exact structure: {"ingredients": ["ingredient1", "ingredient2", ...]}
+        Be fast and concise."""
+# JSON-схема ответа: Ollama ограничивает генерацию ею, без пояснений вокруг JSON
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ingredients": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    },
+    "required": ["ingredients"]
+}
+ANALYSIS_OPTIONS = {'num_timeout': 420, 'num_predict': OLLAMA_NUM_PREDICT}
+# Увеличивать при изменении промпта или разбора ответа: старые записи кэша распознавания перестанут выдаваться
+ANALYSIS_PROMPT_VERSION = 2
+
+# Таймаут одной попытки распознавания и пауза перед следующей
+OLLAMA_ATTEMPT_TIMEOUT_SECONDS = 450
+RETRY_PAUSE_SECONDS = 2
+
 async def call_ollama_with_retry(image_base64: str, original_image_data: bytes) -> dict:
     """Вызов Ollama с повторными попытками и прогрессивным сжатием"""
     
     async def async_ollama_call(current_image_base64: str):
-        """Асинхронная функция для вызова Ollama через asyncio.to_thread"""
-        prompt = """Analyze this image and list all ingredients you can identify or assume in JSON format. 
-        Use this exact structure: {"ingredients": ["ingredient1", "ingredient2", ...]}
-        Be fast and concise."""
+        """Запрос к Ollama через общий асинхронный клиент приложения"""
+        prompt = ANALYSIS_PROMPT
         
         print(f"  -> Отправка запроса к Ollama...")
-        import time
         start_time = time.time()
         
-        # ollama.chat() синхронный, поэтому запускаем в потоке
-        result = await asyncio.to_thread(
-            ollama.Client(host=OLLAMA_HOST).chat,
-            model='qwen3-vl:4b',
+        result = await ollama_client.chat(
             messages=[
                 {
                     'role': 'user',
@@ -239,7 +328,8 @@ async def call_ollama_with_retry(image_base64: str, original_image_data: bytes)
                     'images': [current_image_base64]
                 }
             ],
-            options={'num_timeout': 420}
+            format=ANALYSIS_SCHEMA,
+            options=ANALYSIS_OPTIONS
         )
         
         elapsed = time.time() - start_time
@@ -247,45 +337,53 @@ async def call_ollama_with_retry(image_base64: str, original_image_data: bytes)
         return result
     
     last_error = None
-    current_image_base64 = image_base64
-    current_image_data = original_image_data
+    # Стартовое разрешение выбирается по статистике прошлых попыток для изображений такого размера;
+    # каждая следующая попытка - на уровень меньше
+    long_side = image_long_side(original_image_data)
+    levels = resolution_policy.levels_for(long_side)
+    start_position = levels.index(resolution_policy.choose(long_side))
+    prepared = {}
 
     for attempt in range(3):
+        level = levels[min(start_position + attempt, len(levels) - 1)]
+        max_size, quality = LEVELS[level]
+        start_time = time.perf_counter()
         try:
             print(f"Ollama attempt {attempt + 1}/3")
             
-            if attempt == 1:
-                print("  -> Сжатие изображения до 1000px (вторая попытка)")
-                compressed_data = await compress_image(current_image_data, max_size=1000, quality=85)
-                current_image_base64 = base64.b64encode(compressed_data).decode('utf-8')
-                current_image_data = compressed_data
-                
-            elif attempt == 2:
-                print("  -> Сжатие изображения до 500px (третья попытка)")
-                compressed_data = await compress_image(current_image_data, max_size=500, quality=80)
-                current_image_base64 = base64.b64encode(compressed_data).decode('utf-8')
-                current_image_data = compressed_data
+            if level not in prepared:
+                if max_size is None:
+                    prepared[level] = image_base64
+                else:
+                    print(f"  -> Сжатие изображения до {max_size}px (попытка {attempt + 1})")
+                    compressed_data = await compress_image(original_image_data, max_size=max_size, quality=quality)
+                    prepared[level] = base64.b64encode(compressed_data).decode('utf-8')
+            current_image_base64 = prepared[level]
+            start_time = time.perf_counter()
 
-            print(f"  -> Вызов Ollama (таймаут 4500 сек)...")
+            print(f"  -> Вызов Ollama (таймаут 450 сек)...")
             # Здесь async_ollama_call - корутина, которую мы ожидаем
             response = await asyncio.wait_for(
                 async_ollama_call(current_image_base64),
-                timeout=450
+                timeout=OLLAMA_ATTEMPT_TIMEOUT_SECONDS
             )
             
             content = response.get('message', {}).get('content', '')
             if not content:
                 raise ValueError("Empty response from Ollama")
             
+            resolution_policy.record(long_side, level, True, time.perf_counter() - start_time)
             print(f"  -> Успешно! Длина ответа: {len(content)} символов")
             print(f"  -> Содержимое ответа (первые 200 символов): {content[:200]}")
             return response
             
         except asyncio.TimeoutError:
+            # Таймаут - признак слишком крупного изображения для этого уровня
+            resolution_policy.record(long_side, level, False, time.perf_counter() - start_time)
             last_error = f"Timeout on attempt {attempt + 1}"
             print(f"  -> Ollama timeout, retry {attempt + 1}/3")
             if attempt < 2:
-                await asyncio.sleep(2)
+                await asyncio.sleep(RETRY_PAUSE_SECONDS)
                 
         except Exception as e:
             last_error = str(e)
@@ -293,19 +391,98 @@ async def call_ollama_with_retry(image_base64: str, original_image_data: bytes)
             import traceback
             traceback.print_exc()
             if attempt < 2:
-                await asyncio.sleep(2)
+                await asyncio.sleep(RETRY_PAUSE_SECONDS)
     
     raise Exception(f"Ollama failed after 3 attempts: {last_error}")
 
+async def stream_ollama_chat(image_base64: str):
+    """Потоковый вызов Ollama (stream=True): отдает куски ответа по мере генерации"""
+    chunks = ollama_client.chat_stream(
+        messages=[
+            {
+                'role': 'user',
+                'content': ANALYSIS_PROMPT,
+                'images': [image_base64]
+            }
+        ],
+        format=ANALYSIS_SCHEMA,
+        options=ANALYSIS_OPTIONS
+    )
+    # aclosing: при закрытии потока (отключение клиента) HTTP-запрос к Ollama прерывается сразу
+    async with aclosing(chunks):
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(chunks), timeout=OLLAMA_ATTEMPT_TIMEOUT_SECONDS)
+            except StopAsyncIteration:
+                break
+            yield chunk['message']['content']
+
+# SHA-256 изображения -> задача распознавания, которая сейчас выполняется
+_inflight_analyses = {}
+# Задача распознавания -> число запросов, ожидающих ее результат
+_inflight_waiters = {}
+
 async def analyze_image_with_fallback(image_base64: str, original_image_data: bytes) -> dict:
+    """
+    Анализ изображения с single-flight: одновременные запросы с одинаковым
+    изображением (повтор после обновления токена, двойное нажатие) ждут
+    одно общее распознавание вместо того, чтобы занимать Ollama каждый.
+    Если все ожидающие отменены (клиенты отключились), распознавание
+    отменяется вместе с запросом к Ollama.
+    """
+    key = hashlib.sha256(original_image_data).hexdigest()
+    task = _inflight_analyses.get(key)
+    if task is None:
+        task = asyncio.create_task(_analyze_image(image_base64, original_image_data))
+        _inflight_analyses[key] = task
+        task.add_done_callback(lambda done: _forget_analysis(key, done))
+    else:
+        print(f"Анализ изображения {key[:12]} уже выполняется, ожидаем его результат")
+        metrics.inc("analysis.coalesced")
+
+    # shield: отмена одного из ожидающих не прерывает распознавание для остальных
+    _inflight_waiters[task] = _inflight_waiters.get(task, 0) + 1
+    try:
+        result = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # Уходит последний ожидающий - результат никому не нужен
+        if _inflight_waiters.get(task) == 1 and not task.done():
+            print(f"Анализ изображения {key[:12]} больше никто не ждет, отменяем")
+            metrics.inc("analysis.cancelled")
+            # Новый запрос того же изображения не должен присоединиться к отменяемой задаче
+            _forget_analysis(key, task)
+            task.cancel()
+        raise
+    finally:
+        _leave_analysis(task)
+    return {**result, "ingredients": list(result['ingredients']), "warnings": list(result['warnings'])}
+
+def _forget_analysis(key: str, task):
+    """Убирает задачу из _inflight_analyses, если ключ еще указывает на нее"""
+    if _inflight_analyses.get(key) is task:
+        del _inflight_analyses[key]
+
+def _leave_analysis(task) -> int:
+    """Снимает одного ожидающего с задачи распознавания, возвращает оставшихся"""
+    remaining = _inflight_waiters.get(task, 1) - 1
+    if remaining:
+        _inflight_waiters[task] = remaining
+    else:
+        _inflight_waiters.pop(task, None)
+    return remaining
+
+async def _analyze_image(image_base64: str, original_image_data: bytes) -> dict:
     """
     Анализ изображения с graceful degradation:
     - Сначала пытается вызвать Ollama (с retry)
     - При ошибке возвращает fallback ответ
     """
     try:
-        # Пытаемся вызвать Ollama
-        response = await call_ollama_with_retry(image_base64, original_image_data)
+        # Пытаемся вызвать Ollama; слот держится на все попытки сразу.
+        # Пока автомат разомкнут, сразу уходим в fallback, не занимая очередь
+        async with ollama_breaker.protect():
+            async with inference_limiter.slot():
+                response = await call_ollama_with_retry(image_base64, original_image_data)
         content = response['message']['content']
         print(f"Ollama response received, length: {len(content)}")
         
@@ -321,6 +498,10 @@ async def analyze_image_with_fallback(image_base64: str, original_image_data: by
             "original_response": content,
             "source": "ollama"
         }
+
+    except InferenceOverloaded:
+        # Перегрузка - не сбой Ollama: клиент повторит запрос позже
+        raise
         
     except Exception as e:
         print(f"Ollama analysis failed, using fallback: {e}")
@@ -0,0 +1,215 @@
+import asyncio
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from .config import (
+    OLLAMA_MODEL, INFERENCE_CACHE_MEMORY_SIZE, INFERENCE_CACHE_MAX_ENTRIES, INFERENCE_CACHE_TTL_SECONDS,
+    INFERENCE_CACHE_PHASH_MAX_DISTANCE, INFERENCE_CACHE_TRIM_EVERY
+)
+from .funcs import analyze_image_with_fallback, ANALYSIS_PROMPT_VERSION
+from .perceptual_hash import dhash_from_bytes
+from .metrics import metrics
+from . import repository
+
+class InferenceCache:
+    """
+    Кэш результатов распознавания ингредиентов по содержимому изображения.
+
+    Ключ - SHA-256 байтов изображения, имя модели и версия промпта, так что
+    смена модели или промпта не отдает старые ответы. Значение - список
+    ингредиентов до проверки на аллергены: медицинские данные пользователя
+    применяются поверх кэшированного списка.
+
+    Два уровня: LRU в памяти процесса (max_size записей) и таблица
+    inference_cache в SQLite (max_entries записей, переживает перезапуск;
+    лишние удаляются раз в trim_every вставок).
+    Записи старше ttl секунд не выдаются ни одним уровнем.
+
+    При промахе по точному ключу find_similar ищет в SQLite запись с близким
+    перцептивным хэшем (та же упаковка, снятая заново или пересжатая).
+    """
+
+    def __init__(self, max_size: int = INFERENCE_CACHE_MEMORY_SIZE,
+                 max_entries: int = INFERENCE_CACHE_MAX_ENTRIES,
+                 ttl: float = INFERENCE_CACHE_TTL_SECONDS,
+                 max_distance: int = INFERENCE_CACHE_PHASH_MAX_DISTANCE,
+                 trim_every: int = INFERENCE_CACHE_TRIM_EVERY):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.trim_every = trim_every
+        self._inserts = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> result с полем created_at
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_data: bytes, model: str, prompt_version: int) -> tuple:
+        return (hashlib.sha256(image_data).hexdigest(), model, prompt_version)
+
+    async def get(self, key: tuple):
+        """
+        Результат распознавания {"ingredients", "original_response"} по точному ключу или None.
+        Промах не учитывается в статистике: после него вызывается find_similar.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['created_at'] <= now - self.ttl:
+                del self._entries[key]
+                entry = None
+            elif entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            self._record("memory")
+            return entry
+
+        entry = await repository.get_cached_inference(key, now - self.ttl)
+        if entry is None:
+            return None
+
+        await repository.touch_cached_inference(key, now)
+        self._remember(key, entry)
+        self._record("db")
+        return entry
+
+    async def find_similar(self, key: tuple, phash):
+        """
+        Результат распознавания почти такого же изображения (dHash на расстоянии
+        не больше max_distance) или None. Завершает поиск: промах учитывается здесь.
+        """
+        if phash is None or self.max_distance < 0:
+            self._record("miss")
+            return None
+
+        now = time.time()
+        _, model, prompt_version = key
+        found = await repository.find_similar_inference(
+            model, prompt_version, phash, self.max_distance, now - self.ttl
+        )
+        if found is None:
+            self._record("miss")
+            return None
+
+        entry, distance = found
+        print(f"Кэш распознавания: похожее изображение, расстояние {distance}")
+        await repository.touch_cached_inference(entry['key'], now)
+        # Повторная загрузка этого же файла найдется уже по точному ключу в памяти
+        self._remember(key, entry)
+        self._record("near")
+        return entry
+
+    async def set(self, key: tuple, result: dict, phash=None):
+        """Кладет в оба уровня результат успешного распознавания"""
+        now = time.time()
+        entry = {
+            "ingredients": list(result['ingredients']),
+            "original_response": result.get('original_response'),
+            "created_at": now
+        }
+        self._remember(key, entry)
+        self._inserts += 1
+        await repository.store_cached_inference(
+            key, entry, now, now - self.ttl, self.max_entries, phash,
+            trim=self._inserts % self.trim_every == 0
+        )
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = self.db_hits = self.near_hits = self.misses = 0
+        await repository.clear_cached_inference()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "memory_entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _record(self, outcome: str):
+        with self._lock:
+            if outcome == "memory":
+                self.memory_hits += 1
+            elif outcome == "db":
+                self.db_hits += 1
+            elif outcome == "near":
+                self.near_hits += 1
+            else:
+                self.misses += 1
+            hits = self.memory_hits + self.db_hits + self.near_hits
+            hit_rate = hits / (hits + self.misses)
+        metrics.inc(f"inference_cache.{'misses' if outcome == 'miss' else 'hits'}")
+        metrics.set("inference_cache.hit_rate", hit_rate)
+
+inference_cache = InferenceCache()
+
+def cached_result(entry: dict) -> dict:
+    """Запись кэша в формате результата analyze_image_with_fallback"""
+    return {
+        "ingredients": list(entry['ingredients']),
+        "warnings": [],
+        "original_response": entry['original_response'],
+        "source": "cache"
+    }
+
+async def find_cached_analysis(image_data: bytes) -> tuple:
+    """
+    Поиск результата распознавания: сначала точное совпадение байтов, затем
+    почти такое же изображение по dHash. Возвращает (ключ, dHash, запись или None);
+    ошибка кэша считается промахом.
+    """
+    key = inference_cache.make_key(image_data, OLLAMA_MODEL, ANALYSIS_PROMPT_VERSION)
+    phash = None
+    try:
+        cached = await inference_cache.get(key)
+        if cached is None:
+            # Декодирование уменьшенной копии не должно занимать event loop
+            phash = await asyncio.to_thread(dhash_from_bytes, image_data)
+            cached = await inference_cache.find_similar(key, phash)
+    except Exception as e:
+        print(f"Ошибка чтения кэша распознавания: {e}")
+        cached = None
+    return key, phash, cached
+
+async def store_analysis(key: tuple, result: dict, phash=None):
+    """
+    Кэширует только ответы Ollama: fallback при следующей загрузке повторяет попытку.
+    Ошибка кэша не мешает анализу.
+    """
+    if result.get('source') != 'ollama':
+        return
+    try:
+        await inference_cache.set(key, result, phash)
+    except Exception as e:
+        print(f"Ошибка записи в кэш распознавания: {e}")
+
+async def analyze_image_cached(image_data: bytes) -> dict:
+    """analyze_image_with_fallback с кэшем по содержимому изображения"""
+    key, phash, cached = await find_cached_analysis(image_data)
+    if cached is not None:
+        return cached_result(cached)
+
+    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    result = await analyze_image_with_fallback(image_base64, image_data)
+    await store_analysis(key, result, phash)
+    return result
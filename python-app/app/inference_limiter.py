@@ -0,0 +1,124 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from .config import OLLAMA_MAX_CONCURRENCY, OLLAMA_MAX_QUEUE, OLLAMA_EXPECTED_SERVICE_SECONDS
+from .metrics import metrics
+
+class InferenceOverloaded(Exception):
+    """Очередь к Ollama заполнена; retry_after - через сколько секунд стоит повторить"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Очередь распознавания заполнена, повторите через {retry_after} с")
+        self.retry_after = retry_after
+
+class InferenceLimiter:
+    """
+    Ограничение одновременных запросов к Ollama.
+
+    Не больше max_concurrency распознаваний выполняются одновременно,
+    еще до max_queue ждут своей очереди в порядке поступления. Если очередь
+    заполнена, запрос сразу отклоняется с InferenceOverloaded вместо того,
+    чтобы ждать таймаута в потоке. Retry-After оценивается по скользящему
+    среднему времени обслуживания.
+    """
+
+    # Вес нового наблюдения в скользящем среднем времени обслуживания
+    SMOOTHING = 0.2
+
+    def __init__(self, max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+                 max_queue: int = OLLAMA_MAX_QUEUE,
+                 expected_service_time: float = OLLAMA_EXPECTED_SERVICE_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.service_time = expected_service_time
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает слот на время блока; при переполнении очереди - InferenceOverloaded"""
+        await self.acquire()
+        start_time = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            # Отмененный запрос не показывает, сколько длится обслуживание
+            cancelled = isinstance(e, (asyncio.CancelledError, GeneratorExit))
+            self.release(None if cancelled else time.perf_counter() - start_time)
+            raise
+        self.release(time.perf_counter() - start_time)
+
+    async def acquire(self):
+        with self._lock:
+            if self.in_flight < self.max_concurrency and not self._waiters:
+                self.in_flight += 1
+                self._publish()
+                metrics.observe("ollama.queue_wait_seconds", 0.0)
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                retry_after = self._retry_after()
+                metrics.inc("ollama.rejected")
+                raise InferenceOverloaded(retry_after)
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self._publish()
+
+        start_time = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # Слот уже был передан этому запросу - отдаем следующему
+                    self._release()
+                self._publish()
+            raise
+        metrics.observe("ollama.queue_wait_seconds", time.perf_counter() - start_time)
+
+    def release(self, service_time: float = None):
+        with self._lock:
+            if service_time is not None:
+                self.service_time += self.SMOOTHING * (service_time - self.service_time)
+                metrics.observe("ollama.service_seconds", service_time)
+            self._release()
+            self._publish()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": len(self._waiters),
+                "rejected": self.rejected,
+                "avg_service_seconds": round(self.service_time, 3),
+                "retry_after": self._retry_after()
+            }
+
+    def _release(self):
+        # Слот переходит первому ожидающему, счетчик in_flight не меняется
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _retry_after(self) -> int:
+        # Запросы впереди плюс этот, обслуживаемые max_concurrency параллельно
+        ahead = len(self._waiters) + 1
+        return max(1, math.ceil(ahead * self.service_time / self.max_concurrency))
+
+    def _publish(self):
+        metrics.set("ollama.in_flight", self.in_flight)
+        metrics.set("ollama.queue_depth", len(self._waiters))
+
+inference_limiter = InferenceLimiter()
@@ -0,0 +1,71 @@
+"""
+Разбор текста ответа Ollama со списком ингредиентов.
+
+Модель отвечает JSON вида {"ingredients": ["a", "b", ...]}, и каждый
+ингредиент можно отдать пользователю, как только закрылась его строка,
+не дожидаясь конца ответа. Тот же парсер забирает завершенные элементы
+из ответа, обрезанного на пределе токенов. Модуль не зависит от клиента
+Ollama и используется и обычным, и потоковым анализом.
+"""
+import json
+import re
+
+def clean_ingredient_name(ingredient: str) -> str:
+    """Очищает название ингредиента от лишних символов"""
+    # Убираем маркеры списка, кавычки и лишние пробелы
+    clean = re.sub(r'^[\-\*•\d\.\s"\']+|[\-\*•\d\.\s"\']+$', '', ingredient)
+    return clean.strip() if clean and len(clean) > 1 else ingredient
+
+_ARRAY_START = re.compile(r'"ingredients"\s*:\s*\[')
+
+class IngredientStreamParser:
+    """Инкрементальный разбор массива "ingredients" из растущего JSON"""
+
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self._pos = None  # позиция сразу после '[' массива ingredients
+        self._string_start = None  # начало незакрытой строки (с кавычкой)
+        self._escaped = False
+
+    def feed(self, chunk: str) -> list:
+        """Добавляет кусок ответа, возвращает новые завершенные ингредиенты"""
+        self.text += chunk
+        if self.done:
+            return []
+
+        if self._pos is None:
+            match = _ARRAY_START.search(self.text)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        found = []
+        while self._pos < len(self.text):
+            char = self.text[self._pos]
+            if self._string_start is not None:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    name = self._decode(self.text[self._string_start:self._pos + 1])
+                    if name:
+                        found.append(name)
+                    self._string_start = None
+            elif char == '"':
+                self._string_start = self._pos
+            elif char == ']':
+                self.done = True
+                self._pos += 1
+                break
+            self._pos += 1
+        return found
+
+    @staticmethod
+    def _decode(literal: str):
+        try:
+            value = json.loads(literal)
+        except json.JSONDecodeError:
+            return None
+        return clean_ingredient_name(value) if value else None
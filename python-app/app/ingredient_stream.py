@@ -0,0 +1,93 @@
+"""
+Потоковый анализ изображения: ингредиенты отдаются по мере генерации
+ответа Ollama (разбор - в ingredient_parsing).
+"""
+import asyncio
+import base64
+import time
+import httpx
+from contextlib import aclosing
+from . import funcs
+from .funcs import parse_ollama_response
+from .ingredient_parsing import IngredientStreamParser
+from .inference_cache import find_cached_analysis, store_analysis, cached_result
+from .inference_limiter import inference_limiter, InferenceOverloaded
+from .circuit_breaker import ollama_breaker
+from .resolution_policy import resolution_policy, image_long_side, LEVELS
+from .metrics import metrics
+
+async def analyze_image_stream(image_data: bytes):
+    """
+    Потоковый анализ изображения. Отдает ("ingredient", имя) по мере
+    распознавания и в конце ("result", результат) в формате
+    analyze_image_with_fallback. Если поток Ollama оборвался, анализ
+    повторяется обычным путем (с повторами и fallback), и досылаются
+    ингредиенты, которых еще не было.
+    """
+    start_time = time.perf_counter()
+    emitted = []
+
+    def emit(name):
+        if not emitted:
+            metrics.observe("analysis.time_to_first_ingredient_seconds", time.perf_counter() - start_time)
+        emitted.append(name)
+        return ("ingredient", name)
+
+    key, phash, cached = await find_cached_analysis(image_data)
+    if cached is not None:
+        result = cached_result(cached)
+        for name in result['ingredients']:
+            yield emit(name)
+        yield ("result", result)
+        return
+
+    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    # Поток не повторяется с меньшим разрешением, поэтому сразу берем подходящее
+    long_side = image_long_side(image_data)
+    level = resolution_policy.choose(long_side)
+    max_size, quality = LEVELS[level]
+    stream_base64 = image_base64
+    if max_size is not None:
+        compressed_data = await funcs.compress_image(image_data, max_size=max_size, quality=quality)
+        stream_base64 = base64.b64encode(compressed_data).decode('utf-8')
+    parser = IngredientStreamParser()
+    call_start = None
+    try:
+        async with ollama_breaker.protect():
+            async with inference_limiter.slot():
+                call_start = time.perf_counter()
+                # Генератор закрывается сразу, если закрыт этот поток (клиент отключился)
+                async with aclosing(funcs.stream_ollama_chat(stream_base64)) as pieces:
+                    async for piece in pieces:
+                        for name in parser.feed(piece):
+                            yield emit(name)
+
+        if not parser.text:
+            raise ValueError("Empty response from Ollama")
+        # Статистика уровня разрешения - как у попыток call_ollama_with_retry
+        resolution_policy.record(long_side, level, True, time.perf_counter() - call_start)
+        # Полный разбор как у обычного запроса: ответ мог быть и не в JSON
+        ingredients = parse_ollama_response(parser.text)
+        if not ingredients:
+            raise ValueError("No ingredients extracted from Ollama response")
+        result = {
+            "ingredients": ingredients,
+            "warnings": [],
+            "original_response": parser.text,
+            "source": "ollama"
+        }
+        await store_analysis(key, result, phash)
+
+    except InferenceOverloaded:
+        raise
+    except Exception as e:
+        if call_start is not None and isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)):
+            resolution_policy.record(long_side, level, False, time.perf_counter() - call_start)
+        print(f"Потоковый анализ прерван, повторяем обычным запросом: {e}")
+        result = await funcs.analyze_image_with_fallback(image_base64, image_data)
+        await store_analysis(key, result, phash)
+
+    for name in result['ingredients']:
+        if name not in emitted:
+            yield emit(name)
+    yield ("result", result)
@@ -0,0 +1,50 @@
+"""
+Нормализованное хранение ингредиентов анализов.
+
+Имена ингредиентов интернируются в словарь ingredients, состав
+анализа с флагами хранится в analysis_ingredients по целочисленным id.
+"""
+
+def normalize_ingredients(raw_ingredients) -> list:
+    """
+    Приводит ингредиенты из analysis_result к виду
+    [(name, is_allergen, is_contraindication), ...].
+    Поддерживает оба формата: список строк и список словарей.
+    """
+    normalized = []
+    for item in raw_ingredients or []:
+        if isinstance(item, str):
+            name, is_allergen, is_contraindication = item, False, False
+        elif isinstance(item, dict):
+            name = item.get('name', '')
+            is_allergen = bool(item.get('is_allergen', False))
+            is_contraindication = bool(item.get('is_contraindication', False))
+        else:
+            continue
+        if name:
+            normalized.append((name, is_allergen, is_contraindication))
+    return normalized
+
+def store_analysis_ingredients(cur, analysis_id: int, ingredients: list):
+    """Записывает состав анализа, добавляя новые имена в словарь ingredients"""
+    if not ingredients:
+        return
+
+    names = list({name for name, _, _ in ingredients})
+    cur.executemany(
+        'INSERT OR IGNORE INTO ingredients (name, name_lower) VALUES (?, ?)',
+        [(name, name.lower()) for name in names]
+    )
+    placeholders = ','.join('?' * len(names))
+    ids = dict(cur.execute(
+        f'SELECT name, id FROM ingredients WHERE name IN ({placeholders})', names
+    ).fetchall())
+
+    cur.executemany('''
+        INSERT INTO analysis_ingredients
+        (analysis_id, position, ingredient_id, is_allergen, is_contraindication)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (analysis_id, position, ids[name], int(is_allergen), int(is_contraindication))
+        for position, (name, is_allergen, is_contraindication) in enumerate(ingredients)
+    ])
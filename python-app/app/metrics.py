@@ -0,0 +1,60 @@
+import threading
+
+class Metrics:
+    """
+    Простой потокобезопасный реестр метрик процесса.
+
+    counters - монотонно растущие счетчики,
+    gauges - текущие значения,
+    timings - наблюдения (count/sum/max/last), например длительности в секундах.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name: str, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            timing = self._timings.setdefault(
+                name, {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0}
+            )
+            timing["count"] += 1
+            timing["sum"] += value
+            timing["max"] = max(timing["max"], value)
+            timing["last"] = value
+
+    def get(self, name: str, default=0):
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name]
+            return self._gauges.get(name, default)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                timings[name] = dict(timing)
+                timings[name]["avg"] = timing["sum"] / timing["count"] if timing["count"] else 0.0
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": timings
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+metrics = Metrics()
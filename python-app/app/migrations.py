@@ -0,0 +1,319 @@
+"""
+Версионированные миграции схемы БД.
+
+Номер последней примененной миграции хранится в PRAGMA user_version.
+Каждая миграция выполняется в отдельной транзакции вместе с обновлением
+user_version, поэтому прерванный запуск безопасно повторяется.
+Новые миграции добавляются только в конец списка MIGRATIONS.
+"""
+import json
+from .ingredients import normalize_ingredients, store_analysis_ingredients
+from .search import index_analyses
+from .perceptual_hash import PHASH_CHUNKS
+
+def _baseline_schema(cur):
+    """1: исходная схема (совпадает с тем, что раньше создавал init_db)"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(20) DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(id),
+            token VARCHAR(255) UNIQUE NOT NULL,
+            token_type VARCHAR(10) NOT NULL DEFAULT 'access',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_medical_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE REFERENCES users(id),
+            contraindications TEXT,
+            allergens TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS saved_analyses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(id),
+            image_path TEXT NOT NULL,
+            analysis_result TEXT NOT NULL,
+            ingredients_count INTEGER DEFAULT 0,
+            warnings_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)')
+
+def _token_expiry_as_epoch(cur):
+    """2: user_tokens.expires_at из ISO-строки в целые epoch-секунды"""
+    cur.execute('''
+        CREATE TABLE user_tokens_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(id),
+            token VARCHAR(255) UNIQUE NOT NULL,
+            token_type VARCHAR(10) NOT NULL DEFAULT 'access',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+
+    # Старые значения писались через datetime.now().isoformat(), то есть в локальном времени
+    cur.execute('''
+        INSERT INTO user_tokens_new (id, user_id, token, token_type, created_at, expires_at)
+        SELECT id, user_id, token, token_type, created_at,
+               CASE typeof(expires_at)
+                   WHEN 'integer' THEN expires_at
+                   ELSE CAST(strftime('%s', expires_at, 'utc') AS INTEGER)
+               END
+        FROM user_tokens
+        WHERE expires_at IS NOT NULL
+    ''')
+
+    cur.execute('DROP TABLE user_tokens')
+    cur.execute('ALTER TABLE user_tokens_new RENAME TO user_tokens')
+
+def _hot_path_indexes(cur):
+    """3: индексы под запросы авторизации, очистки токенов и списка анализов"""
+    # Проверка токена: WHERE token = ? AND token_type = ? AND expires_at > ?
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tokens_lookup
+        ON user_tokens(token, token_type, expires_at)
+    ''')
+    # Фоновая очистка просроченных токенов
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_tokens_expires ON user_tokens(expires_at)')
+    # Выход, вход и удаление аккаунта удаляют токены по user_id
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_tokens_user ON user_tokens(user_id)')
+
+    # Список анализов пользователя с сортировкой по дате
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_analyses_user_created
+        ON saved_analyses(user_id, created_at)
+    ''')
+    # Покрывается составным индексом выше
+    cur.execute('DROP INDEX IF EXISTS idx_analyses_user')
+
+    # Сортировка списка пользователей в админ-панели
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)')
+
+def _normalized_ingredients(cur):
+    """4: словарь ingredients и состав анализов analysis_ingredients"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS ingredients (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            name_lower TEXT NOT NULL
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_ingredients (
+            analysis_id INTEGER NOT NULL REFERENCES saved_analyses(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            ingredient_id INTEGER NOT NULL REFERENCES ingredients(id),
+            is_allergen INTEGER NOT NULL DEFAULT 0,
+            is_contraindication INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (analysis_id, position)
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_analysis_ingredients_ingredient
+        ON analysis_ingredients(ingredient_id)
+    ''')
+
+    # Переносим состав уже сохраненных анализов из JSON
+    rows = cur.execute('SELECT id, analysis_result FROM saved_analyses').fetchall()
+    for analysis_id, analysis_result in rows:
+        try:
+            raw_ingredients = json.loads(analysis_result).get('ingredients', [])
+        except (ValueError, AttributeError):
+            print(f"Анализ {analysis_id}: некорректный analysis_result, состав не перенесен")
+            continue
+        store_analysis_ingredients(cur, analysis_id, normalize_ingredients(raw_ingredients))
+
+def _analyses_search_index(cur):
+    """5: полнотекстовый индекс analyses_fts по ингредиентам и предупреждениям"""
+    cur.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5(
+            ingredients,
+            warnings,
+            owner,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS saved_analyses_fts_delete
+        AFTER DELETE ON saved_analyses
+        BEGIN
+            DELETE FROM analyses_fts WHERE rowid = old.id;
+        END
+    ''')
+    index_analyses(cur, '1', ())
+
+def _analyses_keyset_index(cur):
+    """6: индекс под постраничный список анализов с фильтром по предупреждениям"""
+    # Страница без фильтра идет по idx_analyses_user_created: rowid (id) хранится
+    # в индексе последним столбцом, так что ключ (created_at, id) уже упорядочен.
+    # С фильтром "безопасные"/"с предупреждениями" нужен индекс, где признак
+    # стоит перед датой, иначе страница перебирает все неподходящие записи.
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_analyses_user_warned_created
+        ON saved_analyses(user_id, warnings_count > 0, created_at)
+    ''')
+
+def _users_search_index(cur):
+    """7: индексы поиска и постраничного списка пользователей в админ-панели"""
+    # Префиксный поиск и сортировка по имени без учета регистра
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_username_nocase
+        ON users(username COLLATE NOCASE)
+    ''')
+    # Фильтр по ролям: каждая роль читается своей уже упорядоченной ветвью
+    # UNION ALL, и ветви сливаются без сортировки
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_role_username
+        ON users(role, username COLLATE NOCASE)
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_users_role_created ON users(role, created_at)')
+    # Покрывается idx_users_role_created
+    cur.execute('DROP INDEX IF EXISTS idx_users_role')
+
+    # Поиск подстроки в имени: триграммный индекс поверх таблицы users
+    cur.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username,
+            content = 'users',
+            content_rowid = 'id',
+            tokenize = 'trigram'
+        )
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+            INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+        END
+    ''')
+    cur.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+def _inference_cache(cur):
+    """8: кэш результатов распознавания по SHA-256 изображения, модели и версии промпта"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS inference_cache (
+            image_sha256 TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_version INTEGER NOT NULL,
+            ingredients TEXT NOT NULL,
+            original_response TEXT,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            PRIMARY KEY (image_sha256, model, prompt_version)
+        ) WITHOUT ROWID
+    ''')
+    # Удаление записей с истекшим TTL и вытеснение давно не использованных
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_inference_cache_created ON inference_cache(created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_inference_cache_last_used ON inference_cache(last_used_at)')
+
+def _inference_cache_phash(cur):
+    """9: перцептивный хэш изображения в кэше распознавания для поиска почти одинаковых"""
+    cur.execute('ALTER TABLE inference_cache ADD COLUMN phash INTEGER')
+    # Части хэша по 16 бит, см. perceptual_hash
+    for i in range(PHASH_CHUNKS):
+        cur.execute(f'ALTER TABLE inference_cache ADD COLUMN phash_{i} INTEGER')
+        cur.execute(f'CREATE INDEX IF NOT EXISTS idx_inference_cache_phash_{i} ON inference_cache(phash_{i})')
+
+def _revoked_access_tokens(cur):
+    """10: список отзыва подписанных access токенов"""
+    # Базы, созданные раньше, могли получить таблицу вместе с исходной схемой
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_access_tokens (
+            user_id INTEGER PRIMARY KEY,
+            revoked_before REAL NOT NULL
+        )
+    ''')
+    # Удаление записей старше времени жизни access токена
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_before
+        ON revoked_access_tokens(revoked_before)
+    ''')
+
+MIGRATIONS = [
+    _baseline_schema,
+    _token_expiry_as_epoch,
+    _hot_path_indexes,
+    _normalized_ingredients,
+    _analyses_search_index,
+    _analyses_keyset_index,
+    _users_search_index,
+    _inference_cache,
+    _inference_cache_phash,
+    _revoked_access_tokens,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(conn) -> int:
+    """
+    Применяет к БД все миграции новее ее текущей версии.
+
+    Returns:
+        количество примененных миграций
+    """
+    current_version = get_schema_version(conn)
+    applied = 0
+
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current_version:
+            continue
+
+        # Управляем транзакцией вручную, чтобы DDL и user_version коммитились вместе
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None
+        cur = conn.cursor()
+        try:
+            cur.execute('BEGIN')
+            migration(cur)
+            cur.execute(f'PRAGMA user_version = {version}')
+            cur.execute('COMMIT')
+        except Exception:
+            cur.execute('ROLLBACK')
+            raise
+        finally:
+            conn.isolation_level = isolation_level
+
+        print(f"Применена миграция БД {version}: {migration.__doc__.split(':', 1)[1].strip()}")
+        applied += 1
+
+    return applied
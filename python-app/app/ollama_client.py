@@ -0,0 +1,291 @@
+import asyncio
+import threading
+import time
+from contextlib import aclosing
+import httpx
+import ollama
+from .config import (
+    OLLAMA_HOSTS, OLLAMA_MODEL, OLLAMA_POOL_SIZE, OLLAMA_KEEP_ALIVE,
+    OLLAMA_KEEP_ALIVE_PING_SECONDS, OLLAMA_WARMUP, OLLAMA_HOST_EJECT_FAILURES, OLLAMA_HOST_PROBE_SECONDS
+)
+from .metrics import metrics
+
+# Длительности в ответах Ollama - в наносекундах
+NANOSECONDS = 1_000_000_000
+
+class OllamaHost:
+    """Состояние одного сервера Ollama для диспетчера"""
+
+    # Вес нового замера в скользящем среднем времени ответа
+    SMOOTHING = 0.3
+
+    def __init__(self, url: str, client):
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.ejected_at = None
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "avg_latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+class OllamaClient:
+    """
+    Долгоживущие асинхронные клиенты Ollama с балансировкой между серверами.
+
+    На каждый адрес из OLLAMA_HOSTS - один ollama.AsyncClient с пулом
+    keep-alive соединений. Запрос уходит на исправный сервер с наименьшим
+    числом выполняющихся запросов (при равенстве - с меньшим средним временем
+    ответа). После eject_failures ошибок подряд сервер исключается; раз в
+    probe_interval секунд исключенные серверы проверяются легким запросом
+    списка моделей и при ответе возвращаются в работу. Если исключены все,
+    запросы все равно идут на них: решение об отказе принимает автомат защиты.
+
+    При старте модель загружается на каждом сервере пустым запросом (warm-up),
+    а затем каждые ping_interval секунд такой же запрос продлевает keep_alive,
+    чтобы модель не выгружалась между анализами. Время загрузки модели и время
+    самого распознавания учитываются в метриках раздельно.
+    Запускается из lifespan приложения.
+    """
+
+    def __init__(self, hosts: list = OLLAMA_HOSTS, model: str = OLLAMA_MODEL,
+                 pool_size: int = OLLAMA_POOL_SIZE, keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 ping_interval: float = OLLAMA_KEEP_ALIVE_PING_SECONDS, warmup: bool = OLLAMA_WARMUP,
+                 eject_failures: int = OLLAMA_HOST_EJECT_FAILURES,
+                 probe_interval: float = OLLAMA_HOST_PROBE_SECONDS):
+        self.urls = list(hosts)
+        self.model = model
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.ping_interval = ping_interval
+        self.warmup = warmup
+        self.eject_failures = eject_failures
+        self.probe_interval = probe_interval
+        self.model_loaded = False
+        self.last_load_seconds = None
+        self.last_ping_at = None
+        self.pings = 0
+        self.ping_errors = 0
+        self.hosts = []
+        self._tasks = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Создает клиентов в текущем event loop и запускает фоновые прогрев и проверки"""
+        self._ensure_hosts()
+        if self._tasks:
+            return
+        if self.warmup or self.ping_interval > 0:
+            self._tasks.append(asyncio.create_task(self._keep_model_loaded()))
+        if len(self.hosts) > 1:
+            self._tasks.append(asyncio.create_task(self._probe_ejected()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for host in self.hosts:
+            await host.client._client.aclose()
+        self.hosts = []
+
+    async def chat(self, **kwargs):
+        """AsyncClient.chat на выбранном сервере с keep_alive модели"""
+        host = self._acquire()
+        start_time = time.perf_counter()
+        try:
+            response = await host.client.chat(model=self.model, keep_alive=self.keep_alive, **kwargs)
+        except Exception:
+            self._release(host, success=False)
+            raise
+        except BaseException:
+            # Отмена (таймаут попытки, отключение клиента) не говорит о неисправности сервера
+            metrics.inc("ollama.cancelled")
+            self._release(host, success=None)
+            raise
+        self._release(host, success=True, latency=time.perf_counter() - start_time)
+        self._record_durations(response)
+        return response
+
+    async def chat_stream(self, **kwargs):
+        """Потоковый chat: отдает куски ответа, длительности приходят в последнем"""
+        host = self._acquire()
+        start_time = time.perf_counter()
+        try:
+            chunks = await host.client.chat(
+                model=self.model, keep_alive=self.keep_alive, stream=True, **kwargs
+            )
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    if chunk.get('done'):
+                        self._record_durations(chunk)
+                    yield chunk
+        except Exception:
+            self._release(host, success=False)
+            raise
+        except BaseException:
+            # Закрытие потока или отмена: HTTP-запрос к Ollama уже прерван
+            metrics.inc("ollama.cancelled")
+            self._release(host, success=None)
+            raise
+        self._release(host, success=True, latency=time.perf_counter() - start_time)
+
+    async def ping(self):
+        """Пустой запрос на каждый сервер: загружает модель и продлевает keep_alive"""
+        self._ensure_hosts()
+        results = await asyncio.gather(*(self._ping_host(host) for host in self.hosts), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        self.pings += 1
+        self.last_ping_at = time.time()
+        self.model_loaded = len(errors) < len(results)
+        if not self.model_loaded:
+            raise errors[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            hosts = [host.stats() for host in self.hosts]
+        return {
+            "model": self.model,
+            "model_loaded": self.model_loaded,
+            "last_load_seconds": self.last_load_seconds,
+            "last_ping_at": self.last_ping_at,
+            "pings": self.pings,
+            "ping_errors": self.ping_errors,
+            "healthy_hosts": sum(host["healthy"] for host in hosts),
+            "hosts": hosts
+        }
+
+    def _create_client(self, url: str):
+        return ollama.AsyncClient(
+            host=url,
+            # Таймаут чтения - как num_timeout запроса распознавания
+            timeout=httpx.Timeout(420, connect=10),
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size
+            )
+        )
+
+    def _ensure_hosts(self):
+        # Вне lifespan (скрипты, тесты) клиенты создаются при первом запросе
+        if not self.hosts:
+            self.hosts = [OllamaHost(url, self._create_client(url)) for url in self.urls]
+            self._publish()
+
+    def _acquire(self) -> OllamaHost:
+        """Сервер для запроса: исправный с наименьшим числом выполняющихся запросов"""
+        self._ensure_hosts()
+        with self._lock:
+            candidates = [host for host in self.hosts if host.healthy] or self.hosts
+            host = min(candidates, key=lambda h: (h.outstanding, h.latency if h.latency is not None else 0.0))
+            host.outstanding += 1
+            host.requests += 1
+            return host
+
+    def _release(self, host: OllamaHost, success, latency: float = None):
+        """success: True/False - учесть результат, None - только освободить"""
+        with self._lock:
+            host.outstanding -= 1
+            if success is None:
+                return
+            if success:
+                host.consecutive_failures = 0
+                if latency is not None:
+                    host.latency = latency if host.latency is None else \
+                        host.latency + OllamaHost.SMOOTHING * (latency - host.latency)
+                self._readmit(host)
+            else:
+                host.failures += 1
+                host.consecutive_failures += 1
+                if host.healthy and host.consecutive_failures >= self.eject_failures:
+                    self._eject(host)
+
+    def _eject(self, host: OllamaHost):
+        host.healthy = False
+        host.ejected_at = time.monotonic()
+        metrics.inc("ollama.host_ejected")
+        print(f"Сервер Ollama {host.url} исключен после {host.consecutive_failures} ошибок подряд")
+        self._publish()
+
+    def _readmit(self, host: OllamaHost):
+        if not host.healthy:
+            host.healthy = True
+            host.ejected_at = None
+            host.consecutive_failures = 0
+            print(f"Сервер Ollama {host.url} снова в работе")
+            self._publish()
+
+    def _publish(self):
+        metrics.set("ollama.healthy_hosts", sum(host.healthy for host in self.hosts))
+
+    async def _probe(self, host: OllamaHost):
+        """Легкий запрос к исключенному серверу; ответ возвращает его в работу"""
+        try:
+            await host.client.list()
+        except Exception as e:
+            print(f"Сервер Ollama {host.url} пока недоступен: {e}")
+            with self._lock:
+                host.ejected_at = time.monotonic()
+            return
+        with self._lock:
+            self._readmit(host)
+
+    async def _probe_ejected(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            due = [
+                host for host in self.hosts
+                if not host.healthy and time.monotonic() - host.ejected_at >= self.probe_interval
+            ]
+            await asyncio.gather(*(self._probe(host) for host in due))
+
+    async def _ping_host(self, host: OllamaHost):
+        start_time = time.perf_counter()
+        try:
+            response = await host.client.generate(model=self.model, prompt='', keep_alive=self.keep_alive)
+        except Exception as e:
+            print(f"Не удалось загрузить модель {self.model} на {host.url}: {e}")
+            raise
+        load_seconds = self._record_durations(response)
+        print(f"Модель {self.model} на {host.url} готова за {time.perf_counter() - start_time:.1f} с"
+              f" (загрузка {load_seconds or 0:.1f} с)")
+
+    def _record_durations(self, response):
+        """Метрики загрузки модели и распознавания из ответа Ollama. Возвращает время загрузки"""
+        load_duration = response.get('load_duration') or 0
+        total_duration = response.get('total_duration') or 0
+        load_seconds = load_duration / NANOSECONDS
+        if load_duration:
+            self.last_load_seconds = load_seconds
+            metrics.observe("ollama.model_load_seconds", load_seconds)
+        if total_duration:
+            metrics.observe("ollama.inference_seconds", (total_duration - load_duration) / NANOSECONDS)
+        return load_seconds
+
+    async def _keep_model_loaded(self):
+        if not self.warmup:
+            await asyncio.sleep(self.ping_interval)
+        while True:
+            try:
+                await self.ping()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.ping_errors += 1
+                print(f"Не удалось загрузить модель {self.model}: {e}")
+            if self.ping_interval <= 0:
+                return
+            await asyncio.sleep(self.ping_interval)
+
+ollama_client = OllamaClient()
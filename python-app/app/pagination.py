@@ -0,0 +1,52 @@
+"""
+Курсорная (keyset) пагинация.
+
+Курсор - непрозрачная для клиента строка с ключом сортировки последней
+выданной записи. Следующая страница начинается строго после этого ключа,
+поэтому ее стоимость не зависит от номера страницы.
+"""
+import base64
+import json
+from fastapi import HTTPException, status
+
+def encode_cursor(*key) -> str:
+    """Упаковывает ключ сортировки записи в курсор"""
+    raw = json.dumps(key, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """
+    Распаковывает курсор и проверяет типы элементов ключа.
+
+    Raises:
+        ValueError: курсор поврежден или не подходит к этому списку
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Некорректный курсор") from e
+
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(type(value) is expected for value, expected in zip(key, types))):
+        raise ValueError("Некорректный курсор")
+    return tuple(key)
+
+def cursor_key(cursor: str, *types):
+    """Ключ из курсора запроса (None без курсора) или 400"""
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor, *types)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def next_cursor(page: list, limit: int, *fields):
+    """
+    Курсор следующей страницы по полям fields последней записи.
+    page запрашивается с limit + 1 записями: лишняя запись говорит, что страница не последняя.
+    """
+    if len(page) <= limit:
+        return None
+    last = page[limit - 1]
+    return encode_cursor(*(last[field] for field in fields))
@@ -0,0 +1,69 @@
+"""
+Перцептивный хэш (dHash) для поиска почти одинаковых изображений.
+
+dHash - 64 бита: изображение уменьшается до 9x8 в оттенках серого, и каждый
+бит показывает, ярче ли пиксель своего правого соседа. Повторная съемка той
+же упаковки или пересжатие телефоном меняют лишь несколько бит, поэтому
+похожесть измеряется расстоянием Хэмминга.
+
+Для поиска в SQLite хэш делится на PHASH_CHUNKS частей по 16 бит, каждая
+в своем индексированном столбце (multi-index hashing): если расстояние
+не больше d, то хотя бы одна часть отличается не более чем на d // PHASH_CHUNKS бит.
+"""
+import io
+from itertools import combinations
+from PIL import Image
+
+PHASH_BITS = 64
+PHASH_CHUNKS = 4
+CHUNK_BITS = PHASH_BITS // PHASH_CHUNKS
+
+# Почти однотонная картинка дает хэш из одних нулей и совпала бы с любой другой такой же
+MIN_CONTRAST = 16
+
+def dhash(image: Image.Image):
+    """dHash декодированного изображения или None, если в нем нет деталей"""
+    gray = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = gray.tobytes()
+    if max(pixels) - min(pixels) < MIN_CONTRAST:
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def dhash_from_bytes(image_data: bytes):
+    """dHash из байтов файла; JPEG декодируется сразу в уменьшенном размере"""
+    with Image.open(io.BytesIO(image_data)) as image:
+        image.draft('L', (64, 64))
+        return dhash(image)
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def chunks(value: int) -> list:
+    """Части хэша по CHUNK_BITS бит, от старших к младшим"""
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * (PHASH_CHUNKS - 1 - i))) & mask for i in range(PHASH_CHUNKS)]
+
+def chunk_neighbors(chunk: int, radius: int) -> list:
+    """Все значения части на расстоянии Хэмминга не больше radius"""
+    result = [chunk]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            result.append(flipped)
+    return result
+
+def to_signed(value: int) -> int:
+    """64-битный хэш в знаковое целое, которое помещается в INTEGER SQLite"""
+    return value - (1 << PHASH_BITS) if value >= 1 << (PHASH_BITS - 1) else value
+
+def from_signed(value: int) -> int:
+    return value + (1 << PHASH_BITS) if value < 0 else value
@@ -0,0 +1,726 @@
+"""
+Асинхронный слой доступа к данным.
+
+Чтение из SQLite выполняется в отдельном ограниченном пуле потоков
+с соединением из пула соединений, запись - через единственного писателя
+с групповым коммитом (db_writer), поэтому обработчики маршрутов никогда
+не блокируют event loop. Каждая функция атомарна: выход без исключения
+фиксирует ее изменения, исключение - откатывает.
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .db import get_db_connection
+from .db_writer import db_writer
+from .config import DB_EXECUTOR_WORKERS, SEARCH_RANKED_MAX_MATCHES
+from .funcs import (
+    get_user_by_token, generate_token_pair_with_conn,
+    revoke_user_tokens as _revoke_user_tokens, user_tokens_revoked as _user_tokens_revoked
+)
+from .signed_tokens import is_signed_token, verify_access_token
+from .token_cache import token_cache
+from .ingredients import normalize_ingredients, store_analysis_ingredients
+from .search import index_analyses, owner_match_query, RANK
+from .perceptual_hash import (
+    PHASH_CHUNKS, chunks as phash_chunks, chunk_neighbors, hamming, to_signed, from_signed
+)
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+USER_FIELDS = 'id, username, email, role, created_at'
+ANALYSIS_FIELDS = '''id, user_id, image_path, ingredients_count, warnings_count, created_at,
+               CASE WHEN json_valid(analysis_result)
+                    THEN json_remove(analysis_result, '$.ingredients') END AS analysis_rest'''
+
+async def run_db(func, *args):
+    """Выполняет func(conn, *args) в пуле потоков БД"""
+    def call():
+        with get_db_connection() as conn:
+            return func(conn, *args)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, call)
+
+async def run_write(func, *args):
+    """
+    Выполняет запись func(conn, *args) через единственного писателя
+    с групповым коммитом. Если писатель не запущен в текущем event loop
+    (вне lifespan приложения), запись выполняется отдельной транзакцией.
+    """
+    if db_writer.is_running():
+        return await db_writer.submit(func, *args)
+    return await run_db(func, *args)
+
+async def run_in_db_executor(func, *args):
+    """Выполняет блокирующую функцию, которая сама берет соединение, в пуле потоков БД"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+# --- Токены и авторизация ---
+
+async def resolve_user_by_token(token: str, token_type: str = 'access'):
+    """
+    Пользователь по токену. Подписанные и закэшированные токены
+    проверяются прямо в event loop, в БД идем только при промахе кэша.
+    """
+    if token_type == 'access' and is_signed_token(token):
+        return verify_access_token(token)
+
+    cached_user = token_cache.get(token, token_type)
+    if cached_user is not None:
+        return cached_user
+
+    return await run_in_db_executor(get_user_by_token, token, token_type)
+
+async def issue_login_tokens(user_id: int) -> dict:
+    """Удаляет старые токены пользователя и выдает новую пару"""
+    revoked_before = time.time()
+
+    def query(conn):
+        conn.execute('DELETE FROM user_tokens WHERE user_id = ?', (user_id,))
+        _revoke_user_tokens(user_id, conn, revoked_before)
+        return generate_token_pair_with_conn(conn, user_id)
+
+    token_pair = await run_write(query)
+    # Кэш сбрасывается только после коммита удаления старых токенов
+    _user_tokens_revoked(user_id, revoked_before)
+    return token_pair
+
+async def rotate_refresh_token(refresh_token: str, now: int):
+    """
+    Меняет действующий refresh токен на новую пару токенов.
+
+    Returns:
+        (user, token_pair) или None, если токен недействителен
+    """
+    def query(conn):
+        user = conn.execute('''
+            SELECT u.id, u.username, u.email, u.created_at
+            FROM users u
+            JOIN user_tokens ut ON u.id = ut.user_id
+            WHERE ut.token = ? AND ut.expires_at > ? AND ut.token_type = ?
+        ''', (refresh_token, now, 'refresh')).fetchone()
+
+        if not user:
+            return None
+
+        # Удаляем только использованный refresh токен
+        conn.execute('DELETE FROM user_tokens WHERE token = ?', (refresh_token,))
+
+        return dict(user), generate_token_pair_with_conn(conn, user['id'])
+
+    result = await run_write(query)
+    token_cache.invalidate(refresh_token)
+    return result
+
+async def delete_user_tokens(user_id: int):
+    """Удаляет все токены пользователя и отзывает выданные access токены"""
+    revoked_before = time.time()
+
+    def query(conn):
+        conn.execute('DELETE FROM user_tokens WHERE user_id = ?', (user_id,))
+        _revoke_user_tokens(user_id, conn, revoked_before)
+
+    await run_write(query)
+    _user_tokens_revoked(user_id, revoked_before)
+
+# --- Пользователи ---
+
+async def find_user_by_username_or_email(username: str, email: str):
+    def query(conn):
+        return conn.execute(
+            'SELECT id FROM users WHERE username = ? OR email = ?', (username, email)
+        ).fetchone()
+
+    return await run_db(query)
+
+async def create_user(username: str, email: str, password_hash: str) -> dict:
+    def query(conn):
+        cur = conn.execute(
+            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+            (username, email, password_hash)
+        )
+        return dict(conn.execute(
+            f'SELECT {USER_FIELDS} FROM users WHERE id = ?', (cur.lastrowid,)
+        ).fetchone())
+
+    return await run_write(query)
+
+async def get_user_by_credentials(username: str, password_hash: str):
+    def query(conn):
+        row = conn.execute(
+            f'SELECT {USER_FIELDS} FROM users WHERE username = ? AND password_hash = ?',
+            (username, password_hash)
+        ).fetchone()
+        return dict(row) if row else None
+
+    return await run_db(query)
+
+async def get_user(user_id: int):
+    def query(conn):
+        row = conn.execute(f'SELECT {USER_FIELDS} FROM users WHERE id = ?', (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    return await run_db(query)
+
+async def is_username_taken(username: str, exclude_user_id: int) -> bool:
+    def query(conn):
+        return conn.execute(
+            'SELECT id FROM users WHERE username = ? AND id != ?', (username, exclude_user_id)
+        ).fetchone() is not None
+
+    return await run_db(query)
+
+async def is_email_taken(email: str, exclude_user_id: int) -> bool:
+    def query(conn):
+        return conn.execute(
+            'SELECT id FROM users WHERE email = ? AND id != ?', (email, exclude_user_id)
+        ).fetchone() is not None
+
+    return await run_db(query)
+
+async def update_user_profile(user_id: int, fields: dict) -> dict:
+    """Обновляет переданные поля (username, email) и возвращает пользователя"""
+    def query(conn):
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        conn.execute(
+            f'UPDATE users SET {assignments} WHERE id = ?',
+            [*fields.values(), user_id]
+        )
+        return dict(conn.execute(
+            'SELECT id, username, email, created_at FROM users WHERE id = ?', (user_id,)
+        ).fetchone())
+
+    return await run_write(query)
+
+async def check_password(user_id: int, password_hash: str) -> bool:
+    def query(conn):
+        return conn.execute(
+            'SELECT id FROM users WHERE id = ? AND password_hash = ?', (user_id, password_hash)
+        ).fetchone() is not None
+
+    return await run_db(query)
+
+async def update_password(user_id: int, password_hash: str):
+    def query(conn):
+        conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+
+    await run_write(query)
+
+async def get_user_image_paths(user_id: int) -> list:
+    def query(conn):
+        rows = conn.execute(
+            'SELECT image_path FROM saved_analyses WHERE user_id = ?', (user_id,)
+        ).fetchall()
+        return [row['image_path'] for row in rows]
+
+    return await run_db(query)
+
+async def delete_user_with_data(user_id: int):
+    """Удаляет пользователя со всеми анализами, медицинскими данными и токенами"""
+    revoked_before = time.time()
+
+    def query(conn):
+        conn.execute('DELETE FROM saved_analyses WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM user_medical_data WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM user_tokens WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        _revoke_user_tokens(user_id, conn, revoked_before)
+
+    await run_write(query)
+    _user_tokens_revoked(user_id, revoked_before)
+
+USER_SORT_KEYS = {
+    'username': 'username COLLATE NOCASE',
+    'created_at': 'created_at',
+}
+
+def _user_search(search: str):
+    """
+    Условие поиска по имени пользователя и его параметры.
+    От трех символов ищется подстрока по триграммному индексу users_fts,
+    короче - префикс по индексу idx_users_username_nocase.
+    """
+    if not search:
+        return None, []
+    if len(search) >= 3:
+        phrase = '"' + search.replace('"', '""') + '"'
+        return 'id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)', [phrase]
+    # Верхняя граница диапазона: любая строка с этим префиксом меньше prefix + U+10FFFF
+    return ('username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ?',
+            [search, search + '\U0010ffff'])
+
+def _role_branches(roles: list):
+    """Условия ветвей UNION ALL: по одной на роль (или одна без фильтра)"""
+    if not roles:
+        return [(None, [])]
+    return [('role = ?', [role]) for role in dict.fromkeys(roles)]
+
+async def filter_users(roles: list = None, sort_by: str = 'username', sort_order: str = 'asc',
+                       search: str = None, limit: int = None, after: tuple = None) -> list:
+    """
+    Страница пользователей с фильтром по ролям и поиском по имени.
+
+    Args:
+        sort_by: username (без учета регистра) или created_at, вторым ключом всегда id
+        after: ключ (значение sort_by, id) последней записи предыдущей страницы
+    """
+    sort_key = USER_SORT_KEYS[sort_by]
+    descending = sort_order.lower() == "desc"
+
+    def query(conn):
+        conditions, params = [], []
+
+        search_sql, search_params = _user_search(search)
+        if search_sql:
+            conditions.append(search_sql)
+            params.extend(search_params)
+
+        if after is not None:
+            # Эквивалент (sort_key, id) > (?, ?), но с диапазоном по индексу на sort_key
+            op = '<' if descending else '>'
+            conditions.append(f"{sort_key} {op}= ? AND ({sort_key} {op} ? OR id {op} ?)")
+            params.extend([after[0], after[0], after[1]])
+
+        # Каждая ветвь уже упорядочена своим индексом, SQLite сливает их без сортировки
+        branches, branch_params = [], []
+        for role_sql, role_params in _role_branches(roles):
+            where = ' AND '.join(([role_sql] if role_sql else []) + conditions) or '1'
+            branches.append(f"SELECT {USER_FIELDS} FROM users WHERE {where}")
+            branch_params.extend(role_params + params)
+
+        order = "DESC" if descending else "ASC"
+        sql = ' UNION ALL '.join(branches) + f" ORDER BY {sort_key} {order}, id {order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            branch_params.append(limit)
+
+        return [dict(row) for row in conn.execute(sql, branch_params).fetchall()]
+
+    return await run_db(query)
+
+async def count_users(roles: list = None, search: str = None) -> int:
+    """Количество пользователей под теми же фильтрами, что и filter_users"""
+    def query(conn):
+        conditions, params = [], []
+        if roles:
+            conditions.append(f"role IN ({','.join('?' for _ in roles)})")
+            params.extend(roles)
+        search_sql, search_params = _user_search(search)
+        if search_sql:
+            conditions.append(search_sql)
+            params.extend(search_params)
+
+        where = ' AND '.join(conditions) or '1'
+        return conn.execute(f"SELECT COUNT(*) FROM users WHERE {where}", params).fetchone()[0]
+
+    return await run_db(query)
+
+async def update_user_role(user_id: int, new_role: str):
+    revoked_before = time.time()
+
+    def query(conn):
+        conn.execute('UPDATE users SET role = ? WHERE id = ?', (new_role, user_id))
+        # Выданные ранее токены несут старую роль
+        _revoke_user_tokens(user_id, conn, revoked_before)
+
+    await run_write(query)
+    _user_tokens_revoked(user_id, revoked_before)
+
+# --- Медицинские данные ---
+
+async def get_medical_data(user_id: int):
+    def query(conn):
+        row = conn.execute(
+            'SELECT user_id, contraindications, allergens, updated_at FROM user_medical_data WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    return await run_db(query)
+
+async def save_medical_data(user_id: int, contraindications, allergens) -> dict:
+    """Создает или обновляет медицинские данные и возвращает сохраненную запись"""
+    def query(conn):
+        existing = conn.execute(
+            'SELECT id FROM user_medical_data WHERE user_id = ?', (user_id,)
+        ).fetchone()
+
+        if existing:
+            conn.execute(
+                '''UPDATE user_medical_data
+                   SET contraindications = ?, allergens = ?, updated_at = CURRENT_TIMESTAMP
+                   WHERE user_id = ?''',
+                (contraindications, allergens, user_id)
+            )
+        else:
+            conn.execute(
+                '''INSERT INTO user_medical_data (user_id, contraindications, allergens)
+                   VALUES (?, ?, ?)''',
+                (user_id, contraindications, allergens)
+            )
+
+        return dict(conn.execute(
+            'SELECT user_id, contraindications, allergens, updated_at FROM user_medical_data WHERE user_id = ?',
+            (user_id,)
+        ).fetchone())
+
+    return await run_write(query)
+
+# --- Сохраненные анализы ---
+
+def _load_analyses(conn, rows) -> list:
+    """
+    Собирает analysis_result выбранных анализов: состав и флаги - из
+    analysis_ingredients, остальные ключи (предупреждения, ответ модели и
+    любые другие) - как сохранены, без массива ingredients. Документ, который
+    не является JSON объектом, возвращается только с составом.
+    """
+    analyses = {}
+    for row in rows:
+        analysis = dict(row)
+        rest = analysis.pop('analysis_rest')
+        rest = json.loads(rest) if rest is not None else None
+        analysis['analysis_result'] = rest if isinstance(rest, dict) else {}
+        analysis['analysis_result']['ingredients'] = []
+        analyses[analysis['id']] = analysis
+
+    ids = list(analyses)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'''
+            SELECT ai.analysis_id, i.name, ai.is_allergen, ai.is_contraindication
+            FROM analysis_ingredients ai
+            JOIN ingredients i ON i.id = ai.ingredient_id
+            WHERE ai.analysis_id IN ({placeholders})
+            ORDER BY ai.analysis_id, ai.position
+        ''', chunk):
+            analyses[row['analysis_id']]['analysis_result']['ingredients'].append({
+                'name': row['name'],
+                'is_allergen': bool(row['is_allergen']),
+                'is_contraindication': bool(row['is_contraindication'])
+            })
+
+    return list(analyses.values())
+
+def _load_analysis(conn, analysis_id: int, user_id: int):
+    row = conn.execute(f'''
+        SELECT {ANALYSIS_FIELDS}
+        FROM saved_analyses
+        WHERE id = ? AND user_id = ?
+    ''', (analysis_id, user_id)).fetchone()
+    return _load_analyses(conn, [row])[0] if row else None
+
+async def insert_analysis(user_id: int, image_path: str, analysis_result: dict,
+                          ingredients_count: int, warnings_count: int) -> dict:
+    """Сохраняет анализ вместе с нормализованным составом и возвращает сохраненную запись"""
+    def query(conn):
+        cur = conn.execute('''
+            INSERT INTO saved_analyses
+            (user_id, image_path, analysis_result, ingredients_count, warnings_count)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, image_path, json.dumps(analysis_result), ingredients_count, warnings_count))
+        analysis_id = cur.lastrowid
+
+        raw_ingredients = analysis_result.get('ingredients', []) if isinstance(analysis_result, dict) else []
+        store_analysis_ingredients(conn, analysis_id, normalize_ingredients(raw_ingredients))
+        index_analyses(conn, 'id = ?', (analysis_id,))
+        return _load_analysis(conn, analysis_id, user_id)
+
+    return await run_write(query)
+
+async def get_saved_analyses(user_id: int, warnings_filter: str = None, sort_order: str = 'desc',
+                             limit: int = None, after: tuple = None) -> list:
+    """
+    Сохраненные анализы пользователя в порядке (created_at, id).
+
+    Args:
+        warnings_filter: None - все, 'safe' - без предупреждений, 'warnings' - с предупреждениями
+        sort_order: asc или desc по дате создания
+        limit: максимум записей (None - все)
+        after: ключ (created_at, id) последней записи предыдущей страницы
+    """
+    def query(conn):
+        sql = f'''
+            SELECT {ANALYSIS_FIELDS}
+            FROM saved_analyses
+            WHERE user_id = ?
+        '''
+        params = [user_id]
+        # Условие повторяет выражение индекса idx_analyses_user_warned_created
+        if warnings_filter == 'safe':
+            sql += " AND (warnings_count > 0) = 0"
+        elif warnings_filter == 'warnings':
+            sql += " AND (warnings_count > 0) = 1"
+
+        descending = sort_order.lower() == "desc"
+        if after is not None:
+            sql += f" AND (created_at, id) {'<' if descending else '>'} (?, ?)"
+            params.extend(after)
+
+        order = "DESC" if descending else "ASC"
+        sql += f" ORDER BY created_at {order}, id {order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        return _load_analyses(conn, conn.execute(sql, params).fetchall())
+
+    return await run_db(query)
+
+async def get_saved_analysis(analysis_id: int, user_id: int):
+    """Анализ пользователя с составом (None, если не найден)"""
+    return await run_db(_load_analysis, analysis_id, user_id)
+
+async def get_analysis(analysis_id: int, user_id: int):
+    """Запись анализа пользователя без состава (None, если не найдена)"""
+    def query(conn):
+        row = conn.execute('''
+            SELECT id, user_id, image_path
+            FROM saved_analyses
+            WHERE id = ? AND user_id = ?
+        ''', (analysis_id, user_id)).fetchone()
+        return dict(row) if row else None
+
+    return await run_db(query)
+
+def _contains_any(terms: list):
+    """Условие "name_lower содержит хотя бы один из terms" и его параметры"""
+    terms = [term for term in terms if term]
+    if not terms:
+        return '0', []
+    return '(' + ' OR '.join(['instr(i.name_lower, ?) > 0'] * len(terms)) + ')', terms
+
+async def reanalyze_analyses(user_id: int, allergens: list, contraindications: list,
+                             analysis_id: int = None):
+    """
+    Пересчитывает флаги ингредиентов и warnings_count анализов пользователя
+    (или одного анализа) по медицинским данным, целиком в SQL.
+    """
+    def query(conn):
+        allergen_sql, allergen_params = _contains_any(allergens)
+        contra_sql, contra_params = _contains_any(contraindications)
+
+        scope_sql = 'user_id = ?'
+        scope_params = [user_id]
+        if analysis_id is not None:
+            scope_sql += ' AND id = ?'
+            scope_params.append(analysis_id)
+
+        conn.execute(f'''
+            UPDATE analysis_ingredients
+            SET is_allergen = (
+                    SELECT {allergen_sql} FROM ingredients i
+                    WHERE i.id = analysis_ingredients.ingredient_id
+                ),
+                is_contraindication = (
+                    SELECT {contra_sql} FROM ingredients i
+                    WHERE i.id = analysis_ingredients.ingredient_id
+                )
+            WHERE analysis_id IN (SELECT id FROM saved_analyses WHERE {scope_sql})
+        ''', [*allergen_params, *contra_params, *scope_params])
+
+        # Предупреждения в сохраненном документе - по новым флагам, в порядке состава
+        conn.execute(f'''
+            UPDATE saved_analyses
+            SET warnings_count = (
+                    SELECT COALESCE(SUM(is_allergen + is_contraindication), 0)
+                    FROM analysis_ingredients
+                    WHERE analysis_id = saved_analyses.id
+                ),
+                analysis_result = CASE WHEN json_valid(analysis_result) THEN json_set(
+                    analysis_result,
+                    '$.warnings', json((
+                        SELECT json_group_array(text) FROM (
+                            SELECT 'Аллерген обнаружен: ' || i.name AS text, ai.position, 0 AS kind
+                            FROM analysis_ingredients ai
+                            JOIN ingredients i ON i.id = ai.ingredient_id
+                            WHERE ai.analysis_id = saved_analyses.id AND ai.is_allergen
+                            UNION ALL
+                            SELECT 'Противопоказание: ' || i.name, ai.position, 1
+                            FROM analysis_ingredients ai
+                            JOIN ingredients i ON i.id = ai.ingredient_id
+                            WHERE ai.analysis_id = saved_analyses.id AND ai.is_contraindication
+                            ORDER BY 2, 3
+                        )
+                    )),
+                    '$.original_response', COALESCE(
+                        json_extract(analysis_result, '$.original_response'),
+                        'Перепроверено с обновленными медицинскими данными'
+                    )
+                ) ELSE analysis_result END
+            WHERE {scope_sql}
+        ''', scope_params)
+
+        # Тексты предупреждений в поисковом индексе зависят от флагов
+        index_analyses(conn, scope_sql, scope_params)
+
+    await run_write(query)
+
+async def search_saved_analyses(user_id: int, match_query: str, limit: int, offset: int = 0):
+    """
+    Анализы пользователя, найденные полнотекстовым поиском.
+
+    Если совпадений не больше SEARCH_RANKED_MAX_MATCHES, выдача упорядочена
+    по релевантности (bm25), иначе - от новых к старым: ранжирование
+    тысяч почти одинаковых совпадений дорого и мало что дает.
+
+    Returns:
+        (список анализов, порядок выдачи: 'relevance' или 'recent')
+    """
+    def query(conn):
+        fts_query = owner_match_query(user_id, match_query)
+        matches = conn.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM analyses_fts WHERE analyses_fts MATCH ? LIMIT ?
+            )
+        ''', (fts_query, SEARCH_RANKED_MAX_MATCHES + 1)).fetchone()[0]
+
+        if matches <= SEARCH_RANKED_MAX_MATCHES:
+            order, order_sql = 'relevance', RANK
+        else:
+            order, order_sql = 'recent', 'rowid DESC'
+
+        match_ids = [row[0] for row in conn.execute(f'''
+            SELECT rowid FROM analyses_fts
+            WHERE analyses_fts MATCH ?
+            ORDER BY {order_sql}
+            LIMIT ? OFFSET ?
+        ''', (fts_query, limit, offset))]
+        if not match_ids:
+            return [], order
+
+        placeholders = ','.join('?' * len(match_ids))
+        rows = {row['id']: row for row in conn.execute(f'''
+            SELECT {ANALYSIS_FIELDS}
+            FROM saved_analyses
+            WHERE id IN ({placeholders})
+        ''', match_ids)}
+        rows = [rows[analysis_id] for analysis_id in match_ids if analysis_id in rows]
+        return _load_analyses(conn, rows), order
+
+    return await run_db(query)
+
+async def delete_analysis(analysis_id: int):
+    def query(conn):
+        conn.execute('DELETE FROM saved_analyses WHERE id = ?', (analysis_id,))
+
+    await run_write(query)
+
+# --- Кэш распознавания ---
+
+async def get_cached_inference(key: tuple, min_created_at: float):
+    """
+    Результат распознавания из кэша (None, если нет или старше min_created_at).
+    key - (image_sha256, model, prompt_version).
+    """
+    def query(conn):
+        row = conn.execute('''
+            SELECT ingredients, original_response, created_at
+            FROM inference_cache
+            WHERE image_sha256 = ? AND model = ? AND prompt_version = ? AND created_at > ?
+        ''', (*key, min_created_at)).fetchone()
+        if row is None:
+            return None
+        return {
+            "ingredients": json.loads(row['ingredients']),
+            "original_response": row['original_response'],
+            "created_at": row['created_at']
+        }
+
+    return await run_db(query)
+
+async def touch_cached_inference(key: tuple, now: float):
+    """Отмечает использование записи кэша для вытеснения давно не использованных"""
+    def query(conn):
+        conn.execute('''
+            UPDATE inference_cache SET last_used_at = ?
+            WHERE image_sha256 = ? AND model = ? AND prompt_version = ?
+        ''', (now, *key))
+
+    await run_write(query)
+
+async def store_cached_inference(key: tuple, result: dict, now: float,
+                                 min_created_at: float, max_entries: int, phash: int = None,
+                                 trim: bool = True):
+    """
+    Сохраняет результат распознавания и поддерживает размер кэша:
+    удаляет записи старше min_created_at, а при trim - давно не использованные
+    сверх max_entries. phash - dHash изображения для поиска почти одинаковых
+    (None - не искать по нему).
+    """
+    phash_columns = [None] * (1 + PHASH_CHUNKS)
+    if phash is not None:
+        phash_columns = [to_signed(phash)] + phash_chunks(phash)
+
+    def query(conn):
+        conn.execute(f'''
+            INSERT OR REPLACE INTO inference_cache
+                (image_sha256, model, prompt_version, ingredients, original_response, created_at, last_used_at,
+                 phash, {', '.join(f'phash_{i}' for i in range(PHASH_CHUNKS))})
+            VALUES ({', '.join('?' for _ in range(8 + PHASH_CHUNKS))})
+        ''', (*key, json.dumps(result['ingredients'], ensure_ascii=False),
+              result.get('original_response'), now, now, *phash_columns))
+
+        conn.execute('DELETE FROM inference_cache WHERE created_at <= ?', (min_created_at,))
+        if trim:
+            # Все, что за первыми max_entries по last_used_at, одним запросом без COUNT(*)
+            conn.execute('''
+                DELETE FROM inference_cache
+                WHERE (image_sha256, model, prompt_version) IN (
+                    SELECT image_sha256, model, prompt_version
+                    FROM inference_cache
+                    ORDER BY last_used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (max_entries,))
+
+    await run_write(query)
+
+async def find_similar_inference(model: str, prompt_version: int, phash: int,
+                                 max_distance: int, min_created_at: float):
+    """
+    Ближайший по dHash результат распознавания той же модели и версии промпта
+    на расстоянии Хэмминга не больше max_distance: (запись с ключом, расстояние) или None.
+    """
+    radius = max_distance // PHASH_CHUNKS
+    conditions, params = [], []
+    for i, chunk in enumerate(phash_chunks(phash)):
+        neighbors = chunk_neighbors(chunk, radius)
+        conditions.append(f"phash_{i} IN ({','.join('?' for _ in neighbors)})")
+        params.extend(neighbors)
+
+    def query(conn):
+        rows = conn.execute(f'''
+            SELECT image_sha256, model, prompt_version, ingredients, original_response, created_at, phash
+            FROM inference_cache
+            WHERE model = ? AND prompt_version = ? AND created_at > ?
+              AND ({' OR '.join(conditions)})
+        ''', (model, prompt_version, min_created_at, *params)).fetchall()
+
+        best = None
+        for row in rows:
+            distance = hamming(from_signed(row['phash']), phash)
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (row, distance)
+        if best is None:
+            return None
+
+        row, distance = best
+        return {
+            "key": (row['image_sha256'], row['model'], row['prompt_version']),
+            "ingredients": json.loads(row['ingredients']),
+            "original_response": row['original_response'],
+            "created_at": row['created_at']
+        }, distance
+
+    return await run_db(query)
+
+async def clear_cached_inference():
+    await run_write(lambda conn: conn.execute('DELETE FROM inference_cache'))
+
+async def ping():
+    """Проверка доступности БД"""
+    await run_db(lambda conn: conn.execute("SELECT 1").fetchone())
@@ -0,0 +1,113 @@
+import io
+import random
+import threading
+from PIL import Image
+from .config import (
+    RESOLUTION_MIN_SAMPLES, RESOLUTION_SUCCESS_TARGET, RESOLUTION_LATENCY_TARGET_SECONDS, RESOLUTION_EXPLORE_RATE
+)
+from .metrics import metrics
+
+# Уровни разрешения для Ollama: (максимальная длинная сторона, качество JPEG).
+# None - исходное изображение без сжатия
+LEVELS = ((None, None), (1000, 85), (500, 80))
+
+# Корзины по длинной стороне исходного изображения (верхние границы в пикселях)
+SIZE_BUCKETS = (1024, 2048, 4096)
+
+def image_long_side(image_data: bytes) -> int:
+    """Длинная сторона изображения; читается только заголовок файла"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            return max(image.size)
+    except Exception:
+        return 0
+
+def size_bucket(long_side: int) -> int:
+    for i, limit in enumerate(SIZE_BUCKETS):
+        if long_side <= limit:
+            return i
+    return len(SIZE_BUCKETS)
+
+class ResolutionPolicy:
+    """
+    Выбор стартового разрешения изображения для первой попытки Ollama.
+
+    Для каждой корзины размеров и каждого уровня LEVELS копится статистика
+    попыток: сглаженная доля успехов (таймаут - неуспех) и сглаженное время
+    ответа. Выбирается самый крупный уровень, который пока мало пробовали
+    или который обычно успевает (доля успехов не ниже success_target, время
+    не больше latency_target). Так изображения, на которых исходный размер
+    всегда упирался в таймаут, сразу уменьшаются. С вероятностью explore_rate
+    пробуется уровень крупнее выбранного, чтобы заметить, что Ollama стала
+    быстрее.
+    """
+
+    # Вес нового наблюдения в сглаженных значениях
+    SMOOTHING = 0.3
+
+    def __init__(self, min_samples: int = RESOLUTION_MIN_SAMPLES,
+                 success_target: float = RESOLUTION_SUCCESS_TARGET,
+                 latency_target: float = RESOLUTION_LATENCY_TARGET_SECONDS,
+                 explore_rate: float = RESOLUTION_EXPLORE_RATE,
+                 rng: random.Random = None):
+        self.min_samples = min_samples
+        self.success_target = success_target
+        self.latency_target = latency_target
+        self.explore_rate = explore_rate
+        self._rng = rng or random.Random()
+        self._stats = {}  # (корзина, уровень) -> {"attempts", "success", "latency"}
+        self._lock = threading.Lock()
+
+    def levels_for(self, long_side: int) -> list:
+        """Уровни, имеющие смысл для изображения: уменьшать до размера не меньше исходного незачем"""
+        return [i for i, (max_size, _) in enumerate(LEVELS) if max_size is None or max_size < long_side]
+
+    def choose(self, long_side: int) -> int:
+        """Индекс уровня LEVELS для первой попытки"""
+        bucket = size_bucket(long_side)
+        levels = self.levels_for(long_side)
+        with self._lock:
+            chosen = levels[-1]
+            for level in levels:
+                stats = self._stats.get((bucket, level))
+                if stats is None or stats["attempts"] < self.min_samples or self._good(stats):
+                    chosen = level
+                    break
+
+        position = levels.index(chosen)
+        if position > 0 and self._rng.random() < self.explore_rate:
+            chosen = levels[position - 1]
+        metrics.inc(f"resolution.start_level_{chosen}")
+        return chosen
+
+    def record(self, long_side: int, level: int, success: bool, latency: float):
+        """Учитывает попытку: успех с временем ответа или таймаут"""
+        key = (size_bucket(long_side), level)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {"attempts": 0, "success": float(success), "latency": latency}
+            else:
+                stats["success"] += self.SMOOTHING * (float(success) - stats["success"])
+                stats["latency"] += self.SMOOTHING * (latency - stats["latency"])
+            stats["attempts"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                f"bucket_{bucket}/level_{level}": {
+                    "attempts": stats["attempts"],
+                    "success_rate": round(stats["success"], 3),
+                    "avg_latency_seconds": round(stats["latency"], 3)
+                }
+                for (bucket, level), stats in sorted(self._stats.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _good(self, stats: dict) -> bool:
+        return stats["success"] >= self.success_target and stats["latency"] <= self.latency_target
+
+resolution_policy = ResolutionPolicy()
@@ -1,37 +1,39 @@
 from fastapi import APIRouter, Depends, Query, HTTPException, status
 from ..models import UpdateUserRole, UserRole
-from ..db import get_db_connection
 from ..dependencies import require_admin
 from ..minio import delete_image_from_minio
+from ..pagination import cursor_key, next_cursor
+from .. import repository
 from typing import Optional, List
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+def _user_response(user):
+    return {
+        "id": user['id'],
+        "username": user['username'],
+        "email": user['email'],
+        "role": user['role'],
+        "created_at": user['created_at']
+    }
+
 @router.get("/users")
-async def get_all_users(admin = Depends(require_admin)):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT id, username, email, role, created_at 
-        FROM users 
-        ORDER BY created_at DESC
-    ''')
-    
-    users = cur.fetchall()
-    conn.close()
+async def get_all_users(
+    limit: int = Query(50, ge=1, le=200, description="Количество пользователей на странице"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+    admin = Depends(require_admin)
+):
+    """
+    Все пользователи постранично, от новых к старым
+    """
+    after = cursor_key(cursor, str, int)
+    users = await repository.filter_users(
+        sort_by='created_at', sort_order='desc', limit=limit + 1, after=after
+    )
     
     return {
-        "users": [
-            {
-                "id": user['id'],
-                "username": user['username'],
-                "email": user['email'],
-                "role": user['role'],
-                "created_at": user['created_at']
-            }
-            for user in users
-        ]
+        "users": [_user_response(user) for user in users[:limit]],
+        "next_cursor": next_cursor(users, limit, 'created_at', 'id')
     }
 
 @router.get("/filter/users")
@@ -40,60 +42,51 @@ async def get_filtered_users(
     roles: Optional[List[UserRole]] = Query(None, description="Фильтр по ролям"),
     sort_by: Optional[str] = Query("username", description="Поле для сортировки: username или created_at"),
     sort_order: Optional[str] = Query("asc", description="Порядок сортировки: asc или desc"),
+    limit: int = Query(50, ge=1, le=200, description="Количество пользователей на странице"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
     admin = Depends(require_admin)
 ):
     """
-    Получение отфильтрованного и отсортированного списка пользователей
+    Получение отфильтрованного и отсортированного списка пользователей постранично.
+    Поиск от трех символов ищет подстроку в имени, более короткий - начало имени.
+    Курсор действителен только с теми же фильтрами и сортировкой.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Базовый запрос
-    query = "SELECT id, username, email, role, created_at FROM users"
-    params = []
-    conditions = []
-    
-    # Фильтр по ролям
-    if roles:
-        placeholders = ','.join(['?' for _ in roles])
-        conditions.append(f"role IN ({placeholders})")
-        params.extend([role.value for role in roles])
-    
-    # Добавляем условия WHERE
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    
-    # Сортировка
-    valid_sort_fields = ['username', 'created_at']
-    if sort_by in valid_sort_fields:
-        order = "ASC" if sort_order.lower() == "asc" else "DESC"
-        query += f" ORDER BY {sort_by} {order}"
+    if sort_by not in repository.USER_SORT_KEYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Недопустимое поле сортировки. Допустимые поля: {', '.join(repository.USER_SORT_KEYS)}"
+        )
     
-    cur.execute(query, params)
-    users = cur.fetchall()
-    conn.close()
-
-    # Поиск по имени пользователя
-    if search:
-        search_lower = search.lower()
-        users = [
-            user for user in users 
-            if search_lower in user['username'].lower()
-        ]
+    after = cursor_key(cursor, str, int)
+    users = await repository.filter_users(
+        roles=[role.value for role in roles] if roles else None,
+        sort_by=sort_by,
+        sort_order=sort_order,
+        search=search,
+        limit=limit + 1,
+        after=after
+    )
     
     return {
-        "users": [
-            {
-                "id": user['id'],
-                "username": user['username'],
-                "email": user['email'],
-                "role": user['role'],
-                "created_at": user['created_at']
-            }
-            for user in users
-        ]
+        "users": [_user_response(user) for user in users[:limit]],
+        "next_cursor": next_cursor(users, limit, sort_by, 'id')
     }
 
+@router.get("/users/count")
+async def count_users(
+    search: Optional[str] = Query(None, description="Поиск по имени пользователя"),
+    roles: Optional[List[UserRole]] = Query(None, description="Фильтр по ролям"),
+    admin = Depends(require_admin)
+):
+    """
+    Количество пользователей под фильтрами /admin/filter/users
+    """
+    total = await repository.count_users(
+        roles=[role.value for role in roles] if roles else None,
+        search=search
+    )
+    return {"total": total}
+
 @router.post("/update-user-role")
 async def update_user_role(
     role_data: UpdateUserRole,
@@ -113,28 +106,17 @@ async def update_user_role(
             detail=f"Недопустимая роль. Допустимые роли: {', '.join([role.value for role in UserRole])}"
         )
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     # Проверяем существование пользователя
-    cur.execute('SELECT id, username FROM users WHERE id = ?', (role_data.user_id,))
-    target_user = cur.fetchone()
+    target_user = await repository.get_user(role_data.user_id)
     
     if not target_user:
-        conn.close()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Пользователь не найден"
         )
     
     # Обновляем роль
-    cur.execute(
-        'UPDATE users SET role = ? WHERE id = ?',
-        (role_data.new_role, role_data.user_id)
-    )
-    
-    conn.commit()
-    conn.close()
+    await repository.update_user_role(role_data.user_id, role_data.new_role)
     
     return {
         "message": f"Роль пользователя {target_user['username']} изменена на {role_data.new_role}",
@@ -154,34 +136,20 @@ async def delete_user_by_admin(
             detail="Нельзя удалить собственный аккаунт"
         )
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     # Проверяем существование пользователя
-    cur.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-    target_user = cur.fetchone()
+    target_user = await repository.get_user(user_id)
     
     if not target_user:
-        conn.close()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Пользователь не найден"
         )
     
     # Удаляем изображения пользователя из Minio
-    cur.execute('SELECT image_path FROM saved_analyses WHERE user_id = ?', (user_id,))
-    saved_images = cur.fetchall()
-    
-    for img in saved_images:
-        delete_image_from_minio(img['image_path'])
+    for image_path in await repository.get_user_image_paths(user_id):
+        delete_image_from_minio(image_path)
     
     # Удаляем все данные пользователя
-    cur.execute('DELETE FROM saved_analyses WHERE user_id = ?', (user_id,))
-    cur.execute('DELETE FROM user_medical_data WHERE user_id = ?', (user_id,))
-    cur.execute('DELETE FROM user_tokens WHERE user_id = ?', (user_id,))
-    cur.execute('DELETE FROM users WHERE id = ?', (user_id,))
-    
-    conn.commit()
-    conn.close()
+    await repository.delete_user_with_data(user_id)
     
-    return {"message": f"Пользователь {target_user['username']} успешно удален"}
\ No newline at end of file
+    return {"message": f"Пользователь {target_user['username']} успешно удален"}
@@ -1,43 +1,72 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, status, UploadFile, File, Form
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, status, UploadFile, File, Form
+from fastapi.responses import Response, StreamingResponse
+from typing import List
 import io
 import json
 import traceback
 import re
 import asyncio
+from contextlib import aclosing
 from PIL import Image
-import base64
 import ollama
 
-from ..db import get_db_connection
 from ..minio import minio_client, save_image_to_minio, get_image_url, delete_image_from_minio
 from ..dependencies import require_not_banned
-from ..funcs import parse_medical_text, analyze_image_with_fallback
-from ..analyse_utils import reanalyze_all_saved_analyses
-from ..config import MINIO_BUCKET_NAME
+from ..funcs import parse_medical_text
+from ..analyse_utils import build_analysis_response, medical_terms, flag_ingredient
+from ..inference_cache import analyze_image_cached
+from ..inference_limiter import InferenceOverloaded
+from ..analysis_jobs import analysis_jobs, FINISHED_STATUSES
+from ..ingredient_stream import analyze_image_stream
+from ..batch_analysis import analyze_images_batch
+from ..search import build_match_query
+from ..pagination import cursor_key, next_cursor
+from ..config import MINIO_BUCKET_NAME, ANALYSIS_BATCH_MAX_IMAGES, ANALYSIS_DISCONNECT_POLL_SECONDS
+from ..metrics import metrics
+from .. import repository
 
 router = APIRouter(prefix="", tags=["analyse"])
 
-@router.post("/analyze-image")
-async def analyze_image(
-    image: UploadFile = File(...),
-    user = Depends(require_not_banned)
-):
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение, не дождавшись ответа"""
+
+async def run_until_disconnected(request: Request, coro, poll_interval: float = ANALYSIS_DISCONNECT_POLL_SECONDS):
     """
-    Анализ изображения на наличие аллергенов
-    Поддерживает graceful degradation при недоступности Ollama
+    Выполняет coro, пока клиент подключен. Если клиент отключился, задача
+    отменяется (вместе с повторами и запросом к Ollama) и бросается ClientDisconnected
     """
-    
-    # Получаем медицинские данные пользователя
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        'SELECT contraindications, allergens FROM user_medical_data WHERE user_id = ?',
-        (user['id'],)
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print(f"Клиент отключился, отменяем {request.url.path}")
+                metrics.inc("analysis.client_disconnected")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+def sse_event(event: str, data) -> str:
+    """Сообщение server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    medical_data = cur.fetchone()
-    conn.close()
-    
+
+def verify_image(image_data: bytes):
+    with Image.open(io.BytesIO(image_data)) as img:
+        img.verify()
+
+async def read_image_upload(image: UploadFile) -> bytes:
+    """Читает загруженное изображение и проверяет тип, размер и формат (400 при ошибке)"""
     # Проверяем файл
     if not image:
         raise HTTPException(
@@ -53,125 +82,67 @@ async def analyze_image(
             detail=f"Неподдерживаемый тип файла. Разрешены: {', '.join(allowed_content_types)}"
         )
     
+    # Читаем данные изображения
+    image_data = await image.read()
+    
+    if len(image_data) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Файл пустой"
+        )
+    
+    # Проверяем размер файла (максимум 10MB)
+    if len(image_data) > 10 * 1024 * 1024:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Размер файла превышает 10MB"
+        )
+    
+    # Проверяем, что это валидное изображение (декодирование - вне event loop)
     try:
-        # Читаем данные изображения
-        image_data = await image.read()
-        
-        if len(image_data) == 0:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Файл пустой"
-            )
-        
-        # Проверяем размер файла (максимум 10MB)
-        if len(image_data) > 10 * 1024 * 1024:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Размер файла превышает 10MB"
-            )
-        
-        # Проверяем, что это валидное изображение
-        try:
-            with Image.open(io.BytesIO(image_data)) as img:
-                img.verify()
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Некорректный формат изображения: {str(e)}"
-            )
-        
-        # Конвертируем изображение в base64
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
-        # Сохраняем оригинальные данные для возможного сжатия
-        original_image_data = image_data
-        
-        # Используем функцию для вызова Ollama с fallback
-        analysis_result = await analyze_image_with_fallback(image_base64, original_image_data)
-        
-        # Если анализ пришел из fallback, добавляем дополнительное предупреждение
-        is_fallback = analysis_result.get('source') == 'fallback'
-        
-        # Получаем список ингредиентов
-        raw_ingredients = analysis_result.get('ingredients', [])
-        
-        # Если ингредиенты пришли как список строк, преобразуем в формат с is_allergen/is_contraindication
-        if raw_ingredients and isinstance(raw_ingredients[0], str):
-            # Преобразуем строки в объекты
-            ingredients_list = [{"name": ing, "is_allergen": False, "is_contraindication": False} 
-                               for ing in raw_ingredients]
-        else:
-            # Уже в нужном формате
-            ingredients_list = raw_ingredients
-        
-        # Проверяем на аллергены если есть медицинские данные
-        allergens = []
-        contraindications = []
-        
-        if medical_data:
-            allergens = parse_medical_text(medical_data['allergens'])
-            contraindications = parse_medical_text(medical_data['contraindications'])
-        
-        # Анализируем ингредиенты на наличие аллергенов
-        analyzed_ingredients = []
-        warnings = []
-        
-        for ingredient_item in ingredients_list:
-            # Поддерживаем оба формата: строка или словарь
-            if isinstance(ingredient_item, str):
-                ingredient_name = ingredient_item
-                is_allergen = False
-                is_contraindication = False
-            else:
-                ingredient_name = ingredient_item.get('name', '')
-                is_allergen = ingredient_item.get('is_allergen', False)
-                is_contraindication = ingredient_item.get('is_contraindication', False)
-            
-            ingredient_lower = ingredient_name.lower()
-            
-            # Проверяем на аллергены (если не было уже помечено)
-            if not is_allergen:
-                for allergen in allergens:
-                    if allergen and allergen in ingredient_lower:
-                        is_allergen = True
-                        break
-            
-            # Проверяем на противопоказания
-            if not is_contraindication:
-                for contra in contraindications:
-                    if contra and contra in ingredient_lower:
-                        is_contraindication = True
-                        break
-            
-            analyzed_ingredients.append({
-                'name': ingredient_name,
-                'is_allergen': is_allergen,
-                'is_contraindication': is_contraindication
-            })
-            
-            if is_allergen:
-                warnings.append(f"⚠️ Аллерген обнаружен: {ingredient_name}")
-            if is_contraindication:
-                warnings.append(f"⚠️ Противопоказание: {ingredient_name}")
-        
-        # Если это fallback, добавляем информационное сообщение
-        if is_fallback:
-            warnings.insert(0, "ℹ️ Анализ выполнен в упрощенном режиме. Результат может быть менее точным.")
-        
-        # Формируем ответ
-        response = {
-            "ingredients": analyzed_ingredients,
-            "warnings": warnings,
-            "original_response": analysis_result.get('original_response', 'Анализ выполнен')
-        }
+        await asyncio.to_thread(verify_image, image_data)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Некорректный формат изображения: {str(e)}"
+        )
+    
+    return image_data
+
+@router.post("/analyze-image")
+async def analyze_image(
+    request: Request,
+    image: UploadFile = File(...),
+    user = Depends(require_not_banned)
+):
+    """
+    Анализ изображения на наличие аллергенов
+    Поддерживает graceful degradation при недоступности Ollama
+    """
+    
+    # Получаем медицинские данные пользователя
+    medical_data = await repository.get_medical_data(user['id'])
+    
+    try:
+        image_data = await read_image_upload(image)
         
-        # Если была ошибка, добавляем ее в ответ для отладки (но не показываем пользователю)
-        if analysis_result.get('error'):
-            response['_debug_error'] = analysis_result['error']
+        # Вызов Ollama с fallback; повторная загрузка того же изображения берется из кэша.
+        # Если клиент закроет вкладку, распознавание отменяется и не занимает Ollama
+        analysis_result = await run_until_disconnected(request, analyze_image_cached(image_data))
         
-        return response
+        return build_analysis_response(analysis_result, medical_data)
         
     except HTTPException:
         raise
+    except ClientDisconnected:
+        # Ответ никто не прочитает; 499 - "клиент закрыл запрос" (как в nginx)
+        return Response(status_code=499)
+    except InferenceOverloaded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Сервис анализа перегружен. Пожалуйста, повторите запрос позже.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         print(f"Ошибка при обработке изображения: {str(e)}")
         traceback.print_exc()
@@ -193,6 +164,174 @@ async def analyze_image(
             "is_fallback": True
         }
 
+@router.post("/analyze-image/stream")
+async def analyze_image_streaming(
+    image: UploadFile = File(...),
+    user = Depends(require_not_banned)
+):
+    """
+    Анализ изображения с выдачей ингредиентов по мере распознавания (SSE):
+    событие ingredient на каждый ингредиент уже с флагами аллергенов,
+    в конце done с полным ответом как у /analyze-image.
+    При перегрузке Ollama - событие error с retry_after.
+    """
+    image_data = await read_image_upload(image)
+    medical_data = await repository.get_medical_data(user['id'])
+    allergens, contraindications = medical_terms(medical_data)
+
+    async def events():
+        try:
+            async for kind, value in analyze_image_stream(image_data):
+                if kind == "ingredient":
+                    yield sse_event("ingredient", flag_ingredient(value, allergens, contraindications))
+                else:
+                    yield sse_event("done", build_analysis_response(value, medical_data))
+        except (asyncio.CancelledError, GeneratorExit):
+            # Клиент отключился: распознавание прерывается вместе с потоком
+            metrics.inc("analysis.client_disconnected")
+            raise
+        except InferenceOverloaded as e:
+            yield sse_event("error", {
+                "detail": "Сервис анализа перегружен. Пожалуйста, повторите запрос позже.",
+                "retry_after": e.retry_after
+            })
+
+    return sse_response(events())
+
+@router.post("/analyze-images")
+async def analyze_images(
+    images: List[UploadFile] = File(...),
+    user = Depends(require_not_banned)
+):
+    """
+    Пакетный анализ нескольких изображений (SSE): событие result на каждое
+    изображение по мере готовности (index - позиция файла в запросе, остальное
+    как у /analyze-image), error - для файла, который не прошел проверку или
+    не был распознан, в конце done с числом успешных и неудачных.
+    Медицинские данные читаются один раз на весь пакет.
+    """
+    if len(images) > ANALYSIS_BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Не больше {ANALYSIS_BATCH_MAX_IMAGES} изображений за один запрос"
+        )
+
+    # Проверка файлов и медицинские данные - параллельно
+    *uploads, medical_data = await asyncio.gather(
+        *(read_image_upload(image) for image in images),
+        repository.get_medical_data(user['id']),
+        return_exceptions=True
+    )
+    if isinstance(medical_data, BaseException):
+        raise medical_data
+
+    valid = {i: data for i, data in enumerate(uploads) if not isinstance(data, BaseException)}
+    rejected = {i: error for i, error in enumerate(uploads) if isinstance(error, BaseException)}
+
+    def error_event(index: int, error: BaseException) -> str:
+        data = {"index": index, "filename": images[index].filename}
+        if isinstance(error, HTTPException):
+            data["detail"] = error.detail
+        elif isinstance(error, InferenceOverloaded):
+            data["detail"] = "Сервис анализа перегружен. Пожалуйста, повторите запрос позже."
+            data["retry_after"] = error.retry_after
+        else:
+            print(f"Ошибка при пакетном анализе изображения: {error}")
+            data["detail"] = "Произошла ошибка при анализе изображения. Пожалуйста, попробуйте позже."
+        return sse_event("error", data)
+
+    async def events():
+        failed = len(rejected)
+        for index, error in rejected.items():
+            yield error_event(index, error)
+
+        if valid:
+            try:
+                async with aclosing(analyze_images_batch(valid)) as results:
+                    async for index, result in results:
+                        if isinstance(result, BaseException):
+                            failed += 1
+                            yield error_event(index, result)
+                        else:
+                            yield sse_event("result", {
+                                "index": index,
+                                "filename": images[index].filename,
+                                **build_analysis_response(result, medical_data)
+                            })
+            except (asyncio.CancelledError, GeneratorExit):
+                # Клиент отключился: оставшиеся изображения не распознаются
+                metrics.inc("analysis.client_disconnected")
+                raise
+
+        yield sse_event("done", {"analyzed": len(images) - failed, "failed": failed})
+
+    return sse_response(events())
+
+@router.post("/analysis-jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_analysis_job(
+    image: UploadFile = File(...),
+    user = Depends(require_not_banned)
+):
+    """
+    Ставит анализ изображения в очередь и сразу возвращает задачу.
+    Результат - через GET /analysis-jobs/{id} или поток /analysis-jobs/{id}/events
+    """
+    image_data = await read_image_upload(image)
+    try:
+        return analysis_jobs.submit(user['id'], image_data)
+    except InferenceOverloaded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Очередь анализа заполнена. Пожалуйста, повторите запрос позже.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+@router.get("/analysis-jobs/{job_id}")
+async def get_analysis_job(
+    job_id: str,
+    user = Depends(require_not_banned)
+):
+    job = analysis_jobs.get(job_id, user['id'])
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задача не найдена"
+        )
+    return job
+
+@router.get("/analysis-jobs/{job_id}/events")
+async def analysis_job_events(
+    job_id: str,
+    user = Depends(require_not_banned)
+):
+    """Server-sent events: событие на каждую смену статуса задачи до done/failed"""
+    if analysis_jobs.get(job_id, user['id']) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задача не найдена"
+        )
+
+    async def events():
+        last_status = None
+        while True:
+            job, changed = analysis_jobs.watch(job_id, user['id'])
+            if job is None:
+                # Задача истекла, пока клиент был подключен
+                yield sse_event("expired", {})
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield sse_event(last_status, job)
+            if last_status in FINISHED_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                # Комментарий держит соединение открытым через прокси
+                yield ": keep-alive\n\n"
+
+    return sse_response(events())
+
 @router.post("/save-analysis")
 async def save_analysis(
     user = Depends(require_not_banned),
@@ -231,35 +370,14 @@ async def save_analysis(
                 detail="Ошибка при сохранении изображения"
             )
         
-        # Сохраняем запись в базу данных
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute('''
-            INSERT INTO saved_analyses 
-            (user_id, image_path, analysis_result, ingredients_count, warnings_count)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+        # Сохраняем запись в базу данных и получаем сохраненную запись
+        saved_analysis = await repository.insert_analysis(
             user['id'],
             minio_path,
-            json.dumps(analysis_result_dict),
+            analysis_result_dict,
             int(ingredients_count),
             int(warnings_count)
-        ))
-        
-        analysis_id = cur.lastrowid
-        conn.commit()
-        
-        # Получаем сохраненную запись
-        cur.execute('''
-            SELECT id, user_id, image_path, analysis_result, 
-                   ingredients_count, warnings_count, created_at
-            FROM saved_analyses 
-            WHERE id = ?
-        ''', (analysis_id,))
-        
-        saved_analysis = cur.fetchone()
-        conn.close()
+        )
         
         # Генерируем временную ссылку на изображение
         image_url = get_image_url(minio_path)
@@ -268,7 +386,7 @@ async def save_analysis(
             "id": saved_analysis['id'],
             "user_id": saved_analysis['user_id'],
             "image_url": image_url,
-            "analysis_result": json.loads(saved_analysis['analysis_result']),
+            "analysis_result": saved_analysis['analysis_result'],
             "ingredients_count": saved_analysis['ingredients_count'],
             "warnings_count": saved_analysis['warnings_count'],
             "created_at": saved_analysis['created_at']
@@ -288,79 +406,62 @@ async def save_analysis(
         )
 
 @router.get("/saved-analyses")
-async def get_saved_analyses(user = Depends(require_not_banned)):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT id, user_id, image_path, analysis_result, 
-               ingredients_count, warnings_count, created_at
-        FROM saved_analyses 
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-    ''', (user['id'],))
-    
-    saved_analyses = cur.fetchall()
-    conn.close()
+async def get_saved_analyses(
+    limit: int = Query(20, ge=1, le=100, description="Количество анализов на странице"),
+    cursor: str = Query(None, description="Курсор следующей страницы из next_cursor"),
+    user = Depends(require_not_banned)
+):
+    after = cursor_key(cursor, str, int)
+    # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+    saved_analyses = await repository.get_saved_analyses(user['id'], limit=limit + 1, after=after)
     
     results = []
-    for analysis in saved_analyses:
+    for analysis in saved_analyses[:limit]:
         results.append({
             "id": analysis['id'],
             "user_id": analysis['user_id'],
-            "analysis_result": json.loads(analysis['analysis_result']),
+            "analysis_result": analysis['analysis_result'],
             "ingredients_count": analysis['ingredients_count'],
             "warnings_count": analysis['warnings_count'],
             "created_at": analysis['created_at']
         })
     
-    return {"analyses": results}
+    return {"analyses": results, "next_cursor": next_cursor(saved_analyses, limit, 'created_at', 'id')}
 
 @router.get("/filter/saved-analyses")
 async def get_filtered_analyses(
     show_safe: bool = Query(True, description="Показывать безопасные анализы (без предупреждений)"),
     show_warnings: bool = Query(True, description="Показывать анализы с предупреждениями"),
     sort_order: str = Query("desc", description="Порядок сортировки: asc или desc"),
+    limit: int = Query(20, ge=1, le=100, description="Количество анализов на странице"),
+    cursor: str = Query(None, description="Курсор следующей страницы из next_cursor"),
     user = Depends(require_not_banned)
 ):
     """
-    Получение отфильтрованных сохраненных анализов пользователя
-    """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Базовый запрос
-    query = """
-        SELECT id, user_id, image_path, analysis_result, 
-               ingredients_count, warnings_count, created_at
-        FROM saved_analyses 
-        WHERE user_id = ?
+    Получение отфильтрованных сохраненных анализов пользователя постранично.
+    Курсор действителен только с теми же фильтрами и порядком сортировки.
     """
-    params = [user['id']]
+    after = cursor_key(cursor, str, int)
     
     # Применяем фильтры
+    warnings_filter = None
     if show_safe and not show_warnings:
         # Только безопасные
-        query += " AND warnings_count = 0"
+        warnings_filter = 'safe'
     elif not show_safe and show_warnings:
         # Только с предупреждениями
-        query += " AND warnings_count > 0"
+        warnings_filter = 'warnings'
     elif not show_safe and not show_warnings:
         # Ничего не показываем (возвращаем пустой список)
-        conn.close()
-        return {"analyses": []}
+        return {"analyses": [], "next_cursor": None}
     # else: show_safe and show_warnings - показываем все
     
-    # Сортировка
-    order = "DESC" if sort_order.lower() == "desc" else "ASC"
-    query += f" ORDER BY created_at {order}"
-    
-    cur.execute(query, params)
-    saved_analyses = cur.fetchall()
-    conn.close()
+    saved_analyses = await repository.get_saved_analyses(
+        user['id'], warnings_filter, sort_order, limit=limit + 1, after=after
+    )
     
     results = []
-    for analysis in saved_analyses:
+    for analysis in saved_analyses[:limit]:
         # Генерируем временную ссылку на изображение
         image_url = get_image_url(analysis['image_path'])
         
@@ -368,137 +469,93 @@ async def get_filtered_analyses(
             "id": analysis['id'],
             "user_id": analysis['user_id'],
             "image_url": image_url,
-            "analysis_result": json.loads(analysis['analysis_result']),
+            "analysis_result": analysis['analysis_result'],
             "ingredients_count": analysis['ingredients_count'],
             "warnings_count": analysis['warnings_count'],
             "created_at": analysis['created_at']
         })
     
-    return {"analyses": results}
+    return {"analyses": results, "next_cursor": next_cursor(saved_analyses, limit, 'created_at', 'id')}
+
+@router.get("/saved-analyses/search")
+async def search_saved_analyses(
+    q: str = Query(..., description="Поисковый запрос по ингредиентам и предупреждениям"),
+    limit: int = Query(20, ge=1, le=100, description="Количество результатов на странице"),
+    offset: int = Query(0, ge=0, description="Смещение от начала выдачи"),
+    user = Depends(require_not_banned)
+):
+    """
+    Полнотекстовый поиск по сохраненным анализам пользователя.
+    Каждое слово запроса ищется как префикс. Результаты упорядочены по релевантности,
+    а при очень большом числе совпадений - от новых к старым (поле order).
+    """
+    match_query = build_match_query(q)
+    if match_query is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Поисковый запрос не содержит слов"
+        )
+    
+    # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+    found, order = await repository.search_saved_analyses(user['id'], match_query, limit + 1, offset)
+    has_more = len(found) > limit
+    
+    results = []
+    for analysis in found[:limit]:
+        results.append({
+            "id": analysis['id'],
+            "user_id": analysis['user_id'],
+            "image_url": get_image_url(analysis['image_path']),
+            "analysis_result": analysis['analysis_result'],
+            "ingredients_count": analysis['ingredients_count'],
+            "warnings_count": analysis['warnings_count'],
+            "created_at": analysis['created_at']
+        })
+    
+    return {
+        "analyses": results,
+        "order": order,
+        "next_offset": offset + limit if has_more else None
+    }
 
 @router.post("/reanalyze-analysis/{analysis_id}")
 async def reanalyze_saved_analysis(
     analysis_id: int,
     user = Depends(require_not_banned)
 ):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     # Получаем сохраненный анализ
-    cur.execute('''
-        SELECT id, user_id, analysis_result, warnings_count
-        FROM saved_analyses 
-        WHERE id = ? AND user_id = ?
-    ''', (analysis_id, user['id']))
-    
-    analysis = cur.fetchone()
+    analysis = await repository.get_analysis(analysis_id, user['id'])
     
     if not analysis:
-        conn.close()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Анализ не найден"
         )
     
     # Получаем текущие медицинские данные пользователя
-    cur.execute(
-        'SELECT contraindications, allergens FROM user_medical_data WHERE user_id = ?',
-        (user['id'],)
-    )
-    medical_data = cur.fetchone()
-    
-    # Парсим старый результат анализа
-    try:
-        old_result = json.loads(analysis['analysis_result'])
-    except json.JSONDecodeError:
-        conn.close()
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Некорректный формат данных анализа"
-        )
+    medical_data = await repository.get_medical_data(user['id'])
     
     # Извлекаем аллергены и противопоказания из медицинских данных
     allergens = parse_medical_text(medical_data['allergens'] if medical_data else None)
     contraindications = parse_medical_text(medical_data['contraindications'] if medical_data else None)
     
-    # Анализируем ингредиенты заново с новыми медицинскими данными
-    new_ingredients = []
-    new_warnings = []
-    new_warnings_count = 0
-    
-    for ingredient_data in old_result.get('ingredients', []):
-        ingredient_name = ingredient_data.get('name', '')
-        ingredient_lower = ingredient_name.lower()
-        
-        is_allergen = False
-        is_contraindication = False
-        
-        # Проверяем на аллергены
-        for allergen in allergens:
-            if allergen and allergen in ingredient_lower:
-                is_allergen = True
-                break
-        
-        # Проверяем на противопоказания
-        for contra in contraindications:
-            if contra and contra in ingredient_lower:
-                is_contraindication = True
-                break
-        
-        new_ingredients.append({
-            'name': ingredient_name,
-            'is_allergen': is_allergen,
-            'is_contraindication': is_contraindication
-        })
-        
-        if is_allergen:
-            new_warnings.append(f"Аллерген обнаружен: {ingredient_name}")
-            new_warnings_count += 1
-        if is_contraindication:
-            new_warnings.append(f"Противопоказание: {ingredient_name}")
-            new_warnings_count += 1
-    
-    # Обновляем анализ в базе
-    new_result = {
-        "ingredients": new_ingredients,
-        "warnings": new_warnings,
-        "original_response": old_result.get('original_response', 'Перепроверено с обновленными медицинскими данными')
-    }
-    
-    cur.execute('''
-        UPDATE saved_analyses 
-        SET analysis_result = ?, warnings_count = ?
-        WHERE id = ?
-    ''', (json.dumps(new_result), new_warnings_count, analysis_id))
-    
-    conn.commit()
-    
-    # Получаем обновленный анализ с изображением
-    cur.execute('''
-        SELECT id, user_id, image_path, analysis_result, 
-               ingredients_count, warnings_count, created_at
-        FROM saved_analyses 
-        WHERE id = ?
-    ''', (analysis_id,))
-    
-    updated_analysis = cur.fetchone()
+    # Пересчитываем флаги ингредиентов с новыми медицинскими данными
+    await repository.reanalyze_analyses(user['id'], allergens, contraindications, analysis_id)
+    updated_analysis = await repository.get_saved_analysis(analysis_id, user['id'])
     
     # Генерируем временную ссылку на изображение
     image_url = get_image_url(updated_analysis['image_path'])
     
-    result = {
+    return {
         "id": updated_analysis['id'],
         "user_id": updated_analysis['user_id'],
         "image_url": image_url,
-        "analysis_result": json.loads(updated_analysis['analysis_result']),
+        "analysis_result": updated_analysis['analysis_result'],
         "ingredients_count": updated_analysis['ingredients_count'],
         "warnings_count": updated_analysis['warnings_count'],
         "created_at": updated_analysis['created_at'],
         "message": "Анализ успешно перепроверен с обновленными медицинскими данными"
     }
-    
-    conn.close()
-    return result
 
 @router.delete("/saved-analyses/{analysis_id}")
 async def delete_saved_analysis(
@@ -507,34 +564,21 @@ async def delete_saved_analysis(
 ):
     from ..minio import delete_image_from_minio
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     # Получаем анализ с путем к изображению
-    cur.execute('''
-        SELECT id, user_id, image_path 
-        FROM saved_analyses 
-        WHERE id = ? AND user_id = ?
-    ''', (analysis_id, user['id']))
-    
-    analysis = cur.fetchone()
+    analysis = await repository.get_analysis(analysis_id, user['id'])
     
     if not analysis:
-        conn.close()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Анализ не найден"
         )
     
     # Удаляем анализ из базы
-    cur.execute('DELETE FROM saved_analyses WHERE id = ?', (analysis_id,))
+    await repository.delete_analysis(analysis_id)
     
     # Удаляем изображение из Minio
     delete_image_from_minio(analysis['image_path'])
     
-    conn.commit()
-    conn.close()
-    
     return {"message": "Анализ успешно удален"}
 
 @router.get("/image/{analysis_id}")
@@ -543,16 +587,7 @@ async def get_analysis_image(
     user = Depends(require_not_banned)
 ):
     """Получение изображения через бэкенд"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT image_path FROM saved_analyses 
-        WHERE id = ? AND user_id = ?
-    ''', (analysis_id, user['id']))
-    
-    analysis = cur.fetchone()
-    conn.close()
+    analysis = await repository.get_analysis(analysis_id, user['id'])
     
     if not analysis:
         raise HTTPException(status_code=404, detail="Анализ не найден")
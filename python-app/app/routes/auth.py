@@ -1,25 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from ..models import UserRegister, UserLogin, UserResponse
-from ..db import get_db_connection
-from ..funcs import hash_password, generate_token_pair_with_conn, get_user_by_token
+from ..funcs import hash_password
 from ..dependencies import require_auth
+from .. import repository
 
 router = APIRouter(prefix="", tags=["auth"])
-security = HTTPBearer()
 
 @router.post("/register")
 async def register(user_data: UserRegister):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     # Проверяем, существует ли пользователь
-    cur.execute('SELECT id FROM users WHERE username = ? OR email = ?', 
-                (user_data.username, user_data.email))
-    existing_user = cur.fetchone()
+    existing_user = await repository.find_user_by_username_or_email(user_data.username, user_data.email)
     
     if existing_user:
-        conn.close()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Пользователь с таким именем или email уже существует"
@@ -27,22 +19,7 @@ async def register(user_data: UserRegister):
     
     # Хешируем пароль и создаем пользователя
     password_hash = hash_password(user_data.password)
-    
-    cur.execute(
-        'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-        (user_data.username, user_data.email, password_hash)
-    )
-    
-    user_id = cur.lastrowid
-    
-    cur.execute(
-        'SELECT id, username, email, role, created_at FROM users WHERE id = ?',
-        (user_id,)
-    )
-    
-    new_user = cur.fetchone()
-    conn.commit()
-    conn.close()
+    new_user = await repository.create_user(user_data.username, user_data.email, password_hash)
     
     return {
         "message": "Пользователь успешно зарегистрирован", 
@@ -57,33 +34,18 @@ async def register(user_data: UserRegister):
 
 @router.post("/login")
 async def login(login_data: UserLogin):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     # Ищем пользователя
     password_hash = hash_password(login_data.password)
-    cur.execute(
-        'SELECT id, username, email, role, created_at FROM users WHERE username = ? AND password_hash = ?',
-        (login_data.username, password_hash)
-    )
-    
-    user = cur.fetchone()
+    user = await repository.get_user_by_credentials(login_data.username, password_hash)
     
     if not user:
-        conn.close()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверное имя пользователя или пароль"
         )
     
-    # Удаляем старые токены пользователя
-    cur.execute('DELETE FROM user_tokens WHERE user_id = ?', (user['id'],))
-    
-    # Генерируем пару токенов
-    token_pair = generate_token_pair_with_conn(conn, user['id'])
-    
-    conn.commit()
-    conn.close()
+    # Удаляем старые токены пользователя и генерируем новую пару
+    token_pair = await repository.issue_login_tokens(user['id'])
     
     return {
         "access_token": token_pair['access_token'],
@@ -99,26 +61,27 @@ async def login(login_data: UserLogin):
     }
 
 @router.post("/logout")
-async def logout(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    user = Depends(require_auth)
-):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
+async def logout(user = Depends(require_auth)):
     # Удаляем все токены пользователя
-    cur.execute('DELETE FROM user_tokens WHERE user_id = ?', (user['id'],))
-    conn.commit()
-    conn.close()
+    await repository.delete_user_tokens(user['id'])
     
     return {"message": "Успешный выход из системы"}
 
 @router.get("/me")
 async def get_current_user(user = Depends(require_auth)):
+    # Подписанный токен несет только id и роль, остальное читаем из БД
+    if 'username' not in user:
+        user = await repository.get_user(user['id'])
+        # Пользователь удален, а токен еще не истек
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Пользователь не найден"
+            )
     return UserResponse(
         id=user['id'],
         username=user['username'],
         email=user['email'],
         role=user['role'],
         created_at=user['created_at']
-    )
\ No newline at end of file
+    )
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from datetime import datetime
-from ..db import get_db_connection, cleanup_expired_tokens
-from ..funcs import generate_token_pair_with_conn
+import time
+from ..db import cleanup_expired_tokens
+from .. import repository
 
 router = APIRouter(prefix="", tags=["tokens"])
 security = HTTPBearer()
@@ -12,34 +12,16 @@ async def refresh_token(credentials: HTTPAuthorizationCredentials = Depends(secu
     """Обновляет пару токенов по refresh токену"""
     refresh_token = credentials.credentials
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    # Проверяем refresh токен и генерируем новую пару токенов
+    rotated = await repository.rotate_refresh_token(refresh_token, int(time.time()))
     
-    # Проверяем refresh токен
-    cur.execute('''
-        SELECT u.id, u.username, u.email, u.created_at 
-        FROM users u 
-        JOIN user_tokens ut ON u.id = ut.user_id 
-        WHERE ut.token = ? AND ut.expires_at > ? AND ut.token_type = ?
-    ''', (refresh_token, datetime.now().isoformat(), 'refresh'))
-    
-    user = cur.fetchone()
-    
-    if not user:
-        conn.close()
+    if not rotated:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Недействительный или просроченный refresh токен"
         )
     
-    # Удаляем только использованный refresh токен
-    cur.execute('DELETE FROM user_tokens WHERE token = ?', (refresh_token,))
-    
-    # Генерируем новую пару токенов
-    token_pair = generate_token_pair_with_conn(conn, user['id'])
-    
-    conn.commit()
-    conn.close()
+    user, token_pair = rotated
     
     return {
         "access_token": token_pair['access_token'],
@@ -56,5 +38,5 @@ async def refresh_token(credentials: HTTPAuthorizationCredentials = Depends(secu
 @router.post("/cleanup-tokens")
 async def cleanup_tokens():
     """Принудительная очистка просроченных токенов"""
-    cleaned_count = cleanup_expired_tokens()
-    return {"message": f"Удалено {cleaned_count} просроченных токенов"}
\ No newline at end of file
+    cleaned_count = await cleanup_expired_tokens()
+    return {"message": f"Удалено {cleaned_count} просроченных токенов"}
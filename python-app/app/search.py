@@ -0,0 +1,57 @@
+"""
+Полнотекстовый поиск по сохраненным анализам (SQLite FTS5).
+
+analyses_fts хранит по строке на анализ (rowid = saved_analyses.id):
+имена ингредиентов, тексты предупреждений и токен владельца "u<user_id>".
+Фильтр по владельцу входит в сам MATCH, поэтому пересекаются списки
+индекса, а не читаются строки чужих анализов. Удаление синхронизирует
+триггер, сохранение и пересмотр анализов - index_analyses().
+"""
+import re
+
+# Вес совпадения в ингредиентах и в предупреждениях для bm25, владелец не влияет
+RANK = 'bm25(analyses_fts, 2.0, 1.0, 0.0)'
+
+def index_analyses(cur, where_sql: str, params):
+    """Пересобирает строки поискового индекса для анализов saved_analyses, подходящих под where_sql"""
+    cur.execute(f'''
+        INSERT OR REPLACE INTO analyses_fts (rowid, ingredients, warnings, owner)
+        SELECT sa.id,
+               COALESCE((
+                   SELECT group_concat(i.name, ' ')
+                   FROM analysis_ingredients ai
+                   JOIN ingredients i ON i.id = ai.ingredient_id
+                   WHERE ai.analysis_id = sa.id
+               ), ''),
+               COALESCE((
+                   SELECT group_concat(w.text, ' ') FROM (
+                       SELECT 'Аллерген обнаружен: ' || i.name AS text
+                       FROM analysis_ingredients ai
+                       JOIN ingredients i ON i.id = ai.ingredient_id
+                       WHERE ai.analysis_id = sa.id AND ai.is_allergen
+                       UNION ALL
+                       SELECT 'Противопоказание: ' || i.name
+                       FROM analysis_ingredients ai
+                       JOIN ingredients i ON i.id = ai.ingredient_id
+                       WHERE ai.analysis_id = sa.id AND ai.is_contraindication
+                   ) w
+               ), ''),
+               'u' || sa.user_id
+        FROM saved_analyses sa
+        WHERE {where_sql}
+    ''', params)
+
+def build_match_query(q: str):
+    """
+    Превращает пользовательский запрос в безопасное выражение FTS5:
+    каждое слово ищется как префикс, все слова обязательны.
+    Возвращает None, если в запросе нет слов.
+    """
+    terms = re.findall(r'\w+', q or '')
+    if not terms:
+        return None
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+def owner_match_query(user_id: int, match_query: str) -> str:
+    """Ограничивает выражение FTS5 анализами одного пользователя и его текстовыми колонками"""
+    return f'owner:u{int(user_id)} AND {{ingredients warnings}}: ({match_query})'
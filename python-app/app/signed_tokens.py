@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from .db import get_db_connection
+from .config import TOKEN_SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES, SIGNED_ACCESS_TOKENS
+
+if TOKEN_SECRET_KEY:
+    _secret = TOKEN_SECRET_KEY.encode()
+else:
+    # Только вне режима подписанных токенов (см. ensure_signing_key)
+    _secret = secrets.token_bytes(32)
+
+def ensure_signing_key():
+    """
+    Не дает запуститься в режиме подписанных токенов без TOKEN_SECRET_KEY:
+    со случайным ключом токены одного процесса не проходили бы проверку
+    в другом, а каждый перезапуск разлогинивал бы всех
+    """
+    if SIGNED_ACCESS_TOKENS and not TOKEN_SECRET_KEY:
+        raise RuntimeError("SIGNED_ACCESS_TOKENS=true требует задать TOKEN_SECRET_KEY")
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+def is_signed_token(token: str) -> bool:
+    """Подписанный токен имеет вид payload.signature, случайный hex-токен точки не содержит"""
+    return '.' in token
+
+def create_access_token(user_id: int, role: str):
+    """
+    Создает подписанный access токен с id, ролью и сроком действия.
+
+    Returns:
+        (token, expires_at) - токен и время истечения в epoch-секундах
+    """
+    issued_at = time.time()
+    expires_at = issued_at + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    claims = {
+        'sub': user_id,
+        'role': role,
+        'iat': issued_at,
+        'exp': expires_at
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f"{payload}.{_sign(payload)}", expires_at
+
+def verify_access_token(token: str):
+    """
+    Проверяет подпись, срок действия и отзыв токена без обращения к БД.
+
+    Returns:
+        dict с id и role пользователя или None
+    """
+    try:
+        payload, signature = token.split('.', 1)
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+    if claims.get('exp', 0) <= time.time():
+        return None
+    if revocation_set.is_revoked(claims['sub'], claims['iat']):
+        return None
+
+    return {'id': claims['sub'], 'role': claims['role']}
+
+class RevocationSet:
+    """
+    Компактный список отзыва подписанных токенов.
+
+    Для каждого пользователя хранится момент revoked_before: все его
+    токены, выпущенные не позже этого момента, считаются отозванными.
+    Записи старше времени жизни access токена больше ничего не отсекают
+    и удаляются.
+
+    Список в памяти свой у каждого процесса: отзыв применяется в памяти
+    процесса, который его выполнил, только после коммита (apply), а другие
+    процессы увидят его лишь после load_from_db, то есть при своем запуске.
+    """
+
+    def __init__(self):
+        self._revoked_before = {}
+        self._lock = threading.Lock()
+
+    def is_revoked(self, user_id: int, issued_at: float) -> bool:
+        revoked_before = self._revoked_before.get(user_id)
+        return revoked_before is not None and issued_at <= revoked_before
+
+    def revoke_user(self, user_id: int, conn=None, revoked_before: float = None) -> float:
+        """
+        Отзывает все ранее выпущенные токены пользователя и сохраняет это в БД.
+        Если передано соединение, запись идет в его транзакции, и после коммита
+        вызывающий применяет отзыв в памяти через apply. Возвращает revoked_before.
+        """
+        if revoked_before is None:
+            revoked_before = time.time()
+
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db_connection()
+        conn.execute('''
+            INSERT INTO revoked_access_tokens (user_id, revoked_before) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET revoked_before = excluded.revoked_before
+        ''', (user_id, revoked_before))
+        if own_conn:
+            conn.commit()
+            conn.close()
+            self.apply(user_id, revoked_before)
+        return revoked_before
+
+    def apply(self, user_id: int, revoked_before: float):
+        """Применяет закоммиченный отзыв в памяти процесса"""
+        with self._lock:
+            if revoked_before > self._revoked_before.get(user_id, 0):
+                self._revoked_before[user_id] = revoked_before
+
+    def load_from_db(self) -> int:
+        """Восстанавливает список отзыва из БД (при запуске приложения)"""
+        min_revoked_before = time.time() - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+        conn = get_db_connection()
+        rows = conn.execute(
+            'SELECT user_id, revoked_before FROM revoked_access_tokens WHERE revoked_before > ?',
+            (min_revoked_before,)
+        ).fetchall()
+        conn.close()
+
+        with self._lock:
+            self._revoked_before = {row['user_id']: row['revoked_before'] for row in rows}
+        return len(rows)
+
+    def prune(self, conn) -> int:
+        """Удаляет устаревшие записи отзыва из памяти и из БД"""
+        min_revoked_before = time.time() - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        with self._lock:
+            self._revoked_before = {
+                user_id: revoked_before
+                for user_id, revoked_before in self._revoked_before.items()
+                if revoked_before > min_revoked_before
+            }
+
+        cur = conn.execute(
+            'DELETE FROM revoked_access_tokens WHERE revoked_before <= ?',
+            (min_revoked_before,)
+        )
+        return cur.rowcount
+
+    def __len__(self):
+        return len(self._revoked_before)
+
+revocation_set = RevocationSet()
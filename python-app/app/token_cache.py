@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from .config import TOKEN_CACHE_MAX_SIZE
+
+class TokenCache:
+    """
+    Ограниченный LRU-кэш "токен -> пользователь" в памяти процесса.
+
+    Запись живет до expires_at токена, при переполнении вытесняется
+    самая давно использованная. Все операции потокобезопасны, так как
+    зависимости авторизации могут выполняться в пуле потоков.
+
+    Поколения защищают от гонки с выходом или сменой роли: поиск в БД
+    запоминает generation() до SELECT, invalidate_user отмечает пользователя
+    новым поколением, и set не кладет запись, прочитанную до этой отметки.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (token, token_type) -> (user, expires_at)
+        self._by_user = {}  # user_id -> set ключей
+        self._generation = 0
+        self._user_generations = {}  # user_id -> поколение последнего invalidate_user
+        self._lock = threading.Lock()
+
+    def get(self, token: str, token_type: str = 'access'):
+        """Возвращает пользователя из кэша или None"""
+        key = (token, token_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return user
+
+    def generation(self) -> int:
+        """Текущее поколение; читается до запроса в БД и передается в set"""
+        with self._lock:
+            return self._generation
+
+    def set(self, token: str, token_type: str, user: dict, expires_at: float, generation: int = None):
+        """
+        Кладет пользователя в кэш до момента expires_at (epoch-секунды).
+        Если с поколения generation пользователь инвалидирован, данные
+        устарели и запись не кладется.
+        """
+        key = (token, token_type)
+        with self._lock:
+            if generation is not None and self._user_generations.get(user['id'], -1) > generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (user, expires_at)
+            self._by_user.setdefault(user['id'], set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate(self, token: str):
+        """Удаляет из кэша конкретный токен (любого типа)"""
+        with self._lock:
+            for token_type in ('access', 'refresh'):
+                self._remove((token, token_type))
+
+    def invalidate_user(self, user_id: int):
+        """Удаляет из кэша все токены пользователя"""
+        with self._lock:
+            self._generation += 1
+            self._user_generations[user_id] = self._generation
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        """Удаление записи; вызывается под self._lock"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        user_id = entry[0]['id']
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+token_cache = TokenCache()
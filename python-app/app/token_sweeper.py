@@ -0,0 +1,101 @@
+import asyncio
+import time
+from datetime import datetime
+from .config import TOKEN_SWEEP_INTERVAL_SECONDS, TOKEN_SWEEP_BATCH_SIZE
+from .metrics import metrics
+from .signed_tokens import revocation_set
+from .repository import run_write
+
+class TokenSweeper:
+    """
+    Фоновое удаление просроченных токенов.
+
+    Удаляет токены порциями по batch_size строк: каждая порция - отдельная
+    запись через писателя БД (run_write), так что блокировка записи SQLite
+    не держится долго, а остальные записи не ждут всего прохода. Повторяет
+    проход каждые interval секунд. Запускается из lifespan приложения.
+    """
+
+    def __init__(self, interval: float = TOKEN_SWEEP_INTERVAL_SECONDS,
+                 batch_size: int = TOKEN_SWEEP_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_deleted = 0
+        self.last_duration = 0.0
+        self.last_run_at = None
+        self.total_deleted = 0
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def _delete_batch(self, conn, now: int) -> int:
+        cur = conn.execute('''
+            DELETE FROM user_tokens WHERE id IN (
+                SELECT id FROM user_tokens WHERE expires_at <= ? LIMIT ?
+            )
+        ''', (now, self.batch_size))
+        return cur.rowcount
+
+    async def sweep(self) -> int:
+        """Один полный проход очистки. Возвращает количество удаленных токенов"""
+        async with self._lock:
+            start_time = time.perf_counter()
+            deleted_count = 0
+
+            while True:
+                deleted = await run_write(self._delete_batch, int(time.time()))
+                deleted_count += deleted
+                if deleted < self.batch_size:
+                    break
+
+            await run_write(revocation_set.prune)
+
+            duration = time.perf_counter() - start_time
+
+            self.last_deleted = deleted_count
+            self.last_duration = duration
+            self.last_run_at = datetime.now().isoformat()
+            self.total_deleted += deleted_count
+
+            metrics.inc("token_sweeper.runs")
+            metrics.inc("token_sweeper.deleted", deleted_count)
+            metrics.set("token_sweeper.last_deleted", deleted_count)
+            metrics.observe("token_sweeper.duration_seconds", duration)
+
+            if deleted_count > 0:
+                print(f"Удалено {deleted_count} просроченных токенов за {duration * 1000:.1f} мс")
+
+            return deleted_count
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "last_deleted": self.last_deleted,
+            "last_duration_seconds": self.last_duration,
+            "last_run_at": self.last_run_at,
+            "total_deleted": self.total_deleted
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Ошибка при очистке токенов: {e}")
+
+    def start(self):
+        """Запускает периодическую очистку в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+token_sweeper = TokenSweeper()
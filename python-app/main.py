@@ -1,18 +1,55 @@
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 
 from app.config import CORS_ORIGINS, HOST, PORT
-from app.db import init_db, cleanup_expired_tokens
+from app.db import init_db, cleanup_expired_tokens, close_db_pool
 from app.minio import create_bucket_if_not_exists
+from app.metrics import metrics
+from app.token_sweeper import token_sweeper
+from app.inference_cache import inference_cache
+from app.inference_limiter import inference_limiter
+from app.analysis_jobs import analysis_jobs
+from app.ollama_client import ollama_client
+from app.circuit_breaker import ollama_breaker, OPEN
+from app.resolution_policy import resolution_policy
+from app.db_writer import db_writer
+from app.signed_tokens import revocation_set, ensure_signing_key
+from app.dependencies import require_admin
 
 from app.routes import auth, tokens, user, medical, analyse, admin
 
 from app.seo import router as seo_router
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # В режиме подписанных токенов без ключа не запускаемся
+    ensure_signing_key()
+    init_db()
+    # Восстанавливаем список отзыва подписанных токенов
+    revocation_set.load_from_db()
+    create_bucket_if_not_exists()
+    # Очищаем просроченные токены при запуске приложения
+    cleaned_count = await cleanup_expired_tokens()
+    print(f"При запуске удалено {cleaned_count} просроченных токенов")
+    # Дальше очистка идет в фоне по расписанию
+    token_sweeper.start()
+    # Все записи в БД идут через одного писателя с групповым коммитом
+    db_writer.start()
+    # Один клиент Ollama на приложение; модель прогревается в фоне
+    ollama_client.start()
+    # Обработчики фоновых задач анализа изображений
+    analysis_jobs.start()
+    yield
+    await analysis_jobs.stop()
+    await ollama_client.stop()
+    await token_sweeper.stop()
+    await db_writer.stop()
+    close_db_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # Настройки CORS
 app.add_middleware(
@@ -32,15 +69,6 @@ app.include_router(analyse.router)
 app.include_router(admin.router)
 app.include_router(seo_router)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    init_db()
-    create_bucket_if_not_exists()
-    # Очищаем просроченные токены при запуске приложения
-    cleaned_count = cleanup_expired_tokens()
-    print(f"При запуске удалено {cleaned_count} просроченных токенов")
-    yield
-
 @app.get("/")
 async def root():
     return {"message": "Backend is running!"}
@@ -79,15 +107,23 @@ async def health_check():
     
     # 2. Проверка базы данных (опционально)
     try:
-        from app.db import get_db_connection
-        conn = get_db_connection()
-        conn.execute("SELECT 1")
-        conn.close()
+        from app import repository
+        await repository.ping()
         health_status["checks"]["database"] = {"status": "up"}
     except Exception as e:
         health_status["checks"]["database"] = {"status": "down", "error": str(e)}
         is_healthy = False
     
+    # 3. Ollama: автомат защиты и исправные серверы. Разомкнутый автомат не делает
+    # сервис нездоровым - анализ работает в упрощенном режиме. Адреса серверов и
+    # подробная статистика автомата - только в /metrics
+    healthy_hosts = ollama_client.stats()["healthy_hosts"]
+    health_status["checks"]["ollama"] = {
+        "status": "down" if ollama_breaker.state == OPEN or not healthy_hosts else "up",
+        "healthy_hosts": healthy_hosts,
+        "circuit_breaker": ollama_breaker.state
+    }
+    
     if not is_healthy:
         health_status["status"] = "unhealthy"
         return JSONResponse(
@@ -97,6 +133,22 @@ async def health_check():
     
     return health_status
 
+@app.get("/metrics")
+async def get_metrics(admin = Depends(require_admin)):
+    """Внутренние метрики процесса (только для администратора)"""
+    return {
+        **metrics.snapshot(),
+        "token_sweeper": token_sweeper.stats(),
+        "inference_cache": inference_cache.stats(),
+        "ollama": {
+            **inference_limiter.stats(),
+            **ollama_client.stats(),
+            "circuit_breaker": ollama_breaker.stats()
+        },
+        "analysis_jobs": analysis_jobs.stats(),
+        "resolution": resolution_policy.stats()
+    }
+
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc):
     return JSONResponse(
@@ -6,6 +6,7 @@ import {
 import { useAuth } from '../hooks/useAuth';
 import { 
   getFilteredUsers, 
+  getUsersCount,
   updateUserRole, 
   adminDeleteUser,
   User,
@@ -251,6 +252,10 @@ function AdminPanel() {
   
   const [users, setUsers] = useState<User[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [lastParams, setLastParams] = useState<FilterUsersParams | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [counts, setCounts] = useState({ total: 0, admins: 0, banned: 0 });
   const [updatingId, setUpdatingId] = useState<number | null>(null);
   const [notification, setNotification] = useState<{type: 'success' | 'error' | 'warning' | 'info', message: string} | null>(null);
   
@@ -277,8 +282,20 @@ function AdminPanel() {
   const loadFilteredUsers = useCallback(async (params: FilterUsersParams) => {
     try {
       setLoading(true);
-      const response = await getFilteredUsers(params);
+      // Счетчики считаются на сервере: в списке загружена только первая страница
+      const countRole = (role: UserRole) => params.roles && !params.roles.includes(role)
+        ? Promise.resolve({ total: 0 })
+        : getUsersCount({ search: params.search, roles: [role] });
+      const [response, total, admins, banned] = await Promise.all([
+        getFilteredUsers(params),
+        getUsersCount({ search: params.search, roles: params.roles }),
+        countRole('admin'),
+        countRole('banned')
+      ]);
       setUsers(response.users);
+      setNextCursor(response.next_cursor ?? null);
+      setLastParams(params);
+      setCounts({ total: total.total, admins: admins.total, banned: banned.total });
       setChangedRoles(new Map());
     } catch (error) {
       console.error('Error loading users:', error);
@@ -292,6 +309,22 @@ function AdminPanel() {
     }
   }, [navigate]);
 
+  // Загрузка следующей страницы списка
+  const loadMoreUsers = async () => {
+    if (!nextCursor || !lastParams) return;
+    try {
+      setLoadingMore(true);
+      const response = await getFilteredUsers({ ...lastParams, cursor: nextCursor });
+      setUsers(prev => [...prev, ...response.users]);
+      setNextCursor(response.next_cursor ?? null);
+    } catch (error) {
+      console.error('Error loading users:', error);
+      showNotification('error', 'Не удалось загрузить список пользователей');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Функция для применения фильтров
   const applyFilters = useCallback(() => {
     const params: FilterUsersParams = {
@@ -540,7 +573,7 @@ function AdminPanel() {
             minW="200px"
           >
             <Text color="blue.800" fontSize="sm">Всего пользователей</Text>
-            <Text color="blue.900" fontSize="3xl" fontWeight="bold">{users.length}</Text>
+            <Text color="blue.900" fontSize="3xl" fontWeight="bold">{counts.total}</Text>
           </Box>
           <Box
             bg="purple.50"
@@ -553,7 +586,7 @@ function AdminPanel() {
           >
             <Text color="purple.800" fontSize="sm">Администраторов</Text>
             <Text color="purple.900" fontSize="3xl" fontWeight="bold">
-              {users.filter(u => u.role === 'admin').length}
+              {counts.admins}
             </Text>
           </Box>
           <Box
@@ -567,7 +600,7 @@ function AdminPanel() {
           >
             <Text color="orange.800" fontSize="sm">Забанено</Text>
             <Text color="orange.900" fontSize="3xl" fontWeight="bold">
-              {users.filter(u => u.role === 'banned').length}
+              {counts.banned}
             </Text>
           </Box>
         </Flex>
@@ -714,6 +747,21 @@ function AdminPanel() {
           )}
         </Box>
 
+        {/* Следующая страница списка */}
+        {!loading && nextCursor && (
+          <Flex justify="center" mt={4}>
+            <Button
+              size="sm"
+              variant="outline"
+              colorScheme="blue"
+              onClick={loadMoreUsers}
+              disabled={loadingMore}
+            >
+              {loadingMore ? <Spinner size="sm" /> : `Показать еще (${users.length} из ${counts.total})`}
+            </Button>
+          </Flex>
+        )}
+
         {/* Кнопки сохранения всех изменений */}
         {hasAnyChanges && (
           <Flex justify="flex-end" gap={3} mt={6}>
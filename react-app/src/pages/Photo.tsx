@@ -5,7 +5,7 @@ import {
 } from '@chakra-ui/react';
 import { useAuth } from '../hooks/useAuth';
 import { 
-  analyzeImage, 
+  analyzeImageStream, 
   ImageAnalysisResponse, 
   AnalyzedIngredient,
   saveAnalysis,
@@ -22,6 +22,8 @@ interface FilterAnalysesParams {
   show_safe: boolean;
   show_warnings: boolean;
   sort_order?: 'asc' | 'desc';
+  limit?: number;
+  cursor?: string;
 }
 
 // Простые SVG иконки стрелок
@@ -201,6 +203,7 @@ function Photo() {
   const [error, setError] = useState<string | null>(null);
   const [success, setSuccess] = useState<string | null>(null);
   const [savedAnalyses, setSavedAnalyses] = useState<SavedAnalysis[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [imageUrls, setImageUrls] = useState<Map<number, string>>(new Map());
   const [currentAnalysisIndex, setCurrentAnalysisIndex] = useState<number>(0);
   const [historyLoading, setHistoryLoading] = useState(false);
@@ -254,7 +257,17 @@ function Photo() {
     setIsCancelling(false);
 
     try {
-      const result = await analyzeImage(selectedImage, controller.signal);
+      // Ингредиенты показываем по мере распознавания, итоговый ответ заменяет частичный
+      setAnalysisResult(null);
+      const result = await analyzeImageStream(
+        selectedImage,
+        (ingredient) => setAnalysisResult(prev => ({
+          ingredients: [...(prev?.ingredients ?? []), ingredient],
+          warnings: prev?.warnings ?? [],
+          original_response: ''
+        })),
+        controller.signal
+      );
       setAnalysisResult(result);
       setAbortController(null);
     } catch (err) {
@@ -332,6 +345,7 @@ function Photo() {
       
       const response = await getFilteredAnalyses(filterParams);
       setSavedAnalyses(response.analyses);
+      setNextCursor(response.next_cursor ?? null);
       if (response.analyses.length > 0) {
         setCurrentAnalysisIndex(0);
       }
@@ -486,7 +500,29 @@ function Photo() {
     setCurrentAnalysisIndex(prev => prev > 0 ? prev - 1 : savedAnalyses.length - 1);
   };
 
-  const handleNextAnalysis = () => {
+  const handleNextAnalysis = async () => {
+    // Дошли до конца загруженной страницы - подгружаем следующую
+    if (currentAnalysisIndex === savedAnalyses.length - 1 && nextCursor && !historyLoading) {
+      setHistoryLoading(true);
+      try {
+        const response = await getFilteredAnalyses({
+          show_safe: showSafe,
+          show_warnings: showWarnings,
+          sort_order: 'desc',
+          cursor: nextCursor
+        });
+        setSavedAnalyses(prev => [...prev, ...response.analyses]);
+        setNextCursor(response.next_cursor ?? null);
+        if (response.analyses.length > 0) {
+          setCurrentAnalysisIndex(prev => prev + 1);
+          return;
+        }
+      } catch (err) {
+        console.error('Ошибка загрузки истории:', err);
+      } finally {
+        setHistoryLoading(false);
+      }
+    }
     setCurrentAnalysisIndex(prev => prev < savedAnalyses.length - 1 ? prev + 1 : 0);
   };
 
@@ -788,6 +824,7 @@ function Photo() {
                     }}
                     loading={saving}
                     loadingText="Сохранение..."
+                    disabled={loading}
                   >
                     Сохранить результат
                   </Button>
@@ -857,7 +894,7 @@ function Photo() {
                     {/* Информация о текущем анализе и стрелки навигации */}
                     <Flex align="center" gap={4}>
                       <Text color="blue.800" fontSize="lg">
-                        Анализ {savedAnalyses.length - currentAnalysisIndex} из {savedAnalyses.length}
+                        Анализ {currentAnalysisIndex + 1} из {savedAnalyses.length}{nextCursor ? '+' : ''}
                       </Text>
                       {savedAnalyses.length > 1 && (
                         <Flex gap={2}>
@@ -69,6 +69,7 @@ export interface UpdateUserRoleData {
 
 export interface AdminUsersResponse {
   users: User[];
+  next_cursor?: string | null;
 }
 
 export interface FilterUsersParams {
@@ -76,12 +77,16 @@ export interface FilterUsersParams {
   roles?: UserRole[];
   sort_by?: 'username' | 'created_at';
   sort_order?: 'asc' | 'desc';
+  limit?: number;
+  cursor?: string;
 }
 
 export interface FilterAnalysesParams {
   show_safe: boolean;
   show_warnings: boolean;
   sort_order?: 'asc' | 'desc';
+  limit?: number;
+  cursor?: string;
 }
 
 // Сохранение refresh токена
@@ -194,6 +199,7 @@ export interface SavedAnalysis {
 
 export interface SavedAnalysesResponse {
   analyses: SavedAnalysis[];
+  next_cursor?: string | null;
 }
 
 // Базовый запрос с авторизацией
@@ -521,6 +527,82 @@ export const analyzeImage = async (
   }
 };
 
+// Потоковый анализ изображения: ингредиенты приходят по мере распознавания (SSE)
+export const analyzeImageStream = async (
+  imageFile: File,
+  onIngredient: (ingredient: AnalyzedIngredient) => void,
+  signal?: AbortSignal
+): Promise<ImageAnalysisResponse> => {
+  const formData = new FormData();
+  formData.append('image', imageFile);
+
+  let response: Response;
+  try {
+    response = await authFetch(`${API_BASE_URL}/analyze-image/stream`, {
+      method: 'POST',
+      body: formData,
+      signal,
+    });
+  } catch (error) {
+    if (error instanceof Error && error.name === 'AbortError') {
+      throw new Error('Анализ отменен');
+    }
+    throw new Error('Ошибка сети при отправке изображения');
+  }
+
+  if (!response.ok || !response.body) {
+    if (response.status === 401) {
+      removeToken();
+    }
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(typeof errorData.detail === 'string' ? errorData.detail : `Ошибка ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  try {
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // События разделены пустой строкой
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let eventName = 'message';
+        let data = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event: ')) eventName = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        if (!data) continue;
+
+        const payload = JSON.parse(data);
+        if (eventName === 'ingredient') {
+          onIngredient(payload);
+        } else if (eventName === 'done') {
+          return payload;
+        } else if (eventName === 'error') {
+          throw new Error(payload.detail || 'Ошибка анализа изображения');
+        }
+      }
+    }
+  } catch (error) {
+    if (error instanceof Error && error.name === 'AbortError') {
+      throw new Error('Анализ отменен');
+    }
+    throw error;
+  }
+
+  throw new Error('Соединение прервано до завершения анализа');
+};
+
 // Сохранение анализа
 export const saveAnalysis = async (imageFile: File, analysisResult: ImageAnalysisResponse): Promise<SavedAnalysis> => {
   const formData = new FormData();
@@ -729,6 +811,14 @@ export const getFilteredUsers = async (params: FilterUsersParams): Promise<Admin
     queryParams.append('sort_order', params.sort_order);
   }
   
+  if (params.limit) {
+    queryParams.append('limit', params.limit.toString());
+  }
+  
+  if (params.cursor) {
+    queryParams.append('cursor', params.cursor);
+  }
+  
   const url = `${API_BASE_URL}/admin/filter/users${queryParams.toString() ? '?' + queryParams.toString() : ''}`;
   
   const response = await authFetch(url, {
@@ -749,6 +839,38 @@ export const getFilteredUsers = async (params: FilterUsersParams): Promise<Admin
   return response.json();
 };
 
+// Количество пользователей под фильтрами (только для админа)
+export const getUsersCount = async (params: Pick<FilterUsersParams, 'search' | 'roles'>): Promise<{ total: number }> => {
+  const queryParams = new URLSearchParams();
+  
+  if (params.search) {
+    queryParams.append('search', params.search);
+  }
+  
+  if (params.roles && params.roles.length > 0) {
+    params.roles.forEach(role => queryParams.append('roles', role));
+  }
+  
+  const url = `${API_BASE_URL}/admin/users/count${queryParams.toString() ? '?' + queryParams.toString() : ''}`;
+  
+  const response = await authFetch(url, {
+    method: 'GET',
+  });
+
+  if (!response.ok) {
+    if (response.status === 401) {
+      removeTokens();
+    }
+    if (response.status === 403) {
+      throw new Error('Доступ запрещен. Требуются права администратора');
+    }
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.detail || 'Ошибка получения количества пользователей');
+  }
+
+  return response.json();
+};
+
 // Получение отфильтрованных анализов
 export const getFilteredAnalyses = async (params: FilterAnalysesParams): Promise<SavedAnalysesResponse> => {
   const queryParams = new URLSearchParams();
@@ -758,6 +880,12 @@ export const getFilteredAnalyses = async (params: FilterAnalysesParams): Promise
   if (params.sort_order) {
     queryParams.append('sort_order', params.sort_order);
   }
+  if (params.limit) {
+    queryParams.append('limit', params.limit.toString());
+  }
+  if (params.cursor) {
+    queryParams.append('cursor', params.cursor);
+  }
   
   const url = `${API_BASE_URL}/filter/saved-analyses${queryParams.toString() ? '?' + queryParams.toString() : ''}`;
   
@@ -20,6 +20,7 @@ jest.mock('../hooks/useAuth', () => ({
 // Mock API services
 jest.mock('../services/apiService', () => ({
   getFilteredUsers: jest.fn().mockResolvedValue({ users: [] }),
+  getUsersCount: jest.fn().mockResolvedValue({ total: 0 }),
   getFilteredAnalyses: jest.fn().mockResolvedValue({ analyses: [] }),
   getMedicalData: jest.fn().mockResolvedValue({ contraindications: '', allergens: '' }),
   saveMedicalData: jest.fn().mockResolvedValue({}),
@@ -31,6 +32,7 @@ jest.mock('../services/apiService', () => ({
   updateUserRole: jest.fn().mockResolvedValue({}),
   deleteUser: jest.fn().mockResolvedValue({}),
   analyzeImage: jest.fn().mockResolvedValue({ ingredients: [], warnings: [] }),
+  analyzeImageStream: jest.fn().mockResolvedValue({ ingredients: [], warnings: [] }),
   saveAnalysis: jest.fn().mockResolvedValue({}),
   deleteSavedAnalysis: jest.fn().mockResolvedValue({}),
   reanalyzeSavedAnalysis: jest.fn().mockResolvedValue({}),
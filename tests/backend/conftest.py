@@ -22,6 +22,9 @@ os.environ['MINIO_SECRET_KEY'] = 'test_secret'
 os.environ['MINIO_BUCKET_NAME'] = 'test_bucket'
 os.environ['MINIO_SECURE'] = 'false'
 os.environ['OLLAMA_HOST'] = 'http://localhost:11434'
+# Ollama в тестах недоступен: без прогрева модели и keep-alive запросов
+os.environ['OLLAMA_WARMUP'] = 'false'
+os.environ['OLLAMA_KEEP_ALIVE_PING_SECONDS'] = '0'
 os.environ['ACCESS_TOKEN_EXPIRE_MINUTES'] = '15'
 os.environ['REFRESH_TOKEN_EXPIRE_DAYS'] = '7'
 os.environ['CORS_ORIGINS'] = 'http://localhost:3000'
@@ -33,7 +36,7 @@ os.environ['DATABASE_PATH'] = TEST_DB_PATH
 
 # Импортируем app после установки переменных
 from main import app
-from app.db import get_db_connection, init_db
+from app.db import get_db_connection, init_db, close_db_pool
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -65,17 +68,30 @@ def setup_database():
     print(f"\n=== Cleaning up database file {TEST_DB_PATH} ===")
     conn = get_db_connection()
     conn.close()
+    # Закрываем пул, чтобы SQLite удалил -wal и -shm файлы
+    close_db_pool()
     if os.path.exists(TEST_DB_PATH):
         os.unlink(TEST_DB_PATH)
     os.rmdir(TEST_DB_DIR)
     print("=== Cleanup complete ===\n")
 
 
+@pytest.fixture(autouse=True)
+def reset_ollama_breaker():
+    """Ошибки Ollama в одном тесте не размыкают автомат защиты для следующих"""
+    from app.circuit_breaker import ollama_breaker
+    ollama_breaker.reset()
+    yield
+    ollama_breaker.reset()
+
+
 @pytest.fixture(scope="function")
 def client(setup_database):
     """Тестовый клиент FastAPI"""
-    with TestClient(app) as test_client:
-        yield test_client
+    # MinIO в тестах недоступен, не ждем таймаутов при старте lifespan
+    with patch('main.create_bucket_if_not_exists'):
+        with TestClient(app) as test_client:
+            yield test_client
 
 
 @pytest.fixture(scope="function")
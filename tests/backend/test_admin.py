@@ -1,4 +1,5 @@
 import pytest
+from uuid import uuid4
 
 
 class TestAdmin:
@@ -72,4 +73,85 @@ class TestAdmin:
                              headers=test_admin["headers"])
         assert response.status_code == 200
         data = response.json()
-        assert len(data["users"]) >= 1
\ No newline at end of file
+        assert len(data["users"]) >= 1
+
+def create_users(prefix, names, role='user'):
+    """Создает пользователей prefix + name напрямую через репозиторий"""
+    import asyncio
+    from app import repository
+    from app.db import get_db_connection
+    created = []
+    for name in names:
+        user = asyncio.run(repository.create_user(f"{prefix}{name}", f"{prefix}{name}@example.com", "hash"))
+        created.append(user)
+    if role != 'user':
+        with get_db_connection() as conn:
+            conn.executemany("UPDATE users SET role = ? WHERE id = ?", [(role, u["id"]) for u in created])
+    return created
+
+
+class TestAdminUsersPagination:
+    """Тесты поиска и постраничного списка пользователей в админ-панели"""
+
+    def collect(self, client, headers, url):
+        seen, cursor = [], None
+        while True:
+            page_url = url + (f"&cursor={cursor}" if cursor else "")
+            response = client.get(page_url, headers=headers)
+            assert response.status_code == 200, response.text
+            data = response.json()
+            assert len(data["users"]) <= 2
+            seen.extend(u["username"] for u in data["users"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return seen
+
+    def test_search_pages_by_username(self, client, test_admin):
+        """Страницы поиска идут по имени без учета регистра, роли сливаются"""
+        prefix = f"pg{uuid4().hex[:8]}_"
+        create_users(prefix, ["Bob", "alice", "carol"])
+        create_users(prefix, ["Dave", "eve"], role='banned')
+
+        url = f"/admin/filter/users?search={prefix}&roles=user&roles=banned&limit=2"
+        assert self.collect(client, test_admin["headers"], url) == [
+            f"{prefix}alice", f"{prefix}Bob", f"{prefix}carol", f"{prefix}Dave", f"{prefix}eve"
+        ]
+        url += "&sort_order=desc&roles=admin"
+        assert self.collect(client, test_admin["headers"], url)[0] == f"{prefix}eve"
+
+    def test_substring_and_prefix_search(self, client, test_admin):
+        """Подстрока ищется от трех символов, короткий запрос ищет начало имени"""
+        prefix = f"zq{uuid4().hex[:8]}"
+        create_users(prefix, ["_Lynx", "_lyre"])
+        headers = test_admin["headers"]
+
+        found = client.get("/admin/filter/users?search=LYN", headers=headers).json()["users"]
+        assert f"{prefix}_Lynx" in [u["username"] for u in found]
+        assert f"{prefix}_lyre" not in [u["username"] for u in found]
+
+        found = client.get("/admin/filter/users?search=ZQ", headers=headers).json()["users"]
+        assert {f"{prefix}_Lynx", f"{prefix}_lyre"} <= {u["username"] for u in found}
+        assert all(u["username"].lower().startswith("zq") for u in found)
+
+    def test_count_users(self, client, test_admin):
+        """Количество пользователей учитывает поиск и роли"""
+        prefix = f"cnt{uuid4().hex[:8]}_"
+        create_users(prefix, ["a", "b", "c"])
+        create_users(prefix, ["d"], role='banned')
+        headers = test_admin["headers"]
+
+        assert client.get(f"/admin/users/count?search={prefix}", headers=headers).json()["total"] == 4
+        response = client.get(f"/admin/users/count?search={prefix}&roles=banned", headers=headers)
+        assert response.json()["total"] == 1
+
+    def test_all_users_are_limited(self, client, test_admin):
+        """/admin/users отдает страницу и курсор на следующую"""
+        create_users(f"lim{uuid4().hex[:8]}_", ["a", "b"])
+        data = client.get("/admin/users?limit=1", headers=test_admin["headers"]).json()
+        assert len(data["users"]) == 1
+        assert data["next_cursor"] is not None
+
+    def test_invalid_sort_field(self, client, test_admin):
+        """Сортировка по неизвестному полю отклоняется"""
+        response = client.get("/admin/filter/users?sort_by=password_hash", headers=test_admin["headers"])
+        assert response.status_code == 400
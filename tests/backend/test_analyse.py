@@ -1,7 +1,17 @@
 import pytest
 import io
+import asyncio
 from unittest.mock import patch
 
+from app.funcs import (
+    analyze_image_with_fallback, _inflight_analyses, _inflight_waiters, call_ollama_with_retry,
+    parse_ollama_response, parse_strict_response, ANALYSIS_SCHEMA
+)
+from app.config import OLLAMA_NUM_PREDICT
+from app.inference_limiter import InferenceOverloaded
+from app.metrics import metrics
+from app.routes.analyse import run_until_disconnected, ClientDisconnected
+
 class TestAnalyse:
     """Тесты анализа изображений"""
     
@@ -98,6 +108,42 @@ class TestAnalyse:
                              headers=test_user["headers"])
         assert response.status_code == 200
     
+    def test_saved_analyses_keyset_pagination(self, client, test_user):
+        """Страницы по курсору не пересекаются и сохраняют фильтр и порядок"""
+        import asyncio
+        from app import repository
+        user_id = test_user["user"]["id"]
+        ids = []
+        for warnings_count in [0, 1, 0, 0, 1]:
+            saved = asyncio.run(repository.insert_analysis(
+                user_id, f"user_{user_id}/page.png", {"ingredients": ["test"], "warnings": []},
+                1, warnings_count
+            ))
+            ids.append(saved["id"])
+        
+        def collect(url):
+            seen, cursor = [], None
+            while True:
+                page_url = url + (f"&cursor={cursor}" if cursor else "")
+                data = client.get(page_url, headers=test_user["headers"]).json()
+                assert len(data["analyses"]) <= 2
+                seen.extend(a["id"] for a in data["analyses"])
+                cursor = data["next_cursor"]
+                if cursor is None:
+                    return seen
+        
+        with patch('app.routes.analyse.get_image_url', return_value="http://minio/page.png"):
+            assert collect("/saved-analyses?limit=2") == ids[::-1]
+            assert collect("/filter/saved-analyses?limit=2&sort_order=asc") == ids
+            assert collect("/filter/saved-analyses?limit=2&show_warnings=false") == [ids[3], ids[2], ids[0]]
+            assert collect("/filter/saved-analyses?limit=2&show_safe=false&sort_order=asc") == [ids[1], ids[4]]
+    
+    def test_saved_analyses_invalid_cursor(self, client, test_user):
+        """Поврежденный курсор отклоняется"""
+        for cursor in ["not-a-cursor", "WzFd"]:
+            response = client.get(f"/saved-analyses?cursor={cursor}", headers=test_user["headers"])
+            assert response.status_code == 400
+    
     def test_delete_analysis(self, client, test_user):
         """Удаление анализа"""
         import base64
@@ -120,4 +166,212 @@ class TestAnalyse:
         response = client.delete(f"/saved-analyses/{analysis_id}",
                                 headers=test_user["headers"])
         assert response.status_code == 200
-        assert response.json()["message"] == "Анализ успешно удален"
\ No newline at end of file
+        assert response.json()["message"] == "Анализ успешно удален"
+
+
+class TestSingleFlight:
+    """Тесты объединения одновременных анализов одного изображения"""
+
+    @staticmethod
+    def slow_ollama(calls):
+        async def call(*args, **kwargs):
+            calls.append(args[1])
+            await asyncio.sleep(0.05)
+            return {'message': {'content': '{"ingredients": ["tomato", "cheese"]}'}}
+        return call
+
+    def test_identical_requests_share_inference(self):
+        """Одновременные запросы с одним изображением вызывают Ollama один раз"""
+        calls = []
+
+        async def scenario():
+            return await asyncio.gather(
+                analyze_image_with_fallback("aW1n", b"same image"),
+                analyze_image_with_fallback("aW1n", b"same image"),
+                analyze_image_with_fallback("b3RoZXI=", b"other image"),
+            )
+
+        with patch('app.funcs.call_ollama_with_retry', side_effect=self.slow_ollama(calls)):
+            first, second, other = asyncio.run(scenario())
+
+        assert sorted(calls) == [b"other image", b"same image"]
+        assert first == second and first["source"] == "ollama"
+        assert first["ingredients"] is not second["ingredients"]
+        assert other["ingredients"] == ["tomato", "cheese"]
+        assert _inflight_analyses == {}
+
+    def test_cancelled_caller_does_not_cancel_others(self):
+        """Отмена одного ожидающего не прерывает общий анализ"""
+        calls = []
+
+        async def scenario():
+            leader = asyncio.create_task(analyze_image_with_fallback("aW1n", b"image"))
+            follower = asyncio.create_task(analyze_image_with_fallback("aW1n", b"image"))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        with patch('app.funcs.call_ollama_with_retry', side_effect=self.slow_ollama(calls)):
+            result = asyncio.run(scenario())
+
+        assert len(calls) == 1
+        assert result["ingredients"] == ["tomato", "cheese"]
+
+    def test_last_cancelled_caller_cancels_inference(self):
+        """Если отменены все ожидающие, распознавание отменяется вместе с запросом к Ollama"""
+        cancelled = []
+
+        async def hanging_ollama(*args, **kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def scenario():
+            first = asyncio.create_task(analyze_image_with_fallback("aW1n", b"abandoned"))
+            second = asyncio.create_task(analyze_image_with_fallback("aW1n", b"abandoned"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            await asyncio.sleep(0.01)
+            assert cancelled == []
+            second.cancel()
+            await asyncio.gather(first, second, return_exceptions=True)
+            await asyncio.sleep(0.01)
+
+        before = metrics.snapshot()["counters"].get("analysis.cancelled", 0)
+        with patch('app.funcs.call_ollama_with_retry', side_effect=hanging_ollama):
+            asyncio.run(asyncio.wait_for(scenario(), timeout=2))
+
+        assert cancelled == [True]
+        assert metrics.snapshot()["counters"]["analysis.cancelled"] == before + 1
+        assert _inflight_analyses == {} and _inflight_waiters == {}
+
+    def test_new_caller_after_cancel_gets_fresh_analysis(self):
+        """Запрос, пришедший сразу после отмены, запускает новое распознавание, а не ждет отмененное"""
+        calls = []
+
+        async def ollama(*args, **kwargs):
+            calls.append(args[1])
+            if len(calls) == 1:
+                await asyncio.sleep(5)
+            return {'message': {'content': '{"ingredients": ["rice"]}'}}
+
+        async def scenario():
+            first = asyncio.create_task(analyze_image_with_fallback("aW1n", b"retried"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            # Отмененная задача еще не завершилась, а новый запрос уже пришел
+            second = asyncio.create_task(analyze_image_with_fallback("aW1n", b"retried"))
+            await asyncio.gather(first, return_exceptions=True)
+            return await second
+
+        with patch('app.funcs.call_ollama_with_retry', side_effect=ollama):
+            result = asyncio.run(asyncio.wait_for(scenario(), timeout=2))
+
+        assert result["ingredients"] == ["rice"]
+        assert len(calls) == 2
+        assert _inflight_analyses == {} and _inflight_waiters == {}
+
+    def test_failed_inference_releases_waiters(self):
+        """Ошибка общего распознавания (перегрузка) не оставляет ожидающих в _inflight_waiters"""
+        async def scenario():
+            return await asyncio.gather(
+                analyze_image_with_fallback("aW1n", b"overloaded"),
+                analyze_image_with_fallback("aW1n", b"overloaded"),
+                return_exceptions=True
+            )
+
+        with patch('app.funcs.inference_limiter.acquire', side_effect=InferenceOverloaded(5)):
+            for _ in range(3):
+                results = asyncio.run(scenario())
+                assert all(isinstance(result, InferenceOverloaded) for result in results)
+
+        assert _inflight_analyses == {} and _inflight_waiters == {}
+
+    def test_sequential_requests_are_not_coalesced(self):
+        """После завершения анализа следующий запрос выполняется заново"""
+        calls = []
+        with patch('app.funcs.call_ollama_with_retry', side_effect=self.slow_ollama(calls)):
+            asyncio.run(analyze_image_with_fallback("aW1n", b"image"))
+            asyncio.run(analyze_image_with_fallback("aW1n", b"image"))
+
+        assert len(calls) == 2
+
+
+class TestStructuredOutput:
+    """Тесты ответа Ollama по JSON-схеме и предела токенов"""
+
+    def test_request_uses_schema_and_token_limit(self):
+        """Запрос распознавания передает схему ответа и num_predict"""
+        async def chat(**kwargs):
+            return {'message': {'content': '{"ingredients": ["rice"]}'}}
+
+        with patch('app.funcs.ollama_client.chat', side_effect=chat) as mock_chat:
+            asyncio.run(call_ollama_with_retry("aW1n", b"image"))
+
+        kwargs = mock_chat.call_args.kwargs
+        assert kwargs["format"] == ANALYSIS_SCHEMA
+        assert kwargs["options"]["num_predict"] == OLLAMA_NUM_PREDICT
+
+    def test_strict_parse(self):
+        """Ответ по схеме разбирается напрямую"""
+        assert parse_strict_response('{"ingredients": ["Tomato", "1. cheese", " "]}') == ["Tomato", "cheese"]
+        assert parse_strict_response('{"ingredients": "tomato"}') is None
+        assert parse_strict_response('{"ingredients": [1, 2]}') is None
+        assert parse_strict_response('ingredients: tomato') is None
+
+    def test_truncated_response_is_salvaged(self):
+        """Обрезанный по num_predict ответ отдает завершенные элементы"""
+        assert parse_ollama_response('{"ingredients": ["tomato", "cheese", "fl') == ["tomato", "cheese"]
+
+    def test_heuristic_fallback(self):
+        """Ответ не по схеме разбирается прежними эвристиками"""
+        assert parse_ollama_response('Here you go:\n```json\n{"ingredients": ["salt"]}\n```') == ["salt"]
+
+
+class TestClientDisconnect:
+    """Тесты отмены анализа при отключении клиента"""
+
+    class FakeRequest:
+        def __init__(self, disconnect_after):
+            self.polls = 0
+            self.disconnect_after = disconnect_after
+            self.url = type("URL", (), {"path": "/analyze-image"})()
+
+        async def is_disconnected(self):
+            self.polls += 1
+            return self.polls >= self.disconnect_after
+
+    def test_disconnect_cancels_work(self):
+        """Отключение клиента отменяет выполняющуюся задачу"""
+        cancelled = []
+
+        async def work():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def scenario():
+            with pytest.raises(ClientDisconnected):
+                await run_until_disconnected(self.FakeRequest(2), work(), poll_interval=0.01)
+
+        before = metrics.snapshot()["counters"].get("analysis.client_disconnected", 0)
+        asyncio.run(asyncio.wait_for(scenario(), timeout=2))
+
+        assert cancelled == [True]
+        assert metrics.snapshot()["counters"]["analysis.client_disconnected"] == before + 1
+
+    def test_connected_client_gets_result(self):
+        """Пока клиент подключен, результат возвращается как обычно"""
+        async def work():
+            await asyncio.sleep(0.03)
+            return "result"
+
+        request = self.FakeRequest(100)
+        result = asyncio.run(run_until_disconnected(request, work(), poll_interval=0.01))
+
+        assert result == "result"
+        assert request.polls >= 1
@@ -0,0 +1,103 @@
+import io
+import json
+import time
+from unittest.mock import patch
+from PIL import Image
+
+from app.analysis_jobs import analysis_jobs
+
+
+def make_png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def submit(client, user, image_data):
+    return client.post("/analysis-jobs", headers=user["headers"],
+                       files={"image": ("photo.png", io.BytesIO(image_data), "image/png")})
+
+
+def wait_finished(client, user, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/analysis-jobs/{job_id}", headers=user["headers"]).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Задача {job_id} не завершилась за {timeout} с")
+
+
+class TestAnalysisJobs:
+    """Тесты фоновых задач анализа изображений"""
+
+    def test_job_lifecycle(self, client, test_user, mock_ollama):
+        """Задача сразу возвращается в статусе queued, затем получает результат анализа"""
+        client.post("/medical-data", headers=test_user["headers"],
+                    json={"allergens": "cheese", "contraindications": None})
+
+        response = submit(client, test_user, make_png("navy"))
+
+        assert response.status_code == 202
+        assert response.json()["status"] == "queued"
+
+        job = wait_finished(client, test_user, response.json()["id"])
+        assert job["status"] == "done"
+        assert [i["name"] for i in job["result"]["ingredients"]] == ["tomato", "cheese", "flour"]
+        assert job["result"]["warnings"] == ["⚠️ Аллерген обнаружен: cheese"]
+
+    def test_invalid_image_rejected_before_queue(self, client, test_user):
+        """Некорректное изображение отклоняется сразу, задача не создается"""
+        response = client.post("/analysis-jobs", headers=test_user["headers"],
+                               files={"image": ("photo.png", io.BytesIO(b"not an image"), "image/png")})
+
+        assert response.status_code == 400
+
+    def test_job_visible_only_to_owner(self, client, test_user, test_admin, mock_ollama):
+        """Чужая или несуществующая задача - 404"""
+        job_id = submit(client, test_user, make_png("teal")).json()["id"]
+
+        assert client.get(f"/analysis-jobs/{job_id}", headers=test_admin["headers"]).status_code == 404
+        assert client.get("/analysis-jobs/missing", headers=test_user["headers"]).status_code == 404
+        assert client.get(f"/analysis-jobs/{job_id}/events", headers=test_admin["headers"]).status_code == 404
+
+    def test_events_stream(self, client, test_user, mock_ollama):
+        """Поток SSE сообщает смену статусов и завершается результатом"""
+        job_id = submit(client, test_user, make_png("maroon")).json()["id"]
+
+        with client.stream("GET", f"/analysis-jobs/{job_id}/events", headers=test_user["headers"]) as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            lines = [line for line in response.iter_lines() if line]
+
+        events = [line.split(": ", 1)[1] for line in lines if line.startswith("event: ")]
+        data = [json.loads(line.split(": ", 1)[1]) for line in lines if line.startswith("data: ")]
+        assert events[-1] == "done"
+        assert set(events) <= {"queued", "running", "done"}
+        assert data[-1]["result"]["ingredients"][0]["name"] == "tomato"
+
+    def test_ollama_failure_gives_fallback_result(self, client, test_user):
+        """Сбой Ollama не роняет задачу: результат в упрощенном режиме"""
+        with patch('app.funcs.call_ollama_with_retry', side_effect=Exception("ollama down")):
+            job_id = submit(client, test_user, make_png("olive")).json()["id"]
+            job = wait_finished(client, test_user, job_id)
+
+        assert job["status"] == "done"
+        assert job["result"]["warnings"][0].startswith("ℹ️")
+
+    def test_full_queue_returns_429(self, client, test_user):
+        """При заполненной очереди задача не создается, ответ 429 с Retry-After"""
+        with patch.object(analysis_jobs, "max_pending", 0):
+            response = submit(client, test_user, make_png("silver"))
+
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+    def test_finished_jobs_expire(self, client, test_user, mock_ollama):
+        """Завершенная задача удаляется по истечении TTL"""
+        job_id = submit(client, test_user, make_png("gold")).json()["id"]
+        job = wait_finished(client, test_user, job_id)
+
+        with patch('app.analysis_jobs.time.time', return_value=job["updated_at"] + analysis_jobs.ttl + 1):
+            response = client.get(f"/analysis-jobs/{job_id}", headers=test_user["headers"])
+
+        assert response.status_code == 404
@@ -0,0 +1,121 @@
+import io
+import json
+import asyncio
+from unittest.mock import patch
+from PIL import Image
+
+from app.batch_analysis import analyze_images_batch
+from app.config import ANALYSIS_BATCH_MAX_IMAGES
+from app import repository
+
+
+def make_png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def read_events(client, user, files):
+    upload = [("images", (name, io.BytesIO(data), "image/png")) for name, data in files]
+    with client.stream("POST", "/analyze-images", headers=user["headers"], files=upload) as response:
+        assert response.status_code == 200
+        lines = [line for line in response.iter_lines() if line]
+    names = [line.split(": ", 1)[1] for line in lines if line.startswith("event: ")]
+    data = [json.loads(line.split(": ", 1)[1]) for line in lines if line.startswith("data: ")]
+    return list(zip(names, data))
+
+
+class TestAnalyzeImagesEndpoint:
+    """Тесты пакетного анализа изображений"""
+
+    def test_each_image_gets_result(self, client, test_user, mock_ollama):
+        """Каждое изображение приходит отдельным событием с флагами, медданные читаются один раз"""
+        client.post("/medical-data", headers=test_user["headers"],
+                    json={"allergens": "cheese", "contraindications": None})
+        files = [("a.png", make_png("azure")), ("b.png", make_png("bisque")), ("c.png", make_png("crimson"))]
+
+        with patch('app.routes.analyse.repository.get_medical_data',
+                   side_effect=repository.get_medical_data) as medical:
+            events = read_events(client, test_user, files)
+
+        assert medical.call_count == 1
+        results = [data for name, data in events if name == "result"]
+        assert sorted(data["index"] for data in results) == [0, 1, 2]
+        assert {data["filename"] for data in results} == {"a.png", "b.png", "c.png"}
+        assert all(data["warnings"] == ["⚠️ Аллерген обнаружен: cheese"] for data in results)
+        assert events[-1] == ("done", {"analyzed": 3, "failed": 0})
+
+    def test_invalid_file_does_not_fail_batch(self, client, test_user, mock_ollama):
+        """Некорректный файл дает событие error, остальные распознаются"""
+        files = [("good.png", make_png("sienna")), ("bad.png", b"not an image")]
+
+        events = read_events(client, test_user, files)
+
+        errors = [data for name, data in events if name == "error"]
+        assert len(errors) == 1
+        assert errors[0]["index"] == 1 and errors[0]["filename"] == "bad.png"
+        assert "Некорректный формат изображения" in errors[0]["detail"]
+        assert [data["index"] for name, data in events if name == "result"] == [0]
+        assert events[-1] == ("done", {"analyzed": 1, "failed": 1})
+
+    def test_too_many_images(self, client, test_user):
+        """Пакет больше ANALYSIS_BATCH_MAX_IMAGES отклоняется целиком"""
+        upload = [("images", (f"{i}.png", io.BytesIO(b"x"), "image/png"))
+                  for i in range(ANALYSIS_BATCH_MAX_IMAGES + 1)]
+
+        response = client.post("/analyze-images", headers=test_user["headers"], files=upload)
+
+        assert response.status_code == 400
+
+
+class TestAnalyzeImagesBatch:
+    """Тесты планирования пакета на распознавание"""
+
+    def test_cache_hits_first_and_concurrency_bounded(self):
+        """Найденные в кэше отдаются сразу, распознавания идут не больше concurrency одновременно"""
+        cached = make_png("indigo")
+        active, peak = [0], [0]
+
+        async def slow_analysis(image_base64, image_data):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.02)
+            active[0] -= 1
+            return {"ingredients": ["rice"], "warnings": [], "original_response": "", "source": "ollama"}
+
+        async def scenario():
+            images = {0: make_png("salmon"), 1: cached, 2: make_png("orchid"), 3: make_png("linen")}
+            return [(index, result["source"]) async for index, result in analyze_images_batch(images, 2)]
+
+        with patch('app.batch_analysis.analyze_image_with_fallback', side_effect=slow_analysis):
+            asyncio.run(self.collect({0: cached}))
+            results = asyncio.run(scenario())
+
+        assert results[0] == (1, "cache")
+        assert sorted(index for index, _ in results[1:]) == [0, 2, 3]
+        assert peak[0] == 2
+
+    def test_closing_cancels_pending(self):
+        """Закрытие генератора отменяет незавершенные распознавания"""
+        calls = []
+
+        async def slow_ollama(image_base64, image_data):
+            calls.append(image_data)
+            await asyncio.sleep(5)
+
+        async def scenario():
+            batch = analyze_images_batch({0: make_png("tan"), 1: make_png("peru")}, 1)
+            task = asyncio.create_task(batch.__anext__())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await batch.aclose()
+
+        with patch('app.funcs.call_ollama_with_retry', side_effect=slow_ollama):
+            asyncio.run(asyncio.wait_for(scenario(), timeout=2))
+
+        assert len(calls) == 1
+
+    @staticmethod
+    async def collect(images):
+        return [item async for item in analyze_images_batch(images)]
@@ -0,0 +1,132 @@
+import asyncio
+import io
+import time
+import pytest
+from unittest.mock import patch
+from PIL import Image
+
+from app.circuit_breaker import CircuitBreaker, CircuitOpen, ollama_breaker, CLOSED, OPEN, HALF_OPEN
+from app.inference_limiter import InferenceOverloaded
+
+
+def make_png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def call(breaker, error=None, delay=0):
+    async with breaker.protect():
+        if delay:
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+    return "ok"
+
+
+def run(breaker, error=None):
+    try:
+        return asyncio.run(call(breaker, error))
+    except Exception as e:
+        return e
+
+
+class TestCircuitBreaker:
+    """Тесты автомата защиты"""
+
+    def test_opens_on_failure_rate(self):
+        """Автомат размыкается, когда доля ошибок достигает порога при достаточном числе вызовов"""
+        breaker = CircuitBreaker("test", window=10, min_calls=4, failure_rate=0.5, open_seconds=30)
+
+        run(breaker)
+        run(breaker, ValueError("down"))
+        run(breaker, ValueError("down"))
+        assert breaker.state == CLOSED
+
+        run(breaker, ValueError("down"))
+        assert breaker.state == OPEN
+
+        start = time.perf_counter()
+        assert isinstance(run(breaker), CircuitOpen)
+        assert time.perf_counter() - start < 0.1
+        assert breaker.stats()["rejected"] == 1
+
+    def test_single_probe_recovery(self):
+        """После паузы пропускается ровно один пробный вызов, успех замыкает цепь"""
+        breaker = CircuitBreaker("test", window=4, min_calls=1, failure_rate=0.5, open_seconds=0.01)
+        run(breaker, ValueError("down"))
+        time.sleep(0.02)
+
+        async def scenario():
+            probe = asyncio.create_task(call(breaker, delay=0.02))
+            await asyncio.sleep(0)
+            with pytest.raises(CircuitOpen):
+                await call(breaker)
+            assert breaker.state == HALF_OPEN
+            return await probe
+
+        assert asyncio.run(scenario()) == "ok"
+        assert breaker.state == CLOSED
+        assert breaker.stats()["recent_calls"] == 0
+
+    def test_failed_probe_reopens(self):
+        """Неудачный пробный вызов снова размыкает цепь"""
+        breaker = CircuitBreaker("test", window=4, min_calls=1, failure_rate=0.5, open_seconds=0.01)
+        run(breaker, ValueError("down"))
+        time.sleep(0.02)
+
+        run(breaker, ValueError("still down"))
+
+        assert breaker.state == OPEN
+        assert isinstance(run(breaker), CircuitOpen)
+
+    def test_ignored_and_cancelled_calls_are_neutral(self):
+        """Перегрузка очереди и отмена не считаются ошибками зависимости"""
+        breaker = CircuitBreaker("test", window=4, min_calls=1, failure_rate=0.5,
+                                 ignored=(InferenceOverloaded,))
+        run(breaker, InferenceOverloaded(5))
+
+        async def cancelled():
+            task = asyncio.create_task(call(breaker, delay=1))
+            await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(cancelled())
+
+        assert breaker.state == CLOSED
+        assert breaker.stats()["recent_calls"] == 0
+
+
+class TestOllamaBreaker:
+    """Тесты автомата защиты вокруг Ollama"""
+
+    def test_open_breaker_skips_ollama(self, client, test_user):
+        """Пока автомат разомкнут, анализ сразу отдает fallback без вызова Ollama"""
+        with patch('app.funcs.call_ollama_with_retry', side_effect=Exception("ollama down")) as failing:
+            for color in ["#010101", "#020202", "#030303", "#040404"]:
+                client.post("/analyze-image", headers=test_user["headers"],
+                            files={"image": ("photo.png", io.BytesIO(make_png(color)), "image/png")})
+            assert ollama_breaker.state == OPEN
+            calls = failing.call_count
+
+            response = client.post("/analyze-image", headers=test_user["headers"],
+                                   files={"image": ("photo.png", io.BytesIO(make_png("#050505")), "image/png")})
+
+        assert failing.call_count == calls
+        assert response.status_code == 200
+        assert response.json()["warnings"][0].startswith("ℹ️")
+
+    def test_health_shows_breaker_state(self, client, test_admin):
+        """Разомкнутый автомат виден в /health как down, подробности - в /metrics"""
+        with patch('minio.Minio'):
+            closed = client.get("/health").json()
+            ollama_breaker._open()
+            opened = client.get("/health").json()
+        breaker = client.get("/metrics", headers=test_admin["headers"]).json()["ollama"]["circuit_breaker"]
+
+        assert closed["checks"]["ollama"]["status"] == "up"
+        assert closed["checks"]["ollama"]["circuit_breaker"] == CLOSED
+        assert opened["checks"]["ollama"] == {"status": "down", "healthy_hosts": 1, "circuit_breaker": OPEN}
+        assert breaker["state"] == OPEN
+        assert breaker["retry_in_seconds"] > 0
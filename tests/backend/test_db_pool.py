@@ -0,0 +1,52 @@
+import pytest
+import sqlite3
+
+from app.config import DATABASE_PATH
+from app.db import ConnectionPool, get_db_connection
+
+
+class TestConnectionPool:
+    """Тесты пула соединений SQLite"""
+
+    def test_connection_is_configured(self, setup_database):
+        """Соединения пула настроены один раз при создании"""
+        with get_db_connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+            assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+            assert conn.execute("PRAGMA busy_timeout").fetchone()[0] > 0
+
+    def test_connection_is_reused(self, setup_database):
+        """Закрытое соединение возвращается в пул и выдается повторно"""
+        pool = ConnectionPool(DATABASE_PATH, size=2)
+        conn = pool.acquire()
+        raw_conn = conn._conn
+        conn.close()
+
+        with pool.acquire() as conn:
+            assert conn._conn is raw_conn
+        assert pool.stats()["created"] == 1
+        pool.close_all()
+
+    def test_pool_is_bounded(self, setup_database):
+        """Пул не создает больше size соединений"""
+        pool = ConnectionPool(DATABASE_PATH, size=1, timeout=0.1)
+        conn = pool.acquire()
+        with pytest.raises(sqlite3.OperationalError):
+            pool.acquire()
+        conn.close()
+        pool.close_all()
+
+    def test_context_manager_rolls_back_on_error(self, setup_database):
+        """При исключении транзакция откатывается"""
+        with pytest.raises(RuntimeError):
+            with get_db_connection() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+                    ("pool_rollback", "pool_rollback@example.com", "hash")
+                )
+                raise RuntimeError("boom")
+
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT id FROM users WHERE username = ?", ("pool_rollback",)).fetchone()
+        assert row is None
@@ -0,0 +1,94 @@
+import asyncio
+
+from app.db import get_db_connection
+from app.db_writer import DbWriter
+from app.metrics import metrics
+
+
+def insert_user(conn, username):
+    cur = conn.execute(
+        "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+        (username, f"{username}@example.com", "hash")
+    )
+    return cur.lastrowid
+
+
+def user_exists(username):
+    with get_db_connection() as conn:
+        return conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+
+class TestDbWriter:
+    """Тесты единственного писателя с групповым коммитом"""
+
+    def test_concurrent_writes_share_commit(self, setup_database):
+        """Параллельные записи попадают в одну транзакцию, каждый получает свой lastrowid"""
+        writer = DbWriter(window_ms=20, max_batch=100)
+        commits_before = metrics.get("db_writer.commits")
+
+        async def scenario():
+            writer.start()
+            results = await asyncio.gather(*[
+                writer.submit(insert_user, f"writer_batch_{i}") for i in range(20)
+            ])
+            await writer.stop()
+            return results
+
+        row_ids = asyncio.run(scenario())
+
+        assert len(set(row_ids)) == 20
+        assert metrics.get("db_writer.commits") - commits_before == 1
+        assert all(user_exists(f"writer_batch_{i}") for i in range(20))
+
+    def test_failed_operation_does_not_affect_batch(self, setup_database):
+        """Ошибка одной операции откатывает только ее"""
+        writer = DbWriter(window_ms=20)
+
+        def failing_write(conn):
+            insert_user(conn, "writer_failed")
+            raise RuntimeError("boom")
+
+        async def scenario():
+            writer.start()
+            results = await asyncio.gather(
+                writer.submit(insert_user, "writer_ok_1"),
+                writer.submit(failing_write),
+                writer.submit(insert_user, "writer_ok_2"),
+                return_exceptions=True
+            )
+            await writer.stop()
+            return results
+
+        results = asyncio.run(scenario())
+
+        assert isinstance(results[1], RuntimeError)
+        assert user_exists("writer_ok_1")
+        assert user_exists("writer_ok_2")
+        assert not user_exists("writer_failed")
+
+    def test_stop_drains_queue(self, setup_database):
+        """Остановка дописывает уже поставленные операции"""
+        writer = DbWriter(window_ms=50)
+
+        async def scenario():
+            writer.start()
+            pending = asyncio.ensure_future(writer.submit(insert_user, "writer_drained"))
+            await asyncio.sleep(0)
+            await writer.stop()
+            return await pending
+
+        assert asyncio.run(scenario()) is not None
+        assert user_exists("writer_drained")
+
+    def test_app_writes_go_through_writer(self, client):
+        """Записи маршрутов в приложении идут через писателя"""
+        operations_before = metrics.get("db_writer.operations")
+
+        response = client.post("/register", json={
+            "username": "writer_route_user",
+            "email": "writer_route_user@example.com",
+            "password": "testpass123"
+        })
+
+        assert response.status_code == 200
+        assert metrics.get("db_writer.operations") > operations_before
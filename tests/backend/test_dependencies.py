@@ -65,4 +65,28 @@ class TestDependencies:
     def test_missing_token_returns_401(self, client):
         """Отсутствие токена возвращает 401"""
         response = client.get("/me")
-        assert response.status_code == 401
\ No newline at end of file
+        assert response.status_code == 401
+    
+    def test_token_resolved_once_per_request(self, client, test_user):
+        """Токен разрешается один раз за запрос, даже при нескольких зависимостях"""
+        from unittest.mock import patch
+        from app import dependencies
+        
+        with patch.object(dependencies, 'resolve_user_by_token',
+                          wraps=dependencies.resolve_user_by_token) as spy:
+            response = client.post("/logout", headers=test_user["headers"])
+        
+        assert response.status_code == 200
+        assert spy.call_count == 1
+    
+    def test_admin_check_resolves_token_once(self, client, test_admin):
+        """require_admin построен поверх той же зависимости"""
+        from unittest.mock import patch
+        from app import dependencies
+        
+        with patch.object(dependencies, 'resolve_user_by_token',
+                          wraps=dependencies.resolve_user_by_token) as spy:
+            response = client.get("/admin/users", headers=test_admin["headers"])
+        
+        assert response.status_code == 200
+        assert spy.call_count == 1
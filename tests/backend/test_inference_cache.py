@@ -0,0 +1,177 @@
+import asyncio
+import io
+import pytest
+from unittest.mock import patch
+from PIL import Image
+
+from app.db import get_db_connection
+from app.inference_cache import InferenceCache, inference_cache
+from app.perceptual_hash import dhash_from_bytes, hamming, chunk_neighbors
+
+
+def make_png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_photo(flip=False, size=(160, 120), format="PNG", quality=95):
+    """Изображение с деталями: градиент и несколько прямоугольников"""
+    image = Image.new("L", (160, 120))
+    image.putdata([(x * 255 // 160 + y) % 256 for y in range(120) for x in range(160)])
+    image = image.convert("RGB")
+    for i, color in enumerate(["red", "blue", "yellow"]):
+        image.paste(color, (20 + i * 45, 30 + i * 20, 50 + i * 45, 60 + i * 20))
+    if flip:
+        image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    image = image.resize(size)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, quality=quality)
+    return buffer.getvalue()
+
+
+def analyze(client, user, image_data, filename="photo.png", content_type="image/png"):
+    return client.post("/analyze-image", headers=user["headers"],
+                       files={"image": (filename, io.BytesIO(image_data), content_type)})
+
+
+@pytest.fixture
+def empty_cache(client):
+    asyncio.run(inference_cache.clear())
+    yield inference_cache
+    asyncio.run(inference_cache.clear())
+
+
+class TestInferenceCache:
+    """Тесты кэша результатов распознавания"""
+
+    def test_repeat_upload_skips_ollama(self, client, test_user, test_admin, mock_ollama, empty_cache):
+        """Повторная загрузка того же изображения не вызывает Ollama, аллергены считаются заново"""
+        image_data = make_png("red")
+
+        first = analyze(client, test_user, image_data).json()
+        client.post("/medical-data", headers=test_admin["headers"],
+                    json={"allergens": "cheese", "contraindications": None})
+        second = analyze(client, test_admin, image_data).json()
+
+        assert mock_ollama.call_count == 1
+        assert [i["name"] for i in second["ingredients"]] == [i["name"] for i in first["ingredients"]]
+        assert not any(i["is_allergen"] for i in first["ingredients"])
+        assert [i["name"] for i in second["ingredients"] if i["is_allergen"]] == ["cheese"]
+        assert empty_cache.stats()["hit_rate"] == 0.5
+
+        metrics = client.get("/metrics", headers=test_admin["headers"]).json()
+        assert metrics["inference_cache"]["memory_hits"] == 1
+
+    def test_sqlite_tier_survives_memory_loss(self, client, test_user, mock_ollama, empty_cache):
+        """После очистки памяти процесса результат берется из SQLite"""
+        image_data = make_png("green")
+        analyze(client, test_user, image_data)
+        empty_cache._entries.clear()
+
+        response = analyze(client, test_user, image_data)
+
+        assert response.status_code == 200
+        assert mock_ollama.call_count == 1
+        assert empty_cache.stats()["db_hits"] == 1
+
+    def test_fallback_is_not_cached(self, client, test_user, empty_cache):
+        """Ответ fallback не кэшируется: следующая загрузка снова идет в Ollama"""
+        image_data = make_png("blue")
+        with patch('app.funcs.call_ollama_with_retry', side_effect=Exception("ollama down")) as failing:
+            analyze(client, test_user, image_data)
+            analyze(client, test_user, image_data)
+
+        assert failing.call_count == 2
+        assert empty_cache.stats()["hit_rate"] == 0.0
+
+    def test_ttl_and_key_parts(self, client, empty_cache):
+        """Просроченная запись и другая модель или версия промпта дают промах"""
+        cache = InferenceCache(max_size=10, max_entries=10, ttl=60)
+        key = cache.make_key(b"image", "model-a", 1)
+
+        async def scenario():
+            await cache.set(key, {"ingredients": ["salt"], "original_response": "salt"})
+            assert (await cache.get(key))["ingredients"] == ["salt"]
+            assert await cache.get(cache.make_key(b"image", "model-b", 1)) is None
+            assert await cache.get(cache.make_key(b"image", "model-a", 2)) is None
+
+            with patch('app.inference_cache.time.time', return_value=cache._entries[key]["created_at"] + 61):
+                return await cache.get(key)
+
+        assert asyncio.run(scenario()) is None
+
+    def test_size_limits(self, client, empty_cache):
+        """Оба уровня вытесняют давно не использованные записи"""
+        cache = InferenceCache(max_size=1, max_entries=2, ttl=60, trim_every=1)
+        keys = [cache.make_key(f"image{i}".encode(), "model", 1) for i in range(3)]
+
+        async def scenario():
+            for key in keys:
+                await cache.set(key, {"ingredients": [key[0][:8]]})
+
+        asyncio.run(scenario())
+
+        with get_db_connection() as conn:
+            stored = {row[0] for row in conn.execute("SELECT image_sha256 FROM inference_cache")}
+        assert len(cache._entries) == 1
+        assert stored == {keys[1][0], keys[2][0]}
+
+    def test_size_limit_applied_every_n_inserts(self, client, empty_cache):
+        """Лимит SQLite-уровня применяется раз в trim_every вставок"""
+        cache = InferenceCache(max_size=10, max_entries=1, ttl=60, trim_every=3)
+        keys = [cache.make_key(f"batch{i}".encode(), "model", 1) for i in range(3)]
+
+        def stored():
+            with get_db_connection() as conn:
+                return {row[0] for row in conn.execute("SELECT image_sha256 FROM inference_cache")}
+
+        asyncio.run(cache.set(keys[0], {"ingredients": ["a"]}))
+        asyncio.run(cache.set(keys[1], {"ingredients": ["b"]}))
+        assert stored() == {keys[0][0], keys[1][0]}
+
+        asyncio.run(cache.set(keys[2], {"ingredients": ["c"]}))
+        assert stored() == {keys[2][0]}
+
+
+class TestNearDuplicateLookup:
+    """Тесты поиска почти одинаковых изображений по dHash"""
+
+    def test_dhash_tolerates_recompression(self):
+        """Пересжатие и уменьшение меняют лишь несколько бит, другое изображение - много"""
+        original = dhash_from_bytes(make_photo())
+        recompressed = dhash_from_bytes(make_photo(size=(120, 90), format="JPEG", quality=60))
+        other = dhash_from_bytes(make_photo(flip=True))
+
+        assert hamming(original, recompressed) <= 6
+        assert hamming(original, other) > 16
+        assert dhash_from_bytes(make_png("red")) is None
+
+    def test_chunk_neighbors(self):
+        """Соседи части хэша: сама часть, 16 вариантов с одним битом и 120 - с двумя"""
+        neighbors = chunk_neighbors(0b1010, 2)
+        assert len(neighbors) == len(set(neighbors)) == 1 + 16 + 120
+        assert all(hamming(n, 0b1010) <= 2 for n in neighbors)
+
+    def test_recompressed_upload_skips_ollama(self, client, test_user, mock_ollama, empty_cache):
+        """Пересжатая телефоном копия берет ингредиенты из кэша, другое фото идет в Ollama"""
+        first = analyze(client, test_user, make_photo()).json()
+        second = analyze(client, test_user, make_photo(size=(120, 90), format="JPEG", quality=60),
+                         filename="photo.jpg", content_type="image/jpeg").json()
+
+        assert mock_ollama.call_count == 1
+        assert [i["name"] for i in second["ingredients"]] == [i["name"] for i in first["ingredients"]]
+        assert empty_cache.stats()["near_hits"] == 1
+
+        analyze(client, test_user, make_photo(flip=True))
+        assert mock_ollama.call_count == 2
+
+    def test_lookup_can_be_disabled(self, client, test_user, mock_ollama, empty_cache):
+        """Отрицательное расстояние отключает поиск похожих"""
+        with patch.object(empty_cache, "max_distance", -1):
+            analyze(client, test_user, make_photo())
+            analyze(client, test_user, make_photo(format="JPEG", quality=60),
+                    filename="photo.jpg", content_type="image/jpeg")
+
+        assert mock_ollama.call_count == 2
+        assert empty_cache.stats()["near_hits"] == 0
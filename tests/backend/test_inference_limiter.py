@@ -0,0 +1,134 @@
+import asyncio
+import io
+import pytest
+from unittest.mock import patch
+from PIL import Image
+
+from app.inference_limiter import InferenceLimiter, InferenceOverloaded
+
+
+def make_png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestInferenceLimiter:
+    """Тесты ограничения одновременных запросов к Ollama"""
+
+    def test_concurrency_limit_and_fifo(self):
+        """Одновременно выполняется не больше max_concurrency, очередь обслуживается по порядку"""
+        limiter = InferenceLimiter(max_concurrency=2, max_queue=10, expected_service_time=1)
+        running, peak, order = [0], [0], []
+
+        async def job(i):
+            async with limiter.slot():
+                order.append(i)
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                await asyncio.sleep(0.01)
+                running[0] -= 1
+
+        async def scenario():
+            await asyncio.gather(*(job(i) for i in range(6)))
+
+        asyncio.run(scenario())
+
+        assert peak[0] == 2
+        assert order == list(range(6))
+        assert limiter.stats()["in_flight"] == 0
+        assert limiter.stats()["queue_depth"] == 0
+
+    def test_overflow_rejected_with_retry_after(self):
+        """Сверх очереди запрос отклоняется сразу, Retry-After растет с длиной очереди"""
+        limiter = InferenceLimiter(max_concurrency=1, max_queue=2, expected_service_time=10)
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def job():
+                async with limiter.slot():
+                    await release.wait()
+
+            tasks = [asyncio.create_task(job()) for _ in range(3)]
+            await asyncio.sleep(0)
+            with pytest.raises(InferenceOverloaded) as overloaded:
+                await limiter.acquire()
+            stats = limiter.stats()
+            release.set()
+            await asyncio.gather(*tasks)
+            return overloaded.value, stats
+
+        overloaded, stats = asyncio.run(scenario())
+
+        assert stats["in_flight"] == 1 and stats["queue_depth"] == 2
+        assert overloaded.retry_after == 30
+        assert limiter.rejected == 1
+
+    def test_cancelled_waiter_leaves_queue(self):
+        """Отмененный ожидающий освобождает место в очереди и не занимает слот"""
+        limiter = InferenceLimiter(max_concurrency=1, max_queue=1)
+
+        async def scenario():
+            await limiter.acquire()
+            waiter = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            limiter.release()
+            return limiter.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+    def test_service_time_average(self):
+        """Оценка времени обслуживания сглаживает замеры"""
+        limiter = InferenceLimiter(max_concurrency=1, max_queue=1, expected_service_time=10)
+        limiter.in_flight = 1
+        limiter.release(20)
+
+        assert limiter.service_time == pytest.approx(12)
+
+    def test_cancelled_slot_not_counted_in_service_time(self):
+        """Отмененный запрос освобождает слот, но не меняет оценку времени обслуживания"""
+        limiter = InferenceLimiter(max_concurrency=1, max_queue=1, expected_service_time=10)
+
+        async def job():
+            async with limiter.slot():
+                await asyncio.sleep(5)
+
+        async def scenario():
+            task = asyncio.create_task(job())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(scenario())
+
+        assert limiter.service_time == 10
+        assert limiter.stats()["in_flight"] == 0
+
+
+class TestAnalyzeOverload:
+    """Тесты ответа API при перегрузке Ollama"""
+
+    def test_overloaded_returns_429(self, client, test_user):
+        """При заполненной очереди /analyze-image отвечает 429 с Retry-After, а не fallback"""
+        with patch('app.funcs.inference_limiter.acquire', side_effect=InferenceOverloaded(42)):
+            response = client.post("/analyze-image", headers=test_user["headers"],
+                                   files={"image": ("photo.png", io.BytesIO(make_png("purple")), "image/png")})
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "42"
+
+    def test_metrics_expose_queue(self, client, test_user, test_admin, mock_ollama):
+        """Метрики показывают состояние очереди и время ожидания"""
+        client.post("/analyze-image", headers=test_user["headers"],
+                    files={"image": ("photo.png", io.BytesIO(make_png("orange")), "image/png")})
+
+        metrics = client.get("/metrics", headers=test_admin["headers"]).json()
+
+        assert metrics["ollama"]["in_flight"] == 0
+        assert metrics["ollama"]["queue_depth"] == 0
+        assert metrics["timings"]["ollama.queue_wait_seconds"]["count"] >= 1
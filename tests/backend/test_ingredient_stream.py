@@ -0,0 +1,125 @@
+import io
+import json
+import httpx
+from unittest.mock import patch
+from PIL import Image
+
+from app.ingredient_parsing import IngredientStreamParser
+from app.resolution_policy import ResolutionPolicy
+
+
+def make_png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def fake_stream(*pieces, error=None):
+    async def stream(image_base64):
+        for piece in pieces:
+            yield piece
+        if error is not None:
+            raise error
+    return stream
+
+
+def read_events(client, user, image_data):
+    with client.stream("POST", "/analyze-image/stream", headers=user["headers"],
+                       files={"image": ("photo.png", io.BytesIO(image_data), "image/png")}) as response:
+        assert response.status_code == 200
+        lines = [line for line in response.iter_lines() if line]
+    names = [line.split(": ", 1)[1] for line in lines if line.startswith("event: ")]
+    data = [json.loads(line.split(": ", 1)[1]) for line in lines if line.startswith("data: ")]
+    return list(zip(names, data))
+
+
+class TestIngredientStreamParser:
+    """Тесты инкрементального разбора ответа Ollama"""
+
+    def test_char_by_char(self):
+        """Ингредиент выдается, как только закрылась его строка"""
+        text = '```json\n{"ingredients": ["tomato", "cr\\u00e8me \\"fra\\u00eeche\\" sauce", "1. flour"]}\n```'
+        parser = IngredientStreamParser()
+        found = []
+        for char in text:
+            found.extend(parser.feed(char))
+            if char == ',' and len(found) == 1:
+                assert found == ["tomato"]
+
+        assert found == ['tomato', 'crème "fraîche" sauce', 'flour']
+        assert parser.done
+        assert parser.text == text
+
+    def test_ignores_text_before_array_and_after_end(self):
+        """Строки вне массива ingredients не считаются ингредиентами"""
+        parser = IngredientStreamParser()
+        found = parser.feed('{"dish": "pizza", "ingredients": ["salt"')
+        found += parser.feed('], "notes": ["not an ingredient"]}')
+
+        assert found == ["salt"]
+
+    def test_no_json(self):
+        """Ответ без JSON ничего не выдает до полного разбора"""
+        parser = IngredientStreamParser()
+        assert parser.feed("tomato\ncheese\n") == []
+        assert not parser.done
+
+
+class TestAnalyzeImageStream:
+    """Тесты потокового анализа изображения"""
+
+    def test_ingredients_arrive_with_flags(self, client, test_user, test_admin):
+        """Каждый ингредиент приходит отдельным событием с флагами, в конце - полный ответ"""
+        client.post("/medical-data", headers=test_user["headers"],
+                    json={"allergens": "cheese", "contraindications": None})
+        stream = fake_stream('{"ingre', 'dients": ["tom', 'ato", "chee', 'se", "flour"]}')
+
+        with patch('app.funcs.stream_ollama_chat', side_effect=stream):
+            events = read_events(client, test_user, make_png("coral"))
+
+        assert [name for name, _ in events] == ["ingredient"] * 3 + ["done"]
+        assert events[1][1] == {"name": "cheese", "is_allergen": True, "is_contraindication": False}
+        assert events[-1][1]["warnings"] == ["⚠️ Аллерген обнаружен: cheese"]
+
+        timings = client.get("/metrics", headers=test_admin["headers"]).json()["timings"]
+        assert timings["analysis.time_to_first_ingredient_seconds"]["count"] >= 1
+
+    def test_broken_stream_falls_back(self, client, test_user, mock_ollama):
+        """Оборванный поток повторяется обычным запросом, досылаются только новые ингредиенты"""
+        stream = fake_stream('{"ingredients": ["tomato", "sa', error=ConnectionError("reset"))
+
+        with patch('app.funcs.stream_ollama_chat', side_effect=stream):
+            events = read_events(client, test_user, make_png("khaki"))
+
+        assert [data["name"] for name, data in events if name == "ingredient"] == ["tomato", "cheese", "flour"]
+        assert mock_ollama.call_count == 1
+        assert [i["name"] for i in events[-1][1]["ingredients"]] == ["tomato", "cheese", "flour"]
+
+    def test_cached_result_streams_immediately(self, client, test_user):
+        """Повторное изображение отдается из кэша без обращения к Ollama"""
+        image_data = make_png("plum")
+        with patch('app.funcs.stream_ollama_chat', side_effect=fake_stream('{"ingredients": ["rice"]}')) as stream:
+            read_events(client, test_user, image_data)
+            events = read_events(client, test_user, image_data)
+
+        assert stream.call_count == 1
+        assert events == [
+            ("ingredient", {"name": "rice", "is_allergen": False, "is_contraindication": False}),
+            ("done", events[-1][1])
+        ]
+        assert events[-1][1]["original_response"] == '{"ingredients": ["rice"]}'
+
+    def test_stream_updates_resolution_policy(self, client, test_user, mock_ollama):
+        """Успех и таймаут потока учитываются в статистике выбранного уровня разрешения"""
+        policy = ResolutionPolicy()
+        timeout = fake_stream('{"ingredients": ["sa', error=httpx.ReadTimeout("read timeout"))
+
+        with patch('app.ingredient_stream.resolution_policy', policy):
+            with patch('app.funcs.stream_ollama_chat', side_effect=fake_stream('{"ingredients": ["rice"]}')):
+                read_events(client, test_user, make_png("wheat"))
+            with patch('app.funcs.stream_ollama_chat', side_effect=timeout):
+                read_events(client, test_user, make_png("olive"))
+
+        stats = policy.stats()["bucket_0/level_0"]
+        assert stats["attempts"] == 2
+        assert stats["success_rate"] == 0.7
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import sqlite3
+
+from app import repository
+from app.db import get_db_connection
+from app.migrations import run_migrations, MIGRATIONS
+
+
+def save_analysis(user_id, ingredients):
+    return asyncio.run(repository.insert_analysis(
+        user_id, f"user_{user_id}/test.png", {"ingredients": ingredients, "warnings": []},
+        len(ingredients), 0
+    ))
+
+
+class TestNormalizedIngredients:
+    """Тесты нормализованного состава анализов"""
+
+    def test_save_interns_ingredient_names(self, client, test_user):
+        """Одинаковые имена ингредиентов хранятся в словаре один раз"""
+        user_id = test_user["user"]["id"]
+        first = save_analysis(user_id, ["Интерн-молоко", "интерн-сахар"])
+        second = save_analysis(user_id, [{"name": "Интерн-молоко", "is_allergen": True,
+                                          "is_contraindication": False}])
+
+        with get_db_connection() as conn:
+            names = conn.execute(
+                "SELECT COUNT(*) FROM ingredients WHERE name = ?", ("Интерн-молоко",)
+            ).fetchone()[0]
+            rows = conn.execute(
+                "SELECT COUNT(*) FROM analysis_ingredients WHERE analysis_id IN (?, ?)",
+                (first["id"], second["id"])
+            ).fetchone()[0]
+
+        assert names == 1
+        assert rows == 3
+        assert [i["name"] for i in first["analysis_result"]["ingredients"]] == ["Интерн-молоко", "интерн-сахар"]
+        assert second["analysis_result"]["ingredients"][0]["is_allergen"] is True
+
+    def test_medical_data_reanalyzes_in_sql(self, client, test_user):
+        """Смена медицинских данных пересчитывает флаги и warnings_count"""
+        user_id = test_user["user"]["id"]
+        saved = save_analysis(user_id, ["Молоко цельное", "мука", "sugar"])
+
+        response = client.post("/medical-data", headers=test_user["headers"],
+                               json={"allergens": "молоко", "contraindications": "SUGAR"})
+        assert response.status_code == 200
+
+        analysis = asyncio.run(repository.get_saved_analysis(saved["id"], user_id))
+        flags = {i["name"]: (i["is_allergen"], i["is_contraindication"])
+                 for i in analysis["analysis_result"]["ingredients"]}
+
+        assert flags == {
+            "Молоко цельное": (True, False),
+            "мука": (False, False),
+            "sugar": (False, True),
+        }
+        assert analysis["warnings_count"] == 2
+        assert analysis["analysis_result"]["warnings"] == [
+            "Аллерген обнаружен: Молоко цельное", "Противопоказание: sugar"
+        ]
+
+    def test_stored_warnings_returned_unchanged(self, client, test_user):
+        """Предупреждения сохраненного анализа отдаются как были сохранены"""
+        user_id = test_user["user"]["id"]
+        warnings = ["⚠️ Аллерген обнаружен: cheese",
+                    "⚠️ Сервис анализа временно недоступен. Пожалуйста, попробуйте позже."]
+        saved = asyncio.run(repository.insert_analysis(
+            user_id, f"user_{user_id}/test.png",
+            {"ingredients": [{"name": "cheese", "is_allergen": True, "is_contraindication": False}],
+             "warnings": warnings},
+            1, 2
+        ))
+
+        listed = asyncio.run(repository.get_saved_analyses(user_id))
+
+        assert saved["analysis_result"]["warnings"] == warnings
+        assert next(a for a in listed if a["id"] == saved["id"])["analysis_result"]["warnings"] == warnings
+
+    def test_other_stored_keys_returned(self, client, test_user):
+        """Остальные ключи документа и предупреждения не в виде массива отдаются как сохранены"""
+        user_id = test_user["user"]["id"]
+        saved = asyncio.run(repository.insert_analysis(
+            user_id, f"user_{user_id}/test.png",
+            {"ingredients": ["rice"], "warnings": "нет", "source": "cache", "meta": {"model": "x"}},
+            1, 0
+        ))
+        not_object = asyncio.run(repository.insert_analysis(
+            user_id, f"user_{user_id}/test.png", ["rice"], 1, 0
+        ))
+
+        assert saved["analysis_result"] == {
+            "ingredients": [{"name": "rice", "is_allergen": False, "is_contraindication": False}],
+            "warnings": "нет", "source": "cache", "meta": {"model": "x"}
+        }
+        assert not_object["analysis_result"] == {"ingredients": []}
+
+    def test_reanalyze_single_analysis(self, client, test_user):
+        """Перепроверка одного анализа не трогает остальные"""
+        user_id = test_user["user"]["id"]
+        target = save_analysis(user_id, ["peanut"])
+        other = save_analysis(user_id, ["peanut"])
+
+        asyncio.run(repository.save_medical_data(user_id, None, "peanut"))
+        response = client.post(f"/reanalyze-analysis/{target['id']}", headers=test_user["headers"])
+
+        assert response.status_code == 200
+        assert response.json()["warnings_count"] == 1
+        assert asyncio.run(repository.get_saved_analysis(other["id"], user_id))["warnings_count"] == 0
+
+    def test_existing_analyses_are_backfilled(self, tmp_path):
+        """Миграция переносит состав уже сохраненных анализов из JSON"""
+        conn = sqlite3.connect(str(tmp_path / "backfill.db"))
+        conn.isolation_level = None
+        for migration in MIGRATIONS[:3]:
+            migration(conn.cursor())
+        conn.execute("PRAGMA user_version = 3")
+        conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('u', 'u@e', 'h')")
+        conn.execute(
+            "INSERT INTO saved_analyses (user_id, image_path, analysis_result) VALUES (1, 'a.png', ?)",
+            (json.dumps({"ingredients": [{"name": "egg", "is_allergen": True,
+                                          "is_contraindication": False}, "salt"]}),)
+        )
+        conn.execute(
+            "INSERT INTO saved_analyses (user_id, image_path, analysis_result) VALUES (1, 'b.png', 'not json')"
+        )
+        conn.isolation_level = ''
+
+        assert run_migrations(conn) == len(MIGRATIONS) - 3
+
+        rows = conn.execute('''
+            SELECT ai.analysis_id, i.name, ai.is_allergen
+            FROM analysis_ingredients ai JOIN ingredients i ON i.id = ai.ingredient_id
+            ORDER BY ai.analysis_id, ai.position
+        ''').fetchall()
+        conn.close()
+
+        assert rows == [(1, "egg", 1), (1, "salt", 0)]
@@ -0,0 +1,228 @@
+import pytest
+import io
+import base64
+import sqlite3
+import time
+from unittest.mock import patch
+
+from app.config import DATABASE_PATH
+from app.db import close_db_pool
+from app.migrations import run_migrations, get_schema_version, SCHEMA_VERSION, MIGRATIONS
+from app.pagination import encode_cursor
+
+
+PNG_DATA = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==")
+
+
+class TestMigrations:
+    """Тесты миграций схемы"""
+
+    def test_legacy_database_is_migrated(self, tmp_path):
+        """Старая БД без версии получает индексы и epoch-сроки токенов"""
+        db_path = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                email VARCHAR(100) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                role VARCHAR(20) DEFAULT 'user',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE user_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER REFERENCES users(id),
+                token VARCHAR(255) UNIQUE NOT NULL,
+                token_type VARCHAR(10) NOT NULL DEFAULT 'access',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+        conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('u', 'u@e', 'h')")
+        conn.execute(
+            "INSERT INTO user_tokens (user_id, token, expires_at) VALUES (1, 'tok', ?)",
+            ('2030-01-01T12:00:00.123456',)
+        )
+        conn.commit()
+        assert get_schema_version(conn) == 0
+
+        assert run_migrations(conn) == SCHEMA_VERSION
+        assert get_schema_version(conn) == SCHEMA_VERSION
+
+        expires_at = conn.execute("SELECT expires_at FROM user_tokens WHERE token = 'tok'").fetchone()[0]
+        assert isinstance(expires_at, int)
+        assert expires_at > int(time.time())
+
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'idx_tokens_lookup', 'idx_tokens_expires', 'idx_tokens_user',
+                'idx_analyses_user_created'} <= indexes
+
+        # Повторный запуск ничего не делает
+        assert run_migrations(conn) == 0
+        conn.close()
+
+    def test_revoked_tokens_table_is_own_migration(self, tmp_path):
+        """Таблица списка отзыва создается отдельной миграцией поверх уже развернутой схемы"""
+        conn = sqlite3.connect(str(tmp_path / "v9.db"))
+        cur = conn.cursor()
+        for migration in MIGRATIONS[:9]:
+            migration(cur)
+        conn.execute('PRAGMA user_version = 9')
+        conn.commit()
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert 'revoked_access_tokens' not in tables
+
+        assert run_migrations(conn) == SCHEMA_VERSION - 9
+
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert 'idx_revoked_tokens_revoked_before' in indexes
+        conn.close()
+
+
+@pytest.fixture
+def captured_queries():
+    """Собирает все SQL-запросы, выполненные приложением"""
+    queries = []
+    real_connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = real_connect(*args, **kwargs)
+        conn.set_trace_callback(queries.append)
+        return conn
+
+    # Соединения пула должны быть созданы заново через traced_connect
+    close_db_pool()
+    with patch('sqlite3.connect', side_effect=traced_connect):
+        yield queries
+    close_db_pool()
+
+
+def _full_scans(sql):
+    """Возвращает шаги плана, читающие таблицу целиком без индекса"""
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    finally:
+        conn.close()
+    return [
+        row[3] for row in plan
+        if row[3].startswith('SCAN ') and 'USING' not in row[3]
+        and row[3] != 'SCAN CONSTANT ROW'
+        # Поиск FTS5 идет по собственному индексу виртуальной таблицы
+        and 'VIRTUAL TABLE INDEX' not in row[3]
+        # Материализованный результат подзапроса, а не таблица
+        and not row[3].startswith('SCAN (subquery')
+    ]
+
+
+class TestQueryPlans:
+    """Все запросы маршрутов используют индексы"""
+
+    def _exercise_routes(self, client, test_user, test_admin):
+        headers = test_user["headers"]
+        admin_headers = test_admin["headers"]
+        user_id = test_user["user"]["id"]
+
+        client.get("/me", headers=headers)
+        client.post("/update-profile", headers=headers,
+                    json={"username": f"{test_user['user']['username']}_plan"})
+        client.post("/change-password", headers=headers, json={
+            "old_password": "testpass123", "new_password": "testpass123",
+            "confirm_password": "testpass123"
+        })
+        client.get("/medical-data", headers=headers)
+
+        with patch('app.routes.analyse.save_image_to_minio', return_value=f"user_{user_id}/plan.png"), \
+             patch('app.minio.minio_client.get_object', side_effect=Exception("no minio")), \
+             patch('app.minio.minio_client.presigned_get_object', return_value="http://minio/plan.png"), \
+             patch('app.minio.minio_client.remove_object'):
+            save_response = client.post(
+                "/save-analysis", headers=headers,
+                files={"image": ("plan.png", io.BytesIO(PNG_DATA), "image/png")},
+                data={
+                    "analysis_result": '{"ingredients": [{"name": "milk", "is_allergen": false, "is_contraindication": false}], "warnings": []}',
+                    "ingredients_count": "1",
+                    "warnings_count": "0"
+                }
+            )
+            analysis_id = save_response.json()["id"]
+
+            client.post("/medical-data", headers=headers,
+                        json={"contraindications": "sugar", "allergens": "milk"})
+            client.get("/saved-analyses", headers=headers)
+            client.get("/filter/saved-analyses", headers=headers)
+            client.get("/filter/saved-analyses?show_safe=true&show_warnings=false&sort_order=asc",
+                       headers=headers)
+            client.get("/filter/saved-analyses?show_safe=false&show_warnings=true", headers=headers)
+            cursor = encode_cursor("2100-01-01 00:00:00", analysis_id)
+            client.get(f"/saved-analyses?limit=1&cursor={cursor}", headers=headers)
+            client.get(f"/filter/saved-analyses?show_safe=true&show_warnings=false&limit=1&cursor={cursor}",
+                       headers=headers)
+            client.post(f"/reanalyze-analysis/{analysis_id}", headers=headers)
+            client.get("/saved-analyses/search?q=mil", headers=headers)
+            client.get(f"/image/{analysis_id}", headers=headers)
+            client.delete(f"/saved-analyses/{analysis_id}", headers=headers)
+
+            client.get("/admin/users", headers=admin_headers)
+            client.get("/admin/filter/users?search=user", headers=admin_headers)
+            client.get("/admin/filter/users?roles=user&roles=admin&sort_by=created_at&sort_order=desc",
+                       headers=admin_headers)
+            client.get("/admin/filter/users?search=us", headers=admin_headers)
+            client.get(f"/admin/filter/users?roles=user&roles=banned&limit=1&cursor={encode_cursor('m', user_id)}",
+                       headers=admin_headers)
+            client.get(f"/admin/users?limit=1&cursor={encode_cursor('2100-01-01 00:00:00', user_id)}",
+                       headers=admin_headers)
+            client.get("/admin/users/count?search=user&roles=user", headers=admin_headers)
+            client.get("/admin/users/count?search=us", headers=admin_headers)
+            client.post("/admin/update-user-role", headers=admin_headers,
+                        json={"user_id": user_id, "new_role": "user"})
+
+            client.post("/refresh-token",
+                        headers={"Authorization": f"Bearer {test_user['refresh_token']}"})
+            client.post("/cleanup-tokens")
+            client.post("/logout", headers=admin_headers)
+            client.delete("/delete-account", headers=headers)
+
+    def test_route_queries_use_indexes(self, client, test_user, test_admin, captured_queries):
+        """EXPLAIN QUERY PLAN не содержит полных сканирований таблиц"""
+        self._exercise_routes(client, test_user, test_admin)
+
+        statements = [
+            sql for sql in captured_queries
+            if sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE')
+            and 'sqlite_master' not in sql
+            # Служебные запросы FTS5 к своим теневым таблицам
+            and "'main'." not in sql
+        ]
+        assert len(statements) > 20
+
+        offenders = {}
+        for sql in statements:
+            scans = _full_scans(sql)
+            if scans:
+                offenders[' '.join(sql.split())] = scans
+
+        assert not offenders, f"Запросы без индекса: {offenders}"
+
+    def test_list_pages_need_no_sort(self, client, test_admin, test_user, captured_queries):
+        """Страницы списков анализов и пользователей читаются в порядке индекса, без сортировки"""
+        self._exercise_routes(client, test_user, test_admin)
+
+        pages = [
+            sql for sql in captured_queries
+            if (', id DESC' in sql or ', id ASC' in sql)
+            # Совпадения поиска подстроки сортируются, их число ограничено самим поиском
+            and '_fts' not in sql
+        ]
+        assert len(pages) >= 6
+
+        conn = sqlite3.connect(DATABASE_PATH)
+        try:
+            for sql in pages:
+                plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+                assert not any('TEMP B-TREE' in step for step in plan), (sql, plan)
+        finally:
+            conn.close()
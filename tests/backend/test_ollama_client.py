@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.metrics import metrics
+from app.ollama_client import OllamaClient, ollama_client, NANOSECONDS
+
+
+def fake_client(**responses):
+    client = MagicMock()
+    client.chat = AsyncMock(return_value=responses.get("chat"))
+    client.generate = AsyncMock(return_value=responses.get("generate", {"load_duration": 0}))
+    client._client.aclose = AsyncMock()
+    return client
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Эмуляция /api/chat и /api/tags Ollama с задержкой и режимом отказа"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.chats += 1
+        time.sleep(self.server.delay)
+        if self.server.failing:
+            return self.reply(500, {"error": "model crashed"})
+        self.reply(200, {
+            "model": body["model"],
+            "created_at": "2026-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": json.dumps({"ingredients": [self.server.name]})},
+            "done": True,
+            "total_duration": int(self.server.delay * 1e9)
+        })
+
+    def do_GET(self):
+        if self.server.failing:
+            return self.reply(500, {"error": "model crashed"})
+        self.reply(200, {"models": []})
+
+    def reply(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_servers():
+    """Фабрика локальных серверов, отвечающих как Ollama"""
+    servers = []
+
+    def start(name, delay=0.0, failing=False):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+        server.name, server.delay, server.failing, server.chats = name, delay, failing, 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class TestOllamaClient:
+    """Тесты долгоживущего клиента Ollama"""
+
+    def test_chat_reuses_client_and_keeps_model_alive(self):
+        """Все запросы идут через один клиент с keep_alive модели"""
+        client = OllamaClient(model="vision-model", keep_alive="15m", warmup=False, ping_interval=0)
+        stub = fake_client(chat={"message": {"content": "{}"}})
+
+        async def scenario():
+            client.start()
+            await client.chat(messages=[])
+            await client.chat(messages=[])
+            await client.stop()
+
+        with patch.object(client, "_create_client", return_value=stub) as create:
+            asyncio.run(scenario())
+
+        assert create.call_count == 1
+        assert stub.chat.await_args.kwargs["model"] == "vision-model"
+        assert stub.chat.await_args.kwargs["keep_alive"] == "15m"
+        stub._client.aclose.assert_awaited_once()
+
+    def test_load_time_reported_separately(self):
+        """Время загрузки модели и время распознавания попадают в разные метрики"""
+        client = OllamaClient(warmup=False, ping_interval=0)
+        response = {
+            "message": {"content": "{}"},
+            "load_duration": 4 * NANOSECONDS,
+            "total_duration": 7 * NANOSECONDS
+        }
+        with patch.object(client, "_create_client", return_value=fake_client(chat=response)):
+            asyncio.run(client.chat(messages=[]))
+
+        timings = metrics.snapshot()["timings"]
+        assert timings["ollama.model_load_seconds"]["last"] == 4
+        assert timings["ollama.inference_seconds"]["last"] == 3
+        assert client.last_load_seconds == 4
+
+    def test_warmup_and_periodic_pings(self):
+        """При старте модель загружается, затем keep_alive продлевается по расписанию"""
+        client = OllamaClient(warmup=True, ping_interval=0.01)
+        stub = fake_client(generate={"load_duration": 2 * NANOSECONDS, "total_duration": 2 * NANOSECONDS})
+
+        async def scenario():
+            client.start()
+            await asyncio.sleep(0.05)
+            await client.stop()
+
+        with patch.object(client, "_create_client", return_value=stub):
+            asyncio.run(scenario())
+
+        assert client.pings >= 2
+        assert client.model_loaded
+        assert stub.generate.await_args.kwargs["prompt"] == ""
+
+    def test_failed_warmup_does_not_break_startup(self):
+        """Недоступная Ollama при старте только учитывается в статистике"""
+        client = OllamaClient(warmup=True, ping_interval=0)
+        stub = fake_client()
+        stub.generate.side_effect = ConnectionError("refused")
+
+        async def scenario():
+            client.start()
+            await asyncio.sleep(0.01)
+            await client.stop()
+
+        with patch.object(client, "_create_client", return_value=stub):
+            asyncio.run(scenario())
+
+        assert client.ping_errors == 1
+        assert not client.model_loaded
+
+    def test_stream_records_durations_from_last_chunk(self):
+        """Потоковый ответ учитывает длительности из завершающего куска"""
+        client = OllamaClient(warmup=False, ping_interval=0)
+
+        async def chunks():
+            yield {"message": {"content": "{\"ingredients\": "}, "done": False}
+            yield {"message": {"content": "[]}"}, "done": True,
+                   "load_duration": 0, "total_duration": 5 * NANOSECONDS}
+
+        stub = fake_client(chat=chunks())
+
+        async def scenario():
+            return [chunk["message"]["content"] async for chunk in client.chat_stream(messages=[])]
+
+        with patch.object(client, "_create_client", return_value=stub):
+            pieces = asyncio.run(scenario())
+
+        assert "".join(pieces) == "{\"ingredients\": []}"
+        assert metrics.snapshot()["timings"]["ollama.inference_seconds"]["last"] == 5
+
+    def test_metrics_expose_model_state(self, client, test_admin):
+        """Состояние модели видно в /metrics"""
+        data = client.get("/metrics", headers=test_admin["headers"]).json()
+
+        assert data["ollama"]["model"] == ollama_client.model
+        assert "last_load_seconds" in data["ollama"]
+
+
+class TestOllamaDispatcher:
+    """Тесты распределения запросов между несколькими серверами Ollama"""
+
+    def test_least_outstanding_prefers_free_host(self, stub_servers):
+        """Пока медленный сервер занят, запросы уходят на свободный"""
+        slow, fast = stub_servers("slow", delay=0.5), stub_servers("fast", delay=0.0)
+        client = OllamaClient(hosts=[url(slow), url(fast)], warmup=False, ping_interval=0)
+
+        async def scenario():
+            async def one(i):
+                await asyncio.sleep(i * 0.06)
+                response = await client.chat(messages=[])
+                return json.loads(response["message"]["content"])["ingredients"][0]
+
+            answers = await asyncio.gather(*(one(i) for i in range(6)))
+            stats = client.stats()
+            await client.stop()
+            return answers, stats
+
+        answers, stats = asyncio.run(scenario())
+
+        assert answers.count("slow") == 1
+        assert answers.count("fast") == 5
+        hosts = {host["url"]: host for host in stats["hosts"]}
+        assert hosts[url(slow)]["avg_latency_seconds"] > hosts[url(fast)]["avg_latency_seconds"]
+        assert all(host["outstanding"] == 0 for host in stats["hosts"])
+
+    def test_failing_host_ejected_and_readmitted(self, stub_servers):
+        """Сервер с ошибками подряд исключается, а после успешной проверки возвращается"""
+        broken, healthy = stub_servers("broken", failing=True), stub_servers("healthy")
+        client = OllamaClient(hosts=[url(broken), url(healthy)], warmup=False, ping_interval=0,
+                              eject_failures=2, probe_interval=0.05)
+
+        async def scenario():
+            client.start()
+            results = []
+            for _ in range(6):
+                try:
+                    response = await client.chat(messages=[])
+                    results.append(json.loads(response["message"]["content"])["ingredients"][0])
+                except Exception:
+                    results.append("error")
+            ejected = client.stats()["healthy_hosts"]
+
+            broken.failing = False
+            await asyncio.sleep(0.2)
+            readmitted = client.stats()["healthy_hosts"]
+            await client.stop()
+            return results, ejected, readmitted
+
+        results, ejected, readmitted = asyncio.run(scenario())
+
+        assert results.count("error") == 2
+        assert results[-2:] == ["healthy", "healthy"]
+        assert broken.chats == 2
+        assert ejected == 1
+        assert readmitted == 2
+
+    def test_all_hosts_ejected_still_tries(self, stub_servers):
+        """Если исключены все серверы, запрос все равно уходит на один из них"""
+        broken = stub_servers("broken", failing=True)
+        client = OllamaClient(hosts=[url(broken)], warmup=False, ping_interval=0, eject_failures=1)
+
+        async def scenario():
+            for _ in range(2):
+                with pytest.raises(Exception):
+                    await client.chat(messages=[])
+            await client.stop()
+
+        asyncio.run(scenario())
+
+        assert broken.chats == 2
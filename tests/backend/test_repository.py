@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+
+from app import repository
+
+
+class TestRepository:
+    """Тесты асинхронного слоя доступа к данным"""
+
+    def test_queries_run_in_db_executor(self, setup_database):
+        """Запросы выполняются в потоках пула БД, а не в потоке event loop"""
+        def query(conn):
+            conn.execute("SELECT 1").fetchone()
+            return threading.current_thread().name
+
+        thread_name = asyncio.run(repository.run_db(query))
+
+        assert thread_name.startswith("db")
+        assert thread_name != threading.current_thread().name
+
+    def test_slow_query_does_not_block_event_loop(self, setup_database):
+        """Пока идет медленный запрос, event loop обрабатывает другие задачи"""
+        def slow_query(conn):
+            time.sleep(0.3)
+            return conn.execute("SELECT 1").fetchone()[0]
+
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker_task = asyncio.create_task(ticker())
+            result = await repository.run_db(slow_query)
+            ticker_task.cancel()
+            return result, ticks
+
+        result, ticks = asyncio.run(scenario())
+
+        assert result == 1
+        assert ticks >= 10
+
+    def test_insert_and_get_saved_analyses(self, client, test_user):
+        """Сохраненный анализ читается обратно с разобранным analysis_result"""
+        user_id = test_user["user"]["id"]
+        analysis_result = {"ingredients": [{"name": "milk", "is_allergen": True,
+                                            "is_contraindication": False}],
+                           "warnings": ["Аллерген обнаружен: milk"]}
+
+        async def scenario():
+            saved = await repository.insert_analysis(user_id, "user/1.jpg", analysis_result, 1, 1)
+            safe = await repository.get_saved_analyses(user_id, 'safe')
+            with_warnings = await repository.get_saved_analyses(user_id, 'warnings')
+            return saved, safe, with_warnings
+
+        saved, safe, with_warnings = asyncio.run(scenario())
+
+        assert saved["analysis_result"] == analysis_result
+        assert safe == []
+        assert [analysis["id"] for analysis in with_warnings] == [saved["id"]]
+
+    def test_failed_query_is_rolled_back(self, setup_database):
+        """Исключение внутри запроса откатывает транзакцию"""
+        def failing_query(conn):
+            conn.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+                ("repo_rollback", "repo_rollback@example.com", "hash")
+            )
+            raise RuntimeError("boom")
+
+        async def scenario():
+            try:
+                await repository.run_db(failing_query)
+            except RuntimeError:
+                pass
+            return await repository.run_db(lambda conn: conn.execute(
+                "SELECT id FROM users WHERE username = ?", ("repo_rollback",)
+            ).fetchone())
+
+        assert asyncio.run(scenario()) is None
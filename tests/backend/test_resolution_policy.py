@@ -0,0 +1,118 @@
+import asyncio
+import base64
+import io
+import threading
+from unittest.mock import patch
+from PIL import Image
+
+from app.funcs import call_ollama_with_retry, compress_image
+from app.resolution_policy import ResolutionPolicy, image_long_side
+
+
+def make_jpeg(size):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "green").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class FixedRandom:
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class TestResolutionPolicy:
+    """Тесты выбора стартового разрешения"""
+
+    def test_starts_with_original_until_it_proves_too_slow(self):
+        """Без статистики - исходный размер; после таймаутов корзина начинает с меньшего"""
+        policy = ResolutionPolicy(min_samples=2, success_target=0.8, latency_target=60, explore_rate=0)
+
+        assert policy.choose(3000) == 0
+        policy.record(3000, 0, False, 450)
+        assert policy.choose(3000) == 0
+        policy.record(3000, 0, False, 450)
+
+        assert policy.choose(3000) == 1
+        # Другая корзина размеров ничего не знает о чужих таймаутах
+        assert policy.choose(1500) == 0
+
+    def test_slow_success_also_steps_down(self):
+        """Уровень, который отвечает дольше целевого времени, тоже пропускается"""
+        policy = ResolutionPolicy(min_samples=1, latency_target=60, explore_rate=0)
+        policy.record(3000, 0, False, 450)
+        policy.record(3000, 1, True, 200)
+
+        assert policy.choose(3000) == 2
+
+    def test_good_level_is_kept(self):
+        """Быстрый и надежный уровень выбирается, даже если меньший тоже хорош"""
+        policy = ResolutionPolicy(min_samples=1, latency_target=60, explore_rate=0)
+        policy.record(3000, 0, True, 20)
+        policy.record(3000, 1, True, 5)
+
+        assert policy.choose(3000) == 0
+
+    def test_small_images_are_not_downscaled(self):
+        """Изображение меньше уровня не уменьшается: остаются только осмысленные уровни"""
+        policy = ResolutionPolicy(min_samples=1, explore_rate=0)
+
+        assert policy.levels_for(800) == [0, 2]
+        assert policy.levels_for(400) == [0]
+        policy.record(400, 0, False, 450)
+        assert policy.choose(400) == 0
+
+    def test_exploration_tries_one_level_larger(self):
+        """Иногда пробуется уровень крупнее выбранного"""
+        policy = ResolutionPolicy(min_samples=1, explore_rate=0.1, rng=FixedRandom(0.05))
+        policy.record(3000, 0, False, 450)
+
+        assert policy.choose(3000) == 0
+
+    def test_image_long_side(self):
+        assert image_long_side(make_jpeg((1200, 300))) == 1200
+        assert image_long_side(b"not an image") == 0
+
+
+class TestAdaptiveRetry:
+    """Тесты выбора разрешения в call_ollama_with_retry"""
+
+    def test_learns_to_skip_full_resolution(self):
+        """После таймаутов на исходном размере первая попытка сразу идет с уменьшенным"""
+        image_data = make_jpeg((3000, 2000))
+        image_base64 = base64.b64encode(image_data).decode("utf-8")
+        sent_sizes = []
+
+        async def fake_chat(messages, **kwargs):
+            sent = base64.b64decode(messages[0]["images"][0])
+            size = image_long_side(sent)
+            sent_sizes.append(size)
+            if size > 1000:
+                raise asyncio.TimeoutError()
+            return {"message": {"content": '{"ingredients": ["salt"]}'}}
+
+        policy = ResolutionPolicy(min_samples=2, explore_rate=0)
+        with patch('app.funcs.resolution_policy', policy), \
+                patch('app.funcs.RETRY_PAUSE_SECONDS', 0), \
+                patch('app.funcs.ollama_client.chat', side_effect=fake_chat):
+            for _ in range(3):
+                asyncio.run(call_ollama_with_retry(image_base64, image_data))
+
+        assert sent_sizes == [3000, 1000, 3000, 1000, 1000]
+        assert policy.stats()["bucket_2/level_0"]["success_rate"] == 0.0
+        assert policy.stats()["bucket_2/level_1"]["attempts"] == 3
+
+    def test_compression_runs_off_event_loop(self):
+        """Сжатие перед попыткой выполняется в пуле потоков, а не в event loop"""
+        threads = []
+
+        def record_thread(image_data, max_size, quality):
+            threads.append(threading.current_thread())
+            return image_data
+
+        with patch('app.funcs.compress_image_sync', side_effect=record_thread):
+            asyncio.run(compress_image(make_jpeg((1600, 1200)), max_size=1000, quality=85))
+
+        assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from app import repository
+from app.search import build_match_query
+
+
+def save_analysis(user_id, ingredients):
+    return asyncio.run(repository.insert_analysis(
+        user_id, f"user_{user_id}/search.png", {"ingredients": ingredients, "warnings": []},
+        len(ingredients), 0
+    ))
+
+
+def search(client, user, q, **params):
+    return client.get("/saved-analyses/search", headers=user["headers"], params={"q": q, **params})
+
+
+@pytest.fixture(autouse=True)
+def no_minio():
+    """MinIO в тестах недоступен: не ждем таймаутов при выдаче ссылок и удалении"""
+    with patch('app.routes.analyse.get_image_url', return_value="http://minio/search.png"), \
+         patch('app.minio.delete_image_from_minio'):
+        yield
+
+
+class TestSearchSavedAnalyses:
+    """Тесты полнотекстового поиска по сохраненным анализам"""
+
+    def test_build_match_query(self):
+        """Слова запроса экранируются и ищутся как префиксы"""
+        assert build_match_query('арахис "OR" pea') == '"арахис"* AND "OR"* AND "pea"*'
+        assert build_match_query(' ,.- ') is None
+
+    def test_prefix_search_finds_own_analyses(self, client, test_user, test_admin):
+        """Префиксный поиск находит только анализы текущего пользователя"""
+        own = save_analysis(test_user["user"]["id"], ["Peanut butter", "salt"])
+        save_analysis(test_user["user"]["id"], ["flour"])
+        save_analysis(test_admin["user"]["id"], ["Peanut oil"])
+
+        response = search(client, test_user, "pean")
+
+        assert response.status_code == 200
+        assert [a["id"] for a in response.json()["analyses"]] == [own["id"]]
+
+    def test_results_are_ranked_and_paginated(self, client, test_user):
+        """Более релевантные анализы идут первыми, страницы не пересекаются"""
+        user_id = test_user["user"]["id"]
+        weak = save_analysis(user_id, ["cashew", "sugar", "flour", "water", "yeast", "salt"])
+        strong = save_analysis(user_id, ["cashew", "cashew milk"])
+
+        first = search(client, test_user, "cashew", limit=1).json()
+        second = search(client, test_user, "cashew", limit=1, offset=first["next_offset"]).json()
+
+        assert first["order"] == "relevance"
+        assert [a["id"] for a in first["analyses"]] == [strong["id"]]
+        assert [a["id"] for a in second["analyses"]] == [weak["id"]]
+        assert second["next_offset"] is None
+
+    def test_many_matches_fall_back_to_recent_order(self, client, test_user):
+        """При большом числе совпадений выдача идет от новых к старым"""
+        user_id = test_user["user"]["id"]
+        older = save_analysis(user_id, ["hazelnut", "hazelnut spread"])
+        newer = save_analysis(user_id, ["hazelnut", "sugar", "cocoa", "palm oil"])
+
+        with patch('app.repository.SEARCH_RANKED_MAX_MATCHES', 1):
+            data = search(client, test_user, "hazel").json()
+
+        assert data["order"] == "recent"
+        assert [a["id"] for a in data["analyses"]] == [newer["id"], older["id"]]
+
+    def test_index_follows_reanalysis_and_delete(self, client, test_user):
+        """Предупреждения после пересмотра ищутся, удаленный анализ пропадает из индекса"""
+        saved = save_analysis(test_user["user"]["id"], ["Арахис жареный"])
+
+        client.post("/medical-data", headers=test_user["headers"],
+                    json={"allergens": "арахис", "contraindications": None})
+        found = search(client, test_user, "аллерген арах").json()["analyses"]
+        assert saved["id"] in [a["id"] for a in found]
+
+        client.delete(f"/saved-analyses/{saved['id']}", headers=test_user["headers"])
+        found = search(client, test_user, "арахис").json()["analyses"]
+        assert saved["id"] not in [a["id"] for a in found]
+
+    def test_empty_query_returns_400(self, client, test_user):
+        """Запрос без слов отклоняется"""
+        response = search(client, test_user, "!!!")
+        assert response.status_code == 400
@@ -0,0 +1,127 @@
+import pytest
+from unittest.mock import patch
+
+from app.signed_tokens import create_access_token, verify_access_token, RevocationSet, ensure_signing_key
+from app.db import get_db_connection
+from app import repository
+
+
+@pytest.fixture
+def signed_mode():
+    """Включает режим подписанных access токенов"""
+    with patch('app.funcs.SIGNED_ACCESS_TOKENS', True):
+        yield
+
+
+class TestSignedTokens:
+    """Тесты подписанных access токенов"""
+
+    def test_verify_roundtrip(self):
+        """Подписанный токен проверяется без БД"""
+        token, _ = create_access_token(42, 'user')
+        assert verify_access_token(token) == {'id': 42, 'role': 'user'}
+
+    def test_tampered_token_rejected(self):
+        """Токен с измененной подписью или содержимым отклоняется"""
+        token, _ = create_access_token(42, 'user')
+        payload, signature = token.split('.')
+        assert verify_access_token(f"{payload}.{signature[:-2]}xx") is None
+        assert verify_access_token(f"{payload[:-2]}xx.{signature}") is None
+        assert verify_access_token("garbage.token") is None
+
+    def test_revocation_set(self):
+        """Отзыв отсекает токены, выпущенные до него"""
+        revocations = RevocationSet()
+        revocations._revoked_before[1] = 100.0
+        assert revocations.is_revoked(1, 99.0)
+        assert not revocations.is_revoked(1, 101.0)
+        assert not revocations.is_revoked(2, 99.0)
+
+    def test_signed_mode_requires_secret(self):
+        """Без TOKEN_SECRET_KEY режим подписанных токенов не запускается"""
+        with patch('app.signed_tokens.SIGNED_ACCESS_TOKENS', True), \
+             patch('app.signed_tokens.TOKEN_SECRET_KEY', ''):
+            with pytest.raises(RuntimeError):
+                ensure_signing_key()
+        with patch('app.signed_tokens.SIGNED_ACCESS_TOKENS', True), \
+             patch('app.signed_tokens.TOKEN_SECRET_KEY', 'secret'):
+            ensure_signing_key()
+
+    def test_revocation_applied_after_commit(self, client, test_user, signed_mode):
+        """Отзыв попадает в память процесса только после коммита транзакции"""
+        from app.funcs import revocation_set
+        user_id = test_user["user"]["id"]
+        seen_in_transaction = []
+
+        def check_memory(conn):
+            seen_in_transaction.append(revocation_set.is_revoked(user_id, 0))
+
+        original_run_write = repository.run_write
+
+        async def run_write(query):
+            def with_check(conn):
+                result = query(conn)
+                check_memory(conn)
+                return result
+            return await original_run_write(with_check)
+
+        with patch('app.repository.run_write', side_effect=run_write):
+            client.post("/logout", headers=test_user["headers"])
+
+        assert seen_in_transaction == [False]
+        assert revocation_set.is_revoked(user_id, 0)
+
+    def test_login_issues_signed_token(self, client, test_user, signed_mode):
+        """В режиме подписанных токенов /login выдает токен вида payload.signature"""
+        response = client.post("/login", json={
+            "username": test_user["user"]["username"],
+            "password": "testpass123"
+        })
+        assert response.status_code == 200
+        access_token = response.json()["access_token"]
+        assert '.' in access_token
+
+        headers = {"Authorization": f"Bearer {access_token}"}
+        response = client.get("/me", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["username"] == test_user["user"]["username"]
+
+    def test_logout_revokes_signed_token(self, client, test_user, signed_mode):
+        """После выхода подписанный токен недействителен"""
+        response = client.post("/login", json={
+            "username": test_user["user"]["username"],
+            "password": "testpass123"
+        })
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        assert client.post("/logout", headers=headers).status_code == 200
+        assert client.get("/me", headers=headers).status_code == 401
+
+    def test_refresh_keeps_working(self, client, test_user, signed_mode):
+        """Refresh токены по-прежнему хранятся в БД"""
+        response = client.post("/login", json={
+            "username": test_user["user"]["username"],
+            "password": "testpass123"
+        })
+        refresh_token = response.json()["refresh_token"]
+
+        response = client.post("/refresh-token",
+                              headers={"Authorization": f"Bearer {refresh_token}"})
+        assert response.status_code == 200
+        assert '.' in response.json()["access_token"]
+
+    def test_me_for_deleted_user(self, client, test_user, signed_mode):
+        """Токен удаленного пользователя дает 401, а не ошибку сервера"""
+        response = client.post("/login", json={
+            "username": test_user["user"]["username"],
+            "password": "testpass123"
+        })
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        conn = get_db_connection()
+        conn.execute('DELETE FROM user_tokens WHERE user_id = ?', (test_user["user"]["id"],))
+        conn.execute('DELETE FROM users WHERE id = ?', (test_user["user"]["id"],))
+        conn.commit()
+        conn.close()
+
+        assert client.get("/me", headers=headers).status_code == 401
@@ -0,0 +1,137 @@
+import pytest
+import time
+from unittest.mock import patch
+
+from app.token_cache import TokenCache, token_cache
+from app.db import get_db_connection
+
+
+class TestTokenCache:
+    """Тесты кэша токенов"""
+
+    def test_get_after_set(self):
+        """Закэшированный пользователь возвращается по токену"""
+        cache = TokenCache(max_size=10)
+        user = {"id": 1, "username": "user1"}
+        cache.set("token1", "access", user, time.time() + 60)
+
+        assert cache.get("token1", "access") == user
+        assert cache.get("token1", "refresh") is None
+
+    def test_expired_entry_is_dropped(self):
+        """Просроченная запись не возвращается"""
+        cache = TokenCache(max_size=10)
+        cache.set("token1", "access", {"id": 1}, time.time() - 1)
+
+        assert cache.get("token1", "access") is None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        """При переполнении вытесняется самая старая запись"""
+        cache = TokenCache(max_size=2)
+        expires_at = time.time() + 60
+        cache.set("a", "access", {"id": 1}, expires_at)
+        cache.set("b", "access", {"id": 2}, expires_at)
+        cache.get("a", "access")
+        cache.set("c", "access", {"id": 3}, expires_at)
+
+        assert cache.get("a", "access") is not None
+        assert cache.get("b", "access") is None
+        assert cache.get("c", "access") is not None
+
+    def test_invalidate_user(self):
+        """Инвалидация удаляет все токены пользователя"""
+        cache = TokenCache(max_size=10)
+        expires_at = time.time() + 60
+        cache.set("a", "access", {"id": 1}, expires_at)
+        cache.set("b", "refresh", {"id": 1}, expires_at)
+        cache.set("c", "access", {"id": 2}, expires_at)
+
+        cache.invalidate_user(1)
+
+        assert cache.get("a", "access") is None
+        assert cache.get("b", "refresh") is None
+        assert cache.get("c", "access") is not None
+
+    def test_stale_lookup_not_cached_after_invalidation(self):
+        """Данные, прочитанные до invalidate_user, не попадают в кэш; других пользователей это не касается"""
+        cache = TokenCache(max_size=10)
+        expires_at = time.time() + 60
+        generation = cache.generation()
+
+        cache.invalidate_user(1)
+        cache.set("a", "access", {"id": 1}, expires_at, generation)
+        cache.set("b", "access", {"id": 2}, expires_at, generation)
+        cache.set("c", "access", {"id": 1}, expires_at, cache.generation())
+
+        assert cache.get("a", "access") is None
+        assert cache.get("b", "access") is not None
+        assert cache.get("c", "access") is not None
+
+
+class TestTokenCacheInvalidation:
+    """Изменения пользователя сразу видны через кэш"""
+
+    def test_role_change_applies_immediately(self, client, test_admin, test_user):
+        """Бан пользователя действует на уже закэшированный токен"""
+        assert client.get("/medical-data", headers=test_user["headers"]).status_code == 200
+
+        response = client.post("/admin/update-user-role",
+                              headers=test_admin["headers"],
+                              json={"user_id": test_user["user"]["id"], "new_role": "banned"})
+        assert response.status_code == 200
+
+        response = client.get("/medical-data", headers=test_user["headers"])
+        assert response.status_code == 403
+
+    def test_cache_invalidated_after_commit(self, client, test_admin, test_user):
+        """Кэш сбрасывается, когда новая роль уже видна другим соединениям"""
+        user_id = test_user["user"]["id"]
+        seen_roles = []
+
+        def committed_role(invalidated_user_id):
+            conn = get_db_connection()
+            row = conn.execute('SELECT role FROM users WHERE id = ?', (invalidated_user_id,)).fetchone()
+            conn.close()
+            seen_roles.append(row['role'])
+            return TokenCache.invalidate_user(token_cache, invalidated_user_id)
+
+        with patch('app.repository.token_cache.invalidate_user', side_effect=committed_role):
+            response = client.post("/admin/update-user-role",
+                                  headers=test_admin["headers"],
+                                  json={"user_id": user_id, "new_role": "banned"})
+
+        assert response.status_code == 200
+        assert seen_roles == ["banned"]
+
+    def test_logout_during_lookup_is_not_recached(self, client, test_user):
+        """Выход, завершившийся между SELECT и записью в кэш, не возвращает токен в кэш"""
+        from app.funcs import get_user_by_token
+        user_id = test_user["user"]["id"]
+        token = test_user["refresh_token"]
+        token_cache.invalidate(token)
+
+        def connection_then_logout():
+            conn = get_db_connection()
+            # Строка токена еще на месте, но выход успевает закоммититься и сбросить кэш
+            token_cache.invalidate_user(user_id)
+            return conn
+
+        with patch('app.funcs.get_db_connection', side_effect=connection_then_logout):
+            user = get_user_by_token(token, 'refresh')
+
+        assert user["id"] == user_id
+        assert token_cache.get(token, 'refresh') is None
+
+    def test_profile_update_refreshes_me(self, client, test_user):
+        """После обновления профиля /me возвращает новые данные"""
+        assert client.get("/me", headers=test_user["headers"]).status_code == 200
+
+        new_username = f"{test_user['user']['username']}_renamed"
+        response = client.post("/update-profile",
+                              headers=test_user["headers"],
+                              json={"username": new_username})
+        assert response.status_code == 200
+
+        response = client.get("/me", headers=test_user["headers"])
+        assert response.json()["username"] == new_username
@@ -0,0 +1,73 @@
+import pytest
+import time
+import asyncio
+from unittest.mock import patch
+
+from app.db import get_db_connection, cleanup_expired_tokens
+from app.token_sweeper import TokenSweeper
+from app import repository
+
+
+def _insert_tokens(user_id, count, expires_at):
+    conn = get_db_connection()
+    for i in range(count):
+        conn.execute(
+            'INSERT INTO user_tokens (user_id, token, expires_at, token_type) VALUES (?, ?, ?, ?)',
+            (user_id, f"sweep_{time.time()}_{i}", expires_at, 'access')
+        )
+    conn.commit()
+    conn.close()
+
+
+class TestTokenSweeper:
+    """Тесты фоновой очистки токенов"""
+
+    def test_sweep_deletes_in_batches(self, client, test_user):
+        """Просроченные токены удаляются порциями через писателя БД, живые остаются"""
+        user_id = test_user["user"]["id"]
+        _insert_tokens(user_id, 7, int(time.time()) - 60)
+
+        sweeper = TokenSweeper(interval=60, batch_size=3)
+        with patch('app.token_sweeper.run_write', side_effect=repository.run_write) as run_write:
+            deleted = asyncio.run(sweeper.sweep())
+
+        assert deleted >= 7
+        # Порции по 3 строки и очистка списка отзыва - отдельные записи
+        assert run_write.call_count >= 4
+        assert sweeper.last_deleted == deleted
+        assert sweeper.last_duration >= 0
+
+        # Токен пользователя не просрочен и продолжает работать
+        response = client.get("/me", headers=test_user["headers"])
+        assert response.status_code == 200
+
+    def test_auth_check_does_not_delete(self, client, test_user):
+        """Проверка токена больше не удаляет просроченные токены"""
+        user_id = test_user["user"]["id"]
+        _insert_tokens(user_id, 2, int(time.time()) - 60)
+
+        client.get("/me", headers=test_user["headers"])
+
+        conn = get_db_connection()
+        count = conn.execute(
+            'SELECT COUNT(*) FROM user_tokens WHERE user_id = ? AND expires_at <= ?',
+            (user_id, int(time.time()))
+        ).fetchone()[0]
+        conn.close()
+        assert count == 2
+
+        assert asyncio.run(cleanup_expired_tokens()) >= 2
+
+    def test_stats_exposed_in_metrics(self, client, test_admin):
+        """Статистика очистки доступна в /metrics"""
+        client.post("/cleanup-tokens")
+        response = client.get("/metrics", headers=test_admin["headers"])
+        assert response.status_code == 200
+        data = response.json()
+        assert "last_deleted" in data["token_sweeper"]
+        assert "token_sweeper.duration_seconds" in data["timings"]
+
+    def test_metrics_require_admin(self, client, test_user):
+        """/metrics недоступны без авторизации и обычному пользователю"""
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers=test_user["headers"]).status_code == 403
@@ -0,0 +1,110 @@
+"""
+Бенчмарк пула соединений SQLite: запросов в секунду на /me и /saved-analyses
+до (новое sqlite3.connect на каждый вызов, rollback journal) и после
+(пул настроенных соединений, WAL).
+
+Запуск из корня репозитория:
+    python tests/benchmarks/bench_db_pool.py [--requests 2000] [--analyses 200]
+
+Кэш токенов на время замера отключается, чтобы /me каждый раз ходил в БД.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'python-app'))
+
+BENCH_DIR = tempfile.mkdtemp()
+os.environ['ENVIRONMENT'] = 'test'
+os.environ['DATABASE_PATH'] = os.path.join(BENCH_DIR, 'bench.db')
+
+from fastapi.testclient import TestClient  # noqa: E402
+from main import app  # noqa: E402
+from app.config import DATABASE_PATH  # noqa: E402
+from app import db  # noqa: E402
+
+# Модули, которые импортируют get_db_connection напрямую
+MODULES_USING_DB = [
+    'app.db', 'app.funcs', 'app.signed_tokens', 'app.token_sweeper', 'app.repository',
+]
+
+def legacy_get_db_connection():
+    """Поведение до пула: новое соединение на каждый вызов"""
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def seed(client, analyses_count):
+    client.post("/register", json={"username": "bench", "email": "bench@example.com", "password": "benchpass"})
+    data = client.post("/login", json={"username": "bench", "password": "benchpass"}).json()
+
+    conn = sqlite3.connect(DATABASE_PATH)
+    user_id = data["user"]["id"]
+    conn.executemany(
+        '''INSERT INTO saved_analyses (user_id, image_path, analysis_result, ingredients_count, warnings_count)
+           VALUES (?, ?, ?, ?, ?)''',
+        [
+            (user_id, f"user_{user_id}/{i}.jpg",
+             '{"ingredients": [{"name": "milk", "is_allergen": false, "is_contraindication": false}], "warnings": []}',
+             1, 0)
+            for i in range(analyses_count)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+    return {"Authorization": f"Bearer {data['access_token']}"}
+
+def measure(client, headers, path, requests_count):
+    client.get(path, headers=headers)  # прогрев
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200, response.text
+    return requests_count / (time.perf_counter() - start)
+
+def run(mode, requests_count, analyses_count):
+    with ExitStack() as stack:
+        stack.enter_context(patch('main.create_bucket_if_not_exists'))
+        stack.enter_context(patch('app.token_cache.TokenCache.get', return_value=None))
+        if mode == 'before':
+            for module in MODULES_USING_DB:
+                stack.enter_context(patch(f'{module}.get_db_connection', legacy_get_db_connection))
+
+        client = stack.enter_context(TestClient(app))
+        if mode == 'before':
+            conn = sqlite3.connect(DATABASE_PATH)
+            conn.execute("PRAGMA journal_mode = DELETE")
+            conn.close()
+
+        headers = seed(client, analyses_count)
+        return {
+            path: measure(client, headers, path, requests_count)
+            for path in ("/me", "/saved-analyses")
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--analyses', type=int, default=200)
+    args = parser.parse_args()
+
+    before = run('before', args.requests, args.analyses)
+    # Новая БД для второго прогона, чтобы данные совпадали
+    db.close_db_pool()
+    os.unlink(DATABASE_PATH)
+    after = run('after', args.requests, args.analyses)
+    db.close_db_pool()
+
+    print(f"{'endpoint':<18}{'before, rps':>14}{'after, rps':>14}{'speedup':>10}")
+    for path in before:
+        print(f"{path:<18}{before[path]:>14.1f}{after[path]:>14.1f}{after[path] / before[path]:>9.2f}x")
+
+if __name__ == '__main__':
+    main()
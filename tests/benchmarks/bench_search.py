@@ -0,0 +1,76 @@
+"""
+Бенчмарк полнотекстового поиска по сохраненным анализам:
+задержка repository.search_saved_analyses при N анализах у одного пользователя.
+
+Запуск из корня репозитория:
+    python tests/benchmarks/bench_search.py [--analyses 100000] [--queries 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'python-app'))
+
+BENCH_DIR = tempfile.mkdtemp()
+os.environ['ENVIRONMENT'] = 'test'
+os.environ['DATABASE_PATH'] = os.path.join(BENCH_DIR, 'bench.db')
+
+from app import db, repository  # noqa: E402
+from app.ingredients import store_analysis_ingredients  # noqa: E402
+from app.search import index_analyses, build_match_query  # noqa: E402
+
+WORDS = [
+    "milk", "peanut", "sugar", "flour", "salt", "egg", "soy", "wheat", "cashew", "almond",
+    "молоко", "арахис", "сахар", "мука", "соль", "яйцо", "соя", "пшеница", "кешью", "миндаль",
+]
+
+def seed(analyses_count):
+    db.init_db()
+    rng = random.Random(42)
+    with db.get_db_connection() as conn:
+        conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('bench', 'bench@e', 'h')")
+        for analysis_id in range(1, analyses_count + 1):
+            conn.execute(
+                "INSERT INTO saved_analyses (id, user_id, image_path, analysis_result) VALUES (?, 1, 'x.png', '{}')",
+                (analysis_id,)
+            )
+            names = rng.sample(WORDS, 4) + [f"item{rng.randrange(50000)}"]
+            store_analysis_ingredients(conn, analysis_id, [(name, rng.random() < 0.1, False) for name in names])
+        index_analyses(conn, '1', ())
+
+def measure(queries_count):
+    """Задержка repository.search_saved_analyses (без HTTP) в миллисекундах"""
+    async def run():
+        samples = []
+        for i in range(queries_count):
+            q = build_match_query(WORDS[i % len(WORDS)][:3] if i % 2 else f"item{i * 37 % 50000}")
+            start = time.perf_counter()
+            await repository.search_saved_analyses(1, q, 20)
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    return asyncio.run(run())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--analyses', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.analyses)
+    print(f"Заполнено {args.analyses} анализов за {time.perf_counter() - start:.1f} с")
+
+    samples = sorted(measure(args.queries))
+    print(f"median {statistics.median(samples):.2f} мс, "
+          f"p95 {samples[int(len(samples) * 0.95) - 1]:.2f} мс, max {samples[-1]:.2f} мс")
+    db.close_db_pool()
+
+if __name__ == '__main__':
+    main()